@@ -1,6 +1,10 @@
 from django.contrib import admin
-from .models import TrafficLog
+from .models import TrafficLog, ProcessingJob, SignalSource, SignalState, ResultCacheEntry
 from .services import log_traffic_data
 # Register your models here.
 
 admin.site.register(TrafficLog)
+admin.site.register(ProcessingJob)
+admin.site.register(SignalSource)
+admin.site.register(SignalState)
+admin.site.register(ResultCacheEntry)
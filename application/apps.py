@@ -1,6 +1,18 @@
 from django.apps import AppConfig
+from django.conf import settings
 
 
 class ApplicationConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'application'
+
+    def ready(self):
+        from .detector_pool import get_detector_pool, should_warm_up
+        if should_warm_up():
+            # In the background so the server starts accepting (and answering readiness) at once
+            get_detector_pool().warm_up_in_background(getattr(settings, 'DETECTOR_WARMUP_INSTANCES', 1))
+
+        from .jobs import resume_jobs_in_background, should_resume_jobs
+        if should_resume_jobs():
+            # Jobs queued in the worker threads of a previous process were lost with it
+            resume_jobs_in_background()
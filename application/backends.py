@@ -0,0 +1,278 @@
+import os
+import numpy as np
+import cv2
+
+# COCO class ids of the vehicle classes the detector keeps
+VEHICLE_CLASS_IDS = [1, 2, 3, 5, 7]
+
+DEFAULT_MODEL_PATHS = {
+    'torch': 'yolov8n.pt',
+    'onnx': 'yolov8n.onnx',
+}
+
+
+def empty_arrays():
+    return (np.zeros((0, 4), dtype=np.float32),
+            np.zeros(0, dtype=np.int64),
+            np.zeros(0, dtype=np.float32))
+
+
+def yolo_result_arrays(result):
+    """
+    Pulls xyxy boxes, class ids and confidences out of an ultralytics
+    result as NumPy arrays with one device transfer per field.
+    """
+    boxes = result.boxes if result is not None else None
+    if boxes is None or len(boxes) == 0:
+        return empty_arrays()
+    return (boxes.xyxy.cpu().numpy().reshape(-1, 4),
+            boxes.cls.cpu().numpy().astype(np.int64).reshape(-1),
+            boxes.conf.cpu().numpy().reshape(-1))
+
+
+class TorchBackend:
+    """YOLOv8 through ultralytics/PyTorch, on CUDA when available."""
+    name = 'torch'
+
+    def __init__(self, model_path=None, device=None):
+        import torch
+        from ultralytics import YOLO
+        self.device = device or ('cuda' if torch.cuda.is_available() else 'cpu')
+        self.model = YOLO(model_path or DEFAULT_MODEL_PATHS['torch'])
+        self.model.to(self.device)
+
+    def predict(self, frames, imgsz=640, conf=0.25, iou=0.45, max_det=50, classes=VEHICLE_CLASS_IDS):
+        """
+        Detections of each frame as (xyxy, class_ids, confidences) arrays in
+        the frame's pixel coordinates, highest confidence first.
+        """
+        results = self.model(frames, conf=conf, iou=iou, imgsz=imgsz, max_det=max_det,
+                             classes=classes, verbose=False)
+        return [yolo_result_arrays(result) for result in results]
+
+
+def letterbox(image, size, auto=False, stride=32):
+    """
+    Resizes keeping the aspect ratio and pads with gray to `size` x `size`
+    (or, with `auto`, only up to the next multiple of `stride`), like
+    ultralytics' LetterBox. Returns (image, gain, (pad_x, pad_y)).
+    """
+    height, width = image.shape[:2]
+    gain = min(size / height, size / width)
+    new_width, new_height = int(round(width * gain)), int(round(height * gain))
+    pad_x, pad_y = size - new_width, size - new_height
+    if auto:
+        pad_x, pad_y = pad_x % stride, pad_y % stride
+    pad_x, pad_y = pad_x / 2, pad_y / 2
+
+    if (width, height) != (new_width, new_height):
+        image = cv2.resize(image, (new_width, new_height), interpolation=cv2.INTER_LINEAR)
+    top, bottom = int(round(pad_y - 0.1)), int(round(pad_y + 0.1))
+    left, right = int(round(pad_x - 0.1)), int(round(pad_x + 0.1))
+    image = cv2.copyMakeBorder(image, top, bottom, left, right, cv2.BORDER_CONSTANT, value=(114, 114, 114))
+    return image, gain, (left, top)
+
+
+def nms(boxes, scores, iou_threshold):
+    """Greedy non-maximum suppression; returns kept indices, highest score first."""
+    order = np.argsort(-scores, kind='stable')
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    keep = []
+    while len(order):
+        best = order[0]
+        keep.append(best)
+        rest = order[1:]
+        x1 = np.maximum(boxes[best, 0], boxes[rest, 0])
+        y1 = np.maximum(boxes[best, 1], boxes[rest, 1])
+        x2 = np.minimum(boxes[best, 2], boxes[rest, 2])
+        y2 = np.minimum(boxes[best, 3], boxes[rest, 3])
+        intersection = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+        iou = intersection / (areas[best] + areas[rest] - intersection + 1e-9)
+        order = rest[iou <= iou_threshold]
+    return np.array(keep, dtype=np.int64)
+
+
+class OnnxBackend:
+    """
+    A YOLOv8 model exported to ONNX (see `manage.py export_detector`), run
+    with ONNX Runtime. `providers` picks the execution providers, e.g.
+    ['OpenVINOExecutionProvider', 'CPUExecutionProvider'] with the
+    onnxruntime-openvino build. Pre- and post-processing follow ultralytics
+    (letterbox, best-class confidence filter, class-aware NMS) so counts
+    match the torch backend.
+    """
+    name = 'onnx'
+    device = 'cpu'
+
+    def __init__(self, model_path=None, providers=None, threads=None):
+        import onnxruntime
+        model_path = model_path or DEFAULT_MODEL_PATHS['onnx']
+        if not os.path.exists(model_path):
+            raise FileNotFoundError(f'{model_path} not found; create it with `manage.py export_detector`')
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads:
+            options.intra_op_num_threads = threads
+        self.session = onnxruntime.InferenceSession(model_path, options,
+                                                    providers=providers or ['CPUExecutionProvider'])
+        model_input = self.session.get_inputs()[0]
+        self.input_name = model_input.name
+        batch, _, height, width = model_input.shape
+        # Exported with dynamic=True the batch and image size are free; otherwise they are fixed
+        self.batch_size = batch if isinstance(batch, int) else None
+        self.input_size = height if isinstance(height, int) and height == width else None
+        self.device = self.session.get_providers()[0]
+
+    def preprocess(self, frames, imgsz):
+        size = self.input_size or imgsz
+        images = []
+        transforms = []
+        for frame in frames:
+            image, gain, pad = letterbox(frame, size, auto=self.input_size is None)
+            images.append(image)
+            transforms.append((gain, pad, frame.shape[:2]))
+        if len({image.shape for image in images}) > 1:
+            # Only possible with a dynamic model and mixed frame sizes: pad to the largest
+            height = max(image.shape[0] for image in images)
+            width = max(image.shape[1] for image in images)
+            images = [cv2.copyMakeBorder(image, 0, height - image.shape[0], 0, width - image.shape[1],
+                                         cv2.BORDER_CONSTANT, value=(114, 114, 114)) for image in images]
+        # ultralytics reverses the channel order of NumPy input; do the same for identical results
+        batch = np.ascontiguousarray(np.stack(images)[..., ::-1].transpose(0, 3, 1, 2), dtype=np.float32)
+        batch /= 255.0
+        return batch, transforms
+
+    def postprocess(self, prediction, transform, conf, iou, max_det, classes):
+        # (4 + classes, anchors) -> (anchors, 4 + classes)
+        prediction = prediction.T
+        scores = prediction[:, 4:]
+        class_ids = scores.argmax(axis=1)
+        confidences = scores[np.arange(len(scores)), class_ids]
+        keep = confidences > conf
+        if classes is not None:
+            keep &= np.isin(class_ids, classes)
+        if not keep.any():
+            return empty_arrays()
+        boxes, class_ids, confidences = prediction[keep, :4], class_ids[keep], confidences[keep]
+
+        xyxy = np.empty_like(boxes)
+        xyxy[:, :2] = boxes[:, :2] - boxes[:, 2:] / 2
+        xyxy[:, 2:] = boxes[:, :2] + boxes[:, 2:] / 2
+        # Offset boxes per class so NMS never suppresses across classes
+        kept = nms(xyxy + class_ids[:, None] * 7680.0, confidences, iou)[:max_det]
+        xyxy, class_ids, confidences = xyxy[kept], class_ids[kept], confidences[kept]
+
+        gain, (pad_x, pad_y), (height, width) = transform
+        xyxy -= np.array([pad_x, pad_y, pad_x, pad_y], dtype=xyxy.dtype)
+        xyxy /= gain
+        xyxy[:, [0, 2]] = xyxy[:, [0, 2]].clip(0, width)
+        xyxy[:, [1, 3]] = xyxy[:, [1, 3]].clip(0, height)
+        return xyxy.astype(np.float32), class_ids.astype(np.int64), confidences.astype(np.float32)
+
+    def predict(self, frames, imgsz=640, conf=0.25, iou=0.45, max_det=50, classes=VEHICLE_CLASS_IDS):
+        """Same contract as TorchBackend.predict."""
+        frames = list(frames)
+        step = self.batch_size or len(frames) or 1
+        detections = []
+        for start in range(0, len(frames), step):
+            batch, transforms = self.preprocess(frames[start:start + step], imgsz)
+            predictions = self.session.run(None, {self.input_name: batch})[0]
+            detections.extend(self.postprocess(prediction, transform, conf, iou, max_det, classes)
+                              for prediction, transform in zip(predictions, transforms))
+        return detections
+
+
+class StubBackend:
+    """
+    Deterministic fake detections without a model, for benchmarks and load
+    tests: `boxes` vehicle-sized boxes per frame drawn from a generator
+    seeded with `seed`, so runs repeat exactly and cost next to nothing.
+    """
+    name = 'stub'
+    device = 'cpu'
+
+    def __init__(self, model_path=None, boxes=8, seed=0):
+        self.boxes = boxes
+        self.rng = np.random.default_rng(seed)
+
+    def predict(self, frames, imgsz=640, conf=0.25, iou=0.45, max_det=50, classes=VEHICLE_CLASS_IDS):
+        """Same contract as TorchBackend.predict."""
+        class_ids = np.array(classes or VEHICLE_CLASS_IDS, dtype=np.int64)
+        detections = []
+        for frame in frames:
+            height, width = frame.shape[:2]
+            count = min(self.boxes, max_det)
+            sizes = self.rng.uniform(0.05, 0.15, (count, 2)) * (width, height)
+            corners = self.rng.uniform(0, 1, (count, 2)) * ((width, height) - sizes)
+            xyxy = np.hstack([corners, corners + sizes]).astype(np.float32)
+            confidences = np.sort(self.rng.uniform(conf, 1.0, count))[::-1].astype(np.float32)
+            detections.append((xyxy, self.rng.choice(class_ids, count), confidences))
+        return detections
+
+
+class SceneBackend:
+    """
+    Exact detections for clips made with synthetic.TrafficScene, without a
+    model. Vehicle sprites are the only saturated colours on the gray road,
+    so every blob of saturated pixels is one vehicle, classified by its
+    colour. The boxes are the ground truth up to codec blur at the sprite
+    edges. Blobs smaller than `min_area` pixels are compression noise.
+    With this backend, counts from the full upload pipeline can be checked
+    against TrafficScene.ground_truth().
+    """
+    name = 'scene'
+    device = 'cpu'
+
+    def __init__(self, model_path=None, min_area=24, min_saturation=90):
+        from .synthetic import SPRITES
+        self.min_area = min_area
+        self.min_saturation = min_saturation
+        self.class_ids = np.array([class_id for class_id, _, _, _ in SPRITES.values()], dtype=np.int64)
+        # Frames arrive in RGB order
+        self.colors = np.array([color[::-1] for _, color, _, _ in SPRITES.values()], dtype=np.float32)
+        self.kernel = np.ones((3, 3), dtype=np.uint8)
+
+    def predict(self, frames, imgsz=640, conf=0.25, iou=0.45, max_det=50, classes=VEHICLE_CLASS_IDS):
+        """Same contract as TorchBackend.predict."""
+        detections = []
+        for frame in frames:
+            red, green, blue = cv2.split(frame)
+            spread = cv2.subtract(cv2.max(cv2.max(red, green), blue), cv2.min(cv2.min(red, green), blue))
+            mask = cv2.morphologyEx(cv2.compare(spread, self.min_saturation, cv2.CMP_GE), cv2.MORPH_CLOSE, self.kernel)
+            _, _, stats, centroids = cv2.connectedComponentsWithStats(mask, connectivity=8)
+            keep = stats[1:, cv2.CC_STAT_AREA] >= self.min_area
+            stats, centroids = stats[1:][keep], centroids[1:][keep]
+            if not len(stats):
+                detections.append(empty_arrays())
+                continue
+
+            # The centre of a box-shaped sprite is well inside it, away from blurred edges
+            x, y = centroids[:, 0].astype(np.int64), centroids[:, 1].astype(np.int64)
+            samples = frame[y, x].astype(np.float32)
+            nearest = ((samples[:, None, :] - self.colors[None]) ** 2).sum(axis=2).argmin(axis=1)
+            class_ids = self.class_ids[nearest]
+            xyxy = np.hstack([stats[:, :2], stats[:, :2] + stats[:, 2:4]]).astype(np.float32)
+            if classes is not None:
+                wanted = np.isin(class_ids, classes)
+                xyxy, class_ids = xyxy[wanted], class_ids[wanted]
+            xyxy, class_ids = xyxy[:max_det], class_ids[:max_det]
+            detections.append((xyxy, class_ids, np.full(len(xyxy), 0.9, dtype=np.float32)))
+        return detections
+
+
+BACKENDS = {
+    'torch': TorchBackend,
+    'onnx': OnnxBackend,
+    'stub': StubBackend,
+    'scene': SceneBackend,
+}
+
+
+def load_backend(name='torch', model_path=None, **options):
+    """
+    Builds the named inference backend. Raises ImportError when its runtime
+    isn't installed.
+    """
+    if name not in BACKENDS:
+        raise ValueError(f"Invalid detector backend: {name}. Must be one of: {', '.join(BACKENDS)}")
+    return BACKENDS[name](model_path, **options)
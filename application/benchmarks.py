@@ -0,0 +1,282 @@
+import os
+import sys
+import time
+import shutil
+import platform
+import tempfile
+import subprocess
+from contextlib import contextmanager
+from datetime import datetime
+import numpy as np
+import cv2
+from django.conf import settings
+from django.db import transaction
+from django.test import Client
+from django.test.utils import override_settings
+from django.urls import reverse
+from django.utils.timezone import now
+from . import detector_pool
+from .EnhancedTrafficSignal import EnhancedTrafficSignal
+from .detecter import EnhancedVehicleDetector
+from .detector_pool import DetectorPool, build_detector
+from .geometry import AreaGeometry, get_area_geometry, load_areas, scale_points
+from .models import JunctionSignals
+from .synthetic import RESOLUTIONS, TrafficScene
+
+BENCHMARKS = ('point_in_polygon', 'detect_vehicles_in_area', 'pipeline', 'adaptive_green_time')
+
+# Detectors the detection and pipeline benchmarks run with: the deterministic
+# stub backend (pipeline overhead only) and the configured model
+DETECTORS = ('stub', 'model')
+
+# Used when signal A has no area in areas.json
+DEFAULT_AREA = [[100, 100], [1180, 100], [1180, 620], [100, 620]]
+
+
+class BenchmarkError(Exception):
+    pass
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process so far, or None where unavailable."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def summarize(latencies, items_per_call=1):
+    """
+    Throughput and latency percentiles of timed calls that each handled
+    `items_per_call` items (points, frames, signals); latencies are per item.
+    """
+    latencies = np.asarray(latencies, dtype=np.float64)
+    total = float(latencies.sum())
+    items = len(latencies) * items_per_call
+    per_item_ms = latencies / items_per_call * 1000
+    p50, p90, p99 = np.percentile(per_item_ms, [50, 90, 99])
+    return {
+        'items': items,
+        'seconds': round(total, 4),
+        'per_sec': round(items / total, 1) if total else None,
+        'p50_ms': round(float(p50), 4),
+        'p90_ms': round(float(p90), 4),
+        'p99_ms': round(float(p99), 4),
+        'max_ms': round(float(per_item_ms.max()), 4),
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+
+def timed(function, calls, warmup=1):
+    """Seconds taken by each of `calls` calls of function(index), after `warmup` untimed calls."""
+    for index in range(warmup):
+        function(index)
+    latencies = []
+    for index in range(calls):
+        started = time.perf_counter()
+        function(index)
+        latencies.append(time.perf_counter() - started)
+    return latencies
+
+
+def benchmark_area():
+    return load_areas().get('A') or DEFAULT_AREA
+
+
+def load_detector(kind, seed=0):
+    """A detector for the named DETECTORS entry; raises BenchmarkError when the model can't be loaded."""
+    if kind == 'stub':
+        return EnhancedVehicleDetector(backend='stub', backend_options={'seed': seed})
+    detector = build_detector()
+    if detector.model is None:
+        raise BenchmarkError(f"The {getattr(settings, 'DETECTOR_BACKEND', 'torch')} backend could not be loaded")
+    return detector
+
+
+@contextmanager
+def pooled_detector(detector):
+    """Makes the process-wide detector pool hand out `detector` until the block ends."""
+    previous = detector_pool._pool
+    detector_pool._pool = DetectorPool(size=1, factory=lambda: detector)
+    try:
+        yield
+    finally:
+        detector_pool._pool = previous
+
+
+def bench_point_in_polygon(points=20000, chunk=1000, seed=0, **options):
+    """
+    The per-point point_in_polygon loop against AreaGeometry.contains, as
+    processing uses it: with the geometry fetched from get_area_geometry's
+    cache for every chunk, and built from the canvas area for every chunk.
+    """
+    width, height = RESOLUTIONS['1080p']
+    area = benchmark_area()
+    polygon = scale_points(area, width, height)
+    samples = np.random.default_rng(seed).uniform(0, 1, (points, 2)) * (width, height)
+    chunks = [samples[start:start + chunk] for start in range(0, points, chunk)]
+    detector = EnhancedVehicleDetector(backend='stub')
+
+    def loop(index):
+        for point in chunks[index].tolist():
+            detector.point_in_polygon(point, polygon)
+
+    def cached(index):
+        get_area_geometry('A', width, height, area=area).contains(chunks[index])
+
+    def uncached(index):
+        AreaGeometry(scale_points(area, width, height), width, height).contains(chunks[index])
+
+    return {
+        'point_in_polygon': summarize(timed(loop, len(chunks)), chunk),
+        'point_in_polygon/area_geometry': summarize(timed(cached, len(chunks)), chunk),
+        'point_in_polygon/area_geometry_uncached': summarize(timed(uncached, len(chunks)), chunk),
+    }
+
+
+def bench_detect_vehicles_in_area(resolutions, frames=48, seed=0, detectors=DETECTORS, **options):
+    """detect_vehicles_in_area per frame, with the area geometry cached as in processing."""
+    results = {}
+    for kind in detectors:
+        try:
+            detector = load_detector(kind, seed)
+        except BenchmarkError as e:
+            results[f'detect_vehicles_in_area/{kind}'] = {'skipped': str(e)}
+            continue
+        for label in resolutions:
+            width, height = RESOLUTIONS[label]
+            scene = TrafficScene(width, height, min(frames, 8), seed=seed)
+            sample = [scene.frame(index) for index in range(scene.frames)]
+            geometry = get_area_geometry('A', width, height, area=benchmark_area())
+
+            def detect(index):
+                detector.detect_vehicles_in_area(sample[index % len(sample)], geometry)
+
+            results[f'detect_vehicles_in_area/{kind}/{label}'] = summarize(timed(detect, frames))
+    return results
+
+
+def bench_pipeline(resolutions, frames=48, repeat=3, seed=0, detectors=DETECTORS, **options):
+    """
+    Synchronous uploads of a synthetic clip through TrafficLogView: upload,
+    decode, detection, tracking, rendering, encoding and the database write.
+    Runs against a temporary media directory with the result cache off, and
+    rolls the rows back afterwards. Needs signal A's area in areas.json.
+    """
+    results = {}
+    media = tempfile.mkdtemp(prefix='benchmark-')
+    client = Client()
+    try:
+        with override_settings(MEDIA_ROOT=media, ALLOWED_HOSTS=['*'], RESULT_CACHE_ENABLED=False,
+                               VIDEO_UPLOAD_ASYNC=False):
+            clips = {}
+            for label in resolutions:
+                clips[label] = os.path.join(media, f'synthetic_{label}.mp4')
+                try:
+                    TrafficScene(*RESOLUTIONS[label], frames, seed=seed).write(clips[label])
+                except OSError as e:
+                    raise BenchmarkError(str(e))
+
+            for kind in detectors:
+                try:
+                    detector = load_detector(kind, seed)
+                except BenchmarkError as e:
+                    results[f'pipeline/{kind}'] = {'skipped': str(e)}
+                    continue
+                with pooled_detector(detector), transaction.atomic():
+                    junction = JunctionSignals.objects.create(name='benchmark')
+
+                    for label in resolutions:
+                        def upload(index):
+                            with open(clips[label], 'rb') as f:
+                                response = client.post(reverse('upload_api'), {
+                                    'video': f, 'signal_id': 'A', 'junction_id': junction.id,
+                                })
+                            if response.status_code != 200:
+                                raise BenchmarkError(f'Upload failed ({response.status_code}): {response.content[:200]}')
+
+                        results[f'pipeline/{kind}/{label}'] = summarize(timed(upload, repeat), frames)
+                    transaction.set_rollback(True)
+    finally:
+        shutil.rmtree(media, ignore_errors=True)
+    return results
+
+
+def bench_adaptive_green_time(signals=2000, updates=50, seed=0, **options):
+    """calculate_adaptive_green_time for many signals at once, one update round per timed call."""
+    rng = np.random.default_rng(seed)
+    fleet = [EnhancedTrafficSignal(f'S{index}') for index in range(signals)]
+    counts = rng.integers(0, 40, (updates + 1, signals)).tolist()
+    weights = (rng.uniform(0.3, 2.5, (updates + 1, signals)) * counts).tolist()
+    peak = datetime(2024, 1, 1, 8, 0)
+
+    def update(index):
+        for signal, count, weight in zip(fleet, counts[index], weights[index]):
+            signal.calculate_adaptive_green_time(count, weight, peak)
+
+    return {'adaptive_green_time': summarize(timed(update, updates), signals)}
+
+
+SUITE = {
+    'point_in_polygon': bench_point_in_polygon,
+    'detect_vehicles_in_area': bench_detect_vehicles_in_area,
+    'pipeline': bench_pipeline,
+    'adaptive_green_time': bench_adaptive_green_time,
+}
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=settings.BASE_DIR, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def environment():
+    return {
+        'commit': git_commit(),
+        'created_at': now().isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'numpy': np.__version__,
+        'opencv': cv2.__version__,
+        'detector_backend': getattr(settings, 'DETECTOR_BACKEND', 'torch'),
+    }
+
+
+def run_suite(names=BENCHMARKS, progress=None, **options):
+    """
+    Runs the named benchmarks and returns {'environment', 'results'} with
+    one summarize() dict (or {'skipped': reason}) per measurement.
+    """
+    results = {}
+    for name in names:
+        if progress:
+            progress(name)
+        results.update(SUITE[name](**options))
+    return {'environment': environment(), 'results': results}
+
+
+def compare_results(baseline, current):
+    """
+    (name, baseline per_sec, current per_sec, relative change, p50 change)
+    rows for measurements present in both runs.
+    """
+    rows = []
+    for name, result in current['results'].items():
+        before = baseline['results'].get(name)
+        if not before or not before.get('per_sec') or not result.get('per_sec'):
+            continue
+        rows.append((
+            name,
+            before['per_sec'],
+            result['per_sec'],
+            result['per_sec'] / before['per_sec'] - 1,
+            result['p50_ms'] / before['p50_ms'] - 1 if before['p50_ms'] else None,
+        ))
+    return rows
@@ -0,0 +1,149 @@
+import math
+from django.conf import settings
+from django.utils.timezone import now
+from .signal_state import configured_signal, get_signal_store
+from .utils import number_to_letter
+
+SIGNAL_ORDER = ['A', 'B', 'C', 'D']
+
+
+def fixed_greens(controller, demand, time_of_day=None, changed=None):
+    """Every signal gets its default green time, whatever the traffic."""
+    return {signal_id: signal.default_green_time for signal_id, signal in controller.signals.items()}
+
+
+def adaptive_greens(controller, demand, time_of_day=None, changed=None):
+    """
+    Each signal's EnhancedTrafficSignal.calculate_adaptive_green_time, with
+    its history. Signals outside `changed` (when given) keep their last
+    green, so a history only grows with new measurements.
+    """
+    return {
+        signal_id: signal.calculate_adaptive_green_time(*demand.get(signal_id, (0, 0)), time_of_day)
+        if changed is None or signal_id in changed else signal.calculated_green_time
+        for signal_id, signal in controller.signals.items()
+    }
+
+
+def proportional_greens(controller, demand, time_of_day=None, changed=None):
+    """
+    Splits the green time available in a max-length cycle in proportion to
+    each signal's traffic weight (Webster-style), within its min/max green.
+    """
+    available = controller.max_cycle - controller.lost_time()
+    total_weight = sum(weight for _, weight in demand.values())
+    greens = {}
+    for signal_id, signal in controller.signals.items():
+        weight = demand.get(signal_id, (0, 0))[1]
+        if total_weight > 0:
+            green = available * weight / total_weight
+        else:
+            green = signal.default_green_time
+        greens[signal_id] = max(signal.min_green_time, min(green, signal.max_green_time))
+    return greens
+
+
+POLICIES = {
+    'fixed': fixed_greens,
+    'adaptive': adaptive_greens,
+    'proportional': proportional_greens,
+}
+
+
+class JunctionController:
+    """
+    Turns the green times of a junction's EnhancedTrafficSignals into a
+    cycle plan: phases in signal order, each green followed by yellow and
+    all-red, with greens scaled down (not below min green) when the cycle
+    would exceed `max_cycle` seconds.
+
+    `policy` names a function in POLICIES that maps
+    {signal_id: (vehicle_count, traffic_weight)} to desired green times.
+    `signals` are the signals to plan with, e.g. from the SignalStateStore;
+    by default fresh ones with their config.json limits are used.
+    """
+
+    def __init__(self, junction_id=None, signal_ids=SIGNAL_ORDER, policy='adaptive', max_cycle=None, signals=None):
+        if policy not in POLICIES:
+            raise ValueError(f"Invalid policy: {policy}. Must be one of: {', '.join(POLICIES)}")
+        self.junction_id = junction_id
+        self.policy = policy
+        self.max_cycle = max_cycle or getattr(settings, 'SIGNAL_MAX_CYCLE', 120)
+        self.signals = signals or {signal_id: configured_signal(signal_id) for signal_id in signal_ids}
+
+    def lost_time(self):
+        return sum(signal.yellow_time + signal.all_red_time for signal in self.signals.values())
+
+    def plan(self, time_of_day=None, demand=None, greens=None, changed=None):
+        """
+        Computes the next cycle from `demand`, or from already decided
+        `greens`; `changed` optionally names the signals with new demand.
+        The policy's greens are kept as each signal's calculated_green_time. Returns {'policy', 'cycle_length',
+        'lost_time', 'phases': [...]} where each phase has signal_id, start,
+        green, yellow and all_red in seconds.
+        """
+        if greens is None:
+            greens = POLICIES[self.policy](self, demand or {}, time_of_day, changed)
+            for signal_id, green in greens.items():
+                self.signals[signal_id].calculated_green_time = int(round(green))
+
+        lost_time = self.lost_time()
+        total_green = sum(greens.values())
+        available = self.max_cycle - lost_time
+        if total_green > available > 0:
+            # Scale the part above min green down so the cycle fits
+            minimum = sum(self.signals[signal_id].min_green_time for signal_id in greens)
+            extra = total_green - minimum
+            factor = max(0.0, (available - minimum) / extra) if extra > 0 else 0.0
+            # Rounded down to the 0.1 s the plan is given in, so the rounded greens still fit
+            greens = {
+                signal_id: math.floor(10 * (self.signals[signal_id].min_green_time
+                                            + (green - self.signals[signal_id].min_green_time) * factor) + 1e-6) / 10
+                for signal_id, green in greens.items()
+            }
+
+        phases = []
+        start = 0.0
+        for signal_id, signal in self.signals.items():
+            green = round(greens[signal_id], 1)
+            phases.append({
+                'signal_id': signal_id,
+                'start': round(start, 1),
+                'green': green,
+                'yellow': signal.yellow_time,
+                'all_red': signal.all_red_time,
+            })
+            start += green + signal.yellow_time + signal.all_red_time
+        return {
+            'policy': self.policy,
+            'cycle_length': round(start, 1),
+            'lost_time': lost_time,
+            'phases': phases,
+        }
+
+
+def plan_junction(junction_id, logs, policy=None):
+    """
+    Cycle plan of a junction from the latest log of each signal
+    ({numeric signal_id: TrafficLog}), using the shared signal state. The
+    policy only runs when a signal has a log that wasn't planned with yet,
+    and only those signals' history grows; otherwise the stored greens are
+    reused, so repeated polls don't skew the adaptive timing.
+    """
+    policy = policy or getattr(settings, 'SIGNAL_CONTROL_POLICY', 'adaptive')
+    store = get_signal_store()
+    latest = {number_to_letter(signal_id): log for signal_id, log in logs.items()}
+
+    signals = store.signals(junction_id, SIGNAL_ORDER)
+    if all(signals[signal_id].last_log_id == log.id for signal_id, log in latest.items()):
+        controller = JunctionController(junction_id, policy=policy, signals=signals)
+        return controller.plan(greens={signal_id: signal.calculated_green_time for signal_id, signal in signals.items()})
+
+    def replan(signals):
+        changed = [signal_id for signal_id, log in latest.items() if signals[signal_id].last_log_id != log.id]
+        for signal_id in changed:
+            signals[signal_id].last_log_id = latest[signal_id].id
+        demand = {signal_id: (log.vehicle_count, log.traffic_weight) for signal_id, log in latest.items()}
+        return JunctionController(junction_id, policy=policy, signals=signals).plan(now(), demand, changed=changed)
+
+    return store.update(junction_id, SIGNAL_ORDER, replan)
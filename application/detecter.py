@@ -1,24 +1,32 @@
-import torch
 import numpy as np
 import cv2
+from .backends import VEHICLE_CLASS_IDS, empty_arrays, load_backend
+from .geometry import AreaGeometry, geometry_for_points, points_in_polygon
+from .metrics import NULL_TIMER
 
-try:
-    from ultralytics import YOLO
-    YOLO_AVAILABLE = True
-except ImportError:
-    YOLO_AVAILABLE = False
+# Traffic weight of one vehicle of each class
+VEHICLE_WEIGHTS = {
+    'car': 1.0,
+    'truck': 2.5,
+    'bus': 2.0,
+    'motorcycle': 0.5,
+    'bicycle': 0.3
+}
 
 class EnhancedVehicleDetector:
-    def __init__(self):
+    # Model thresholds (also part of the result cache key)
+    confidence_threshold = 0.25
+    iou_threshold = 0.45
+    max_detections = 50
+
+    def __init__(self, roi_crop=False, roi_padding=32, imgsz=640, backend='torch', model_path=None,
+                 backend_options=None):
+        # Inference backend (see backends.py); None runs simulated detection
         self.model = None
+        # Why the backend failed to load, if it did
+        self.load_error = None
         self.vehicle_classes = ['car', 'truck', 'bus', 'motorcycle', 'bicycle']
-        self.vehicle_weights = {
-            'car': 1.0,
-            'truck': 2.5,
-            'bus': 2.0,
-            'motorcycle': 0.5,
-            'bicycle': 0.3
-        }
+        self.vehicle_weights = dict(VEHICLE_WEIGHTS)
         self.coco_vehicle_classes = {
             2: 'car',
             3: 'motorcycle',
@@ -26,43 +34,48 @@ class EnhancedVehicleDetector:
             7: 'truck',
             1: 'bicycle'
         }
-        self.device = 'cuda' if torch.cuda.is_available() else 'cpu'
-        print(f"Using device: {self.device}")
+        # Lookup tables for vectorized counting: COCO class id -> vehicle_classes index
+        self._class_lookup = np.full(max(self.coco_vehicle_classes) + 1, -1, dtype=np.int64)
+        for class_id, class_name in self.coco_vehicle_classes.items():
+            self._class_lookup[class_id] = self.vehicle_classes.index(class_name)
+        self._class_weights = np.array([self.vehicle_weights.get(name, 1.0) for name in self.vehicle_classes])
+        # Detections centered closer than this (in pixels, per axis) are treated as duplicates
+        self.duplicate_radius = 30
+        # Inference on the area's bounding box (plus padding) instead of the full frame
+        self.roi_crop = roi_crop
+        self.roi_padding = roi_padding
+        self.imgsz = imgsz
+        self.backend = backend
+        self.model_path = model_path
+        self.backend_options = backend_options or {}
+        self.device = 'cpu'
+        # StageTimer of the video being processed (set by whoever leased the detector)
+        self.timer = NULL_TIMER
         self.load_yolo_model()
 
     def load_yolo_model(self):
-        if YOLO_AVAILABLE:
-            try:
-                self.model = YOLO("yolov8n.pt")
-                self.model.to(self.device)
-                print("✅ YOLOv8 model loaded successfully")
-                return True
-            except Exception as e:
-                print(f"Error loading YOLOv8 model: {e}")
-        else:
-            print("YOLOv8 not available. Using simulated detection.")
-        return False
+        # The backend's runtime (torch, onnxruntime) is only imported here, so importing this module stays cheap
+        try:
+            self.model = load_backend(self.backend, self.model_path, **self.backend_options)
+        except ImportError as e:
+            self.load_error = f"{self.backend} backend not available: {e}"
+            print(f"YOLOv8 not available ({self.backend} backend: {e}). Using simulated detection.")
+            return False
+        except Exception as e:
+            self.load_error = f"Error loading {self.backend} backend: {e}"
+            print(f"Error loading YOLOv8 model: {e}")
+            return False
+        self.device = self.model.device
+        print(f"Using device: {self.device}")
+        print(f"✅ YOLOv8 model loaded successfully ({self.backend} backend)")
+        return True
 
     def point_in_polygon(self, point, polygon):
-        x, y = point
-        n = len(polygon)
-        inside = False
-        p1x, p1y = polygon[0]
-        for i in range(1, n + 1):
-            p2x, p2y = polygon[i % n]
-            if y > min(p1y, p2y):
-                if y <= max(p1y, p2y):
-                    if x <= max(p1x, p2x):
-                        if p1y != p2y:
-                            xinters = (y - p1y) * (p2x - p1x) / (p2y - p1y) + p1x
-                        if p1x == p2x or x <= xinters:
-                            inside = not inside
-            p1x, p1y = p2x, p2y
-        return inside
-
-    def simulate_detection(self, frame, mask):
+        return bool(points_in_polygon([point], polygon)[0])
+
+    def simulate_detection(self, frame, mask, annotate=True):
         vehicle_type_counts = {key: 0 for key in self.vehicle_classes}
-        processed_frame = frame.copy()
+        processed_frame = frame.copy() if annotate else None
         height, width = frame.shape[:2]
         num_vehicles = np.random.randint(1, 12)
         total_weight = 0
@@ -76,6 +89,8 @@ class EnhancedVehicleDetector:
             confidence = np.random.uniform(0.5, 0.95)
             vehicle_type_counts[class_name] += 1
             total_weight += self.vehicle_weights.get(class_name, 1.0)
+            if not annotate:
+                continue
             color = {
                 'car': (0, 255, 0),
                 'truck': (255, 0, 0),
@@ -90,76 +105,226 @@ class EnhancedVehicleDetector:
 
         return num_vehicles, total_weight, processed_frame, vehicle_type_counts
 
-    def detect_vehicles_in_area(self, frame, area_points, draw_area=True):
+    def detect_vehicles_in_area(self, frame, area_points, draw_area=True, imgsz=None, roi_crop=None, annotate=True):
         if frame is None:
             return 0, 0, None, {key: 0 for key in self.vehicle_classes}
+        return self.detect_vehicles_batch([frame], area_points, draw_area, imgsz=imgsz,
+                                          roi_crop=roi_crop, annotate=annotate)[0]
+
+    def detect_vehicles_batch(self, frames, area_points, draw_area=True, imgsz=None, roi_crop=None, annotate=True):
+        """
+        Runs detection on several frames with a single model call.
+
+        `frames` may be a list of BGR frames or a stacked (N, H, W, 3) array.
+        `area_points` is a list of frame-space points or a cached AreaGeometry.
+        `imgsz` and `roi_crop` override the detector's defaults for this call.
+        With annotate=False nothing is copied or drawn and processed_frame is None.
+        Returns one (vehicle_count, traffic_weight, processed_frame,
+        vehicle_type_counts) tuple per frame, in input order.
+        """
+        frames = list(frames)
+        if not frames:
+            return []
 
         try:
-            mask = np.zeros(frame.shape[:2], dtype=np.uint8)
-            area_points_np = np.array(area_points, dtype=np.int32)
-            cv2.fillPoly(mask, [area_points_np], 255)
-            processed_frame = frame.copy()
-
-            if draw_area:
-                cv2.polylines(processed_frame, [area_points_np], True, (0, 255, 255), 3)
-                cv2.putText(processed_frame, "Detection Area",
-                            (area_points_np[0][0], area_points_np[0][1] - 10),
-                            cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 255), 2)
-
-            vehicle_counts = {key: 0 for key in self.vehicle_classes}
-
-            if self.model is not None:
-                frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-                results = self.model(frame_rgb, conf=0.25, iou=0.45,
-                                     max_det=50, classes=[1, 2, 3, 5, 7], verbose=False)
-
-                vehicle_count = 0
-                traffic_weight = 0
-                detected_centers = []
-
-                for result in results:
-                    boxes = result.boxes
-                    if boxes is not None:
-                        for box in boxes:
-                            x1, y1, x2, y2 = box.xyxy[0].cpu().numpy()
-                            x, y = int((x1 + x2) / 2), int((y1 + y2) / 2)
-                            if self.point_in_polygon((x, y), area_points):
-                                if any(abs(x - cx) < 30 and abs(y - cy) < 30 for cx, cy in detected_centers):
-                                    continue
-                                detected_centers.append((x, y))
-                                class_id = int(box.cls[0].cpu().numpy())
-                                confidence = float(box.conf[0].cpu().numpy())
-                                if class_id in self.coco_vehicle_classes:
-                                    class_name = self.coco_vehicle_classes[class_id]
-                                    vehicle_count += 1
-                                    traffic_weight += self.vehicle_weights.get(class_name, 1.0)
-                                    vehicle_counts[class_name] += 1
-                                    color = {
-                                        'car': (0, 255, 0),
-                                        'truck': (255, 0, 0),
-                                        'bus': (255, 165, 0),
-                                        'motorcycle': (0, 255, 255),
-                                        'bicycle': (255, 0, 255)
-                                    }.get(class_name, (0, 255, 0))
-                                    cv2.rectangle(processed_frame, (int(x1), int(y1)), (int(x2), int(y2)), color, 2)
-                                    label = f"{class_name}: {confidence:.2f}"
-                                    (label_w, label_h), _ = cv2.getTextSize(label, cv2.FONT_HERSHEY_SIMPLEX, 0.5, 2)
-                                    cv2.rectangle(processed_frame, (int(x1), int(y1 - 20)),
-                                                  (int(x1 + label_w), int(y1)), color, -1)
-                                    cv2.putText(processed_frame, label, (int(x1), int(y1 - 5)),
-                                                cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 2)
-
-                cv2.rectangle(processed_frame, (10, 10), (150, 35), (0, 0, 0), -1)
-                cv2.putText(processed_frame, f"Vehicles: {vehicle_count}", (15, 30),
-                            cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 255), 2)
-                cv2.rectangle(processed_frame, (10, 40), (200, 65), (0, 0, 0), -1)
-                cv2.putText(processed_frame, f"Traffic Weight: {traffic_weight:.1f}", (15, 60),
-                            cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 255), 2)
-
-                return vehicle_count, traffic_weight, processed_frame, vehicle_counts
-
-            return self.simulate_detection(frame, mask)
+            if self.model is None:
+                return [self.simulate_detection(frame, None, annotate=annotate) for frame in frames]
+
+            height, width = frames[0].shape[:2]
+            geometry = self.area_geometry(area_points, width, height)
+
+            use_roi = self.roi_crop if roi_crop is None else roi_crop
+            x1, y1, x2, y2 = self.inference_region(geometry) if use_roi else (0, 0, width, height)
+            with self.timer.stage('color_conversion'):
+                frames_rgb = [cv2.cvtColor(frame[y1:y2, x1:x2], cv2.COLOR_BGR2RGB) for frame in frames]
+            with self.timer.stage('inference'):
+                results = self.model.predict(frames_rgb, imgsz=imgsz or self.imgsz,
+                                             conf=self.confidence_threshold, iou=self.iou_threshold,
+                                             max_det=self.max_detections, classes=VEHICLE_CLASS_IDS)
+            self.timer.count('detections', sum(len(xyxy) for xyxy, _, _ in results))
 
+            return [self._process_result(frame, result, geometry, draw_area, offset=(x1, y1), annotate=annotate)
+                    for frame, result in zip(frames, results)]
+
+        except Exception as e:
+            print(f"Error in vehicle detection: {e}")
+            self.timer.count('detection_errors')
+            return [(0, 0, frame if annotate else None, {key: 0 for key in self.vehicle_classes}) for frame in frames]
+
+    def detect_objects_batch(self, frames, area_points, imgsz=None, roi_crop=None):
+        """
+        Per-frame vehicle detections for the tracker. Unlike
+        detect_vehicles_batch, boxes outside the area are kept too so
+        entries and exits can be seen.
+        Returns one (xyxy, class_ids, confidences, inside) tuple of arrays
+        per frame, in input order.
+        """
+        frames = list(frames)
+        if not frames:
+            return []
+
+        height, width = frames[0].shape[:2]
+        geometry = self.area_geometry(area_points, width, height)
+        try:
+            if self.model is None:
+                detections = [self.simulate_objects(frame) for frame in frames]
+            else:
+                use_roi = self.roi_crop if roi_crop is None else roi_crop
+                x1, y1, x2, y2 = self.inference_region(geometry) if use_roi else (0, 0, width, height)
+                with self.timer.stage('color_conversion'):
+                    frames_rgb = [cv2.cvtColor(frame[y1:y2, x1:x2], cv2.COLOR_BGR2RGB) for frame in frames]
+                with self.timer.stage('inference'):
+                    results = self.model.predict(frames_rgb, imgsz=imgsz or self.imgsz,
+                                                 conf=self.confidence_threshold, iou=self.iou_threshold,
+                                                 max_det=self.max_detections, classes=VEHICLE_CLASS_IDS)
+                self.timer.count('detections', sum(len(xyxy) for xyxy, _, _ in results))
+                offset = np.array([x1, y1, x1, y1], dtype=np.float32)
+                detections = [(xyxy + offset, class_ids, confidences) for xyxy, class_ids, confidences in results]
         except Exception as e:
             print(f"Error in vehicle detection: {e}")
-            return 0, 0, frame, {key: 0 for key in self.vehicle_classes}
\ No newline at end of file
+            self.timer.count('detection_errors')
+            detections = [empty_arrays() for _ in frames]
+
+        output = []
+        with self.timer.stage('polygon_filter'):
+            for xyxy, class_ids, confidences in detections:
+                keep = self.filter_detections(xyxy, class_ids, geometry, inside_only=False)
+                xyxy, class_ids, confidences = xyxy[keep], class_ids[keep], confidences[keep]
+                centers = ((xyxy[:, :2] + xyxy[:, 2:]) / 2).astype(np.int64)
+                output.append((xyxy, class_ids, confidences, geometry.contains(centers)))
+        return output
+
+    def simulate_objects(self, frame):
+        """Random vehicle boxes in the same array form as a backend's predict, for running without a model."""
+        height, width = frame.shape[:2]
+        num_vehicles = np.random.randint(1, 12)
+        x = np.random.randint(0, width - 100, num_vehicles)
+        y = np.random.randint(0, height - 60, num_vehicles)
+        w = np.random.randint(80, 120, num_vehicles)
+        h = np.random.randint(40, 80, num_vehicles)
+        xyxy = np.stack([x, y, x + w, y + h], axis=1).astype(np.float32)
+        class_ids = np.random.choice(list(self.coco_vehicle_classes), num_vehicles).astype(np.int64)
+        confidences = np.random.uniform(0.5, 0.95, num_vehicles).astype(np.float32)
+        return xyxy, class_ids, confidences
+
+    def inference_region(self, geometry):
+        """The area's bounding box grown by roi_padding and clipped to the frame, as (x1, y1, x2, y2)."""
+        x1, y1, x2, y2 = geometry.bbox
+        pad = self.roi_padding
+        return (max(0, x1 - pad), max(0, y1 - pad),
+                min(geometry.width, x2 + pad), min(geometry.height, y2 + pad))
+
+    def area_geometry(self, area, width, height):
+        """Accepts an AreaGeometry or a list of frame-space points."""
+        if isinstance(area, AreaGeometry):
+            return area
+        return geometry_for_points(area, width, height)
+
+    def filter_detections(self, xyxy, class_ids, geometry, inside_only=True):
+        """
+        Returns the indices of boxes whose center lies inside the area,
+        dropping boxes centered within `duplicate_radius` pixels of an
+        earlier kept box, and keeping only vehicle classes.
+        With inside_only=False boxes outside the area are kept as well.
+        """
+        if len(xyxy) == 0:
+            return np.zeros(0, dtype=np.int64)
+
+        centers = ((xyxy[:, :2] + xyxy[:, 2:]) / 2).astype(np.int64)
+        if inside_only:
+            candidates = np.flatnonzero(geometry.contains(centers))
+        else:
+            candidates = np.arange(len(xyxy))
+
+        # Greedy suppression in detection (confidence) order
+        if len(candidates) > 1:
+            pts = centers[candidates]
+            close = (np.abs(pts[:, None, :] - pts[None, :, :]) < self.duplicate_radius).all(axis=2)
+            keep = np.zeros(len(candidates), dtype=bool)
+            for i in range(len(candidates)):
+                keep[i] = not (close[i, :i] & keep[:i]).any()
+            candidates = candidates[keep]
+
+        return candidates[self.class_index(class_ids[candidates]) >= 0]
+
+    def class_index(self, class_ids):
+        """Maps COCO class ids to positions in vehicle_classes (-1 for non-vehicles)."""
+        class_ids = np.asarray(class_ids, dtype=np.int64)
+        valid = (class_ids >= 0) & (class_ids < len(self._class_lookup))
+        index = np.full(len(class_ids), -1, dtype=np.int64)
+        index[valid] = self._class_lookup[class_ids[valid]]
+        return index
+
+    def summarize_detections(self, class_ids):
+        index = self.class_index(class_ids)
+        index = index[index >= 0]
+        per_class = np.bincount(index, minlength=len(self.vehicle_classes))
+        vehicle_counts = {name: int(per_class[i]) for i, name in enumerate(self.vehicle_classes)}
+        traffic_weight = float(self._class_weights[index].sum())
+        return int(len(index)), traffic_weight, vehicle_counts
+
+    def _process_result(self, frame, detections, geometry, draw_area, offset=(0, 0), annotate=True):
+        xyxy, class_ids, confidences = detections
+        if offset != (0, 0):
+            # Boxes from a cropped inference region back to frame coordinates
+            xyxy = xyxy + np.array([offset[0], offset[1], offset[0], offset[1]], dtype=xyxy.dtype)
+        with self.timer.stage('polygon_filter'):
+            keep = self.filter_detections(xyxy, class_ids, geometry)
+        xyxy, class_ids, confidences = xyxy[keep], class_ids[keep], confidences[keep]
+        vehicle_count, traffic_weight, vehicle_counts = self.summarize_detections(class_ids)
+
+        if not annotate:
+            return vehicle_count, traffic_weight, None, vehicle_counts
+
+        processed_frame = self.annotate_frame(frame, geometry, xyxy, class_ids, confidences,
+                                              vehicle_count, traffic_weight, draw_area)
+        return vehicle_count, traffic_weight, processed_frame, vehicle_counts
+
+    def annotate_frame(self, frame, geometry, xyxy, class_ids, confidences, vehicle_count, traffic_weight,
+                       draw_area=True, track_ids=None):
+        """
+        Draws the area, the kept boxes and the count/weight overlay on a copy
+        of the frame. With `track_ids` each label carries the vehicle's track id.
+        """
+        with self.timer.stage('drawing'):
+            return self._draw(frame, geometry, xyxy, class_ids, confidences, vehicle_count, traffic_weight,
+                              draw_area, track_ids)
+
+    def _draw(self, frame, geometry, xyxy, class_ids, confidences, vehicle_count, traffic_weight,
+              draw_area, track_ids):
+        area_points_np = geometry.polygon
+        processed_frame = frame.copy()
+
+        if draw_area:
+            cv2.polylines(processed_frame, [area_points_np], True, (0, 255, 255), 3)
+            cv2.putText(processed_frame, "Detection Area",
+                        (int(area_points_np[0][0]), int(area_points_np[0][1] - 10)),
+                        cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 255), 2)
+
+        if track_ids is None:
+            track_ids = [None] * len(xyxy)
+        for (x1, y1, x2, y2), class_id, confidence, track_id in zip(xyxy, class_ids, confidences, track_ids):
+            class_name = self.coco_vehicle_classes[int(class_id)]
+            color = {
+                'car': (0, 255, 0),
+                'truck': (255, 0, 0),
+                'bus': (255, 165, 0),
+                'motorcycle': (0, 255, 255),
+                'bicycle': (255, 0, 255)
+            }.get(class_name, (0, 255, 0))
+            cv2.rectangle(processed_frame, (int(x1), int(y1)), (int(x2), int(y2)), color, 2)
+            label = f"{class_name}: {confidence:.2f}" if track_id is None else f"{class_name} #{track_id}: {confidence:.2f}"
+            (label_w, label_h), _ = cv2.getTextSize(label, cv2.FONT_HERSHEY_SIMPLEX, 0.5, 2)
+            cv2.rectangle(processed_frame, (int(x1), int(y1 - 20)),
+                          (int(x1 + label_w), int(y1)), color, -1)
+            cv2.putText(processed_frame, label, (int(x1), int(y1 - 5)),
+                        cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 2)
+
+        cv2.rectangle(processed_frame, (10, 10), (150, 35), (0, 0, 0), -1)
+        cv2.putText(processed_frame, f"Vehicles: {vehicle_count}", (15, 30),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 255), 2)
+        cv2.rectangle(processed_frame, (10, 40), (200, 65), (0, 0, 0), -1)
+        cv2.putText(processed_frame, f"Traffic Weight: {traffic_weight:.1f}", (15, 60),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 255), 2)
+
+        return processed_frame
@@ -0,0 +1,223 @@
+import os
+import sys
+import time
+import threading
+from contextlib import contextmanager
+import numpy as np
+from django.conf import settings
+from .geometry import CANVAS_HEIGHT, CANVAS_WIDTH
+
+# Servers and manage.py commands that run detection; warm-up only runs in these by default
+SERVER_PROGRAMS = ('gunicorn', 'uvicorn', 'daphne', 'hypercorn')
+WORKER_COMMANDS = ('run_jobs', 'ingest_streams')
+
+# Full-canvas detection area used for the warm-up inference
+WARMUP_AREA = [[0, 0], [CANVAS_WIDTH, 0], [CANVAS_WIDTH, CANVAS_HEIGHT], [0, CANVAS_HEIGHT]]
+
+
+def backend_options(backend):
+    """Runtime options of a detector backend from settings."""
+    if backend == 'onnx':
+        return {
+            'providers': getattr(settings, 'DETECTOR_ONNX_PROVIDERS', None),
+            'threads': getattr(settings, 'DETECTOR_ONNX_THREADS', None),
+        }
+    return {}
+
+
+def build_detector(backend=None, model_path=None):
+    """A detector with the DETECTOR_BACKEND (or given) inference backend."""
+    from .detecter import EnhancedVehicleDetector
+    backend = backend or getattr(settings, 'DETECTOR_BACKEND', 'torch')
+    return EnhancedVehicleDetector(
+        roi_padding=getattr(settings, 'DETECTION_ROI_PADDING', 32),
+        backend=backend,
+        model_path=model_path or getattr(settings, 'DETECTOR_MODEL_PATH', None),
+        backend_options=backend_options(backend),
+    )
+
+
+class DetectorUnavailable(RuntimeError):
+    """Raised instead of handing out a detector whose model failed to load."""
+
+
+def load_error(detector):
+    """
+    Why `detector` has no model, or None when it has one. Without a model
+    detections are simulated, which is only wanted with the stub backend.
+    """
+    if detector.model is not None or detector.backend == 'stub':
+        return None
+    return detector.load_error or f'{detector.backend} backend did not load'
+
+
+class DetectorPool:
+    """
+    Warm EnhancedVehicleDetector instances shared by the threads of one
+    process. Nothing is loaded until a detector is first leased (or
+    warm_up() runs); then at most `size` instances are created and reused.
+    The YOLO predictor keeps per-call state, so each instance is leased to
+    one caller at a time and other callers wait for it.
+    """
+
+    def __init__(self, size=None, factory=build_detector):
+        self.size = max(1, size or getattr(settings, 'DETECTOR_POOL_SIZE', None) or getattr(settings, 'JOB_WORKERS', 2))
+        self.factory = factory
+        self.state = 'cold'  # cold -> warming -> ready, or failed
+        self.error = None
+        self.warmup_seconds = None
+        self._idle = []
+        self._created = 0
+        self._condition = threading.Condition()
+
+    def reserve(self, count):
+        """Grows the pool to at least `count` instances, for callers that hold a detector for long."""
+        with self._condition:
+            self.size = max(self.size, count)
+            self._condition.notify_all()
+
+    def acquire(self, timeout=None):
+        """
+        Leases an idle detector, or creates one while the pool is below its
+        size. Raises DetectorUnavailable when a new detector's model failed
+        to load, except with the stub backend.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._condition:
+            while not self._idle and self._created >= self.size:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    raise TimeoutError(f'No detector became free within {timeout} seconds')
+                self._condition.wait(remaining)
+            if self._idle:
+                return self._idle.pop()
+            self._created += 1
+
+        # Model loading happens outside the lock so leases of warm instances aren't held up
+        try:
+            detector = self.factory()
+        except Exception:
+            with self._condition:
+                self._created -= 1
+                self._condition.notify()
+            raise
+        error = load_error(detector)
+        if error:
+            # Not kept: it could only simulate detections. The next caller tries to load it again.
+            with self._condition:
+                self._created -= 1
+                self._condition.notify()
+            self.state = 'failed'
+            self.error = error
+            print(f"[ERROR] Detector model did not load: {error}")
+            raise DetectorUnavailable(error)
+        if self.state == 'cold':
+            self.state = 'ready'
+        return detector
+
+    def release(self, detector):
+        with self._condition:
+            self._idle.append(detector)
+            self._condition.notify()
+
+    @contextmanager
+    def lease(self, timeout=None):
+        """Context manager lending a detector to the caller."""
+        detector = self.acquire(timeout)
+        try:
+            yield detector
+        finally:
+            self.release(detector)
+
+    def warm_up(self, instances=1):
+        """
+        Loads `instances` detectors and runs one inference with each on a
+        blank frame, so the first real request doesn't pay for the model
+        load and the first (slow) forward pass. Returns True on success;
+        a detector whose model failed to load fails the warm-up.
+        """
+        self.state = 'warming'
+        started = time.monotonic()
+        detectors = []
+        try:
+            for _ in range(min(max(1, instances), self.size)):
+                detectors.append(self.acquire())
+            frame = np.zeros((CANVAS_HEIGHT, CANVAS_WIDTH, 3), dtype=np.uint8)
+            for detector in detectors:
+                detector.detect_objects_batch([frame], WARMUP_AREA, imgsz=getattr(settings, 'DETECTION_IMGSZ', 640))
+        except Exception as e:
+            self.state = 'failed'
+            self.error = str(e)
+            print(f"[ERROR] Detector warm-up failed: {e}")
+            return False
+        finally:
+            for detector in detectors:
+                self.release(detector)
+        self.warmup_seconds = round(time.monotonic() - started, 3)
+        self.state = 'ready'
+        self.error = None
+        print(f"[INFO] {len(detectors)} detector(s) warmed up in {self.warmup_seconds}s")
+        return True
+
+    def warm_up_in_background(self, instances=1):
+        self.state = 'warming'
+        thread = threading.Thread(target=self.warm_up, args=(instances,), daemon=True, name='detector-warmup')
+        thread.start()
+        return thread
+
+    def status(self):
+        """
+        Readiness of the pool. 'cold' counts as ready: the model will load
+        on first use. Not ready while warming up, after a failed warm-up or
+        once a detector came up without its model.
+        """
+        with self._condition:
+            loaded = self._created
+            idle = len(self._idle)
+        return {
+            'ready': self.state in ('cold', 'ready'),
+            'state': self.state,
+            'size': self.size,
+            'loaded': loaded,
+            'in_use': loaded - idle,
+            'warmup_seconds': self.warmup_seconds,
+            'error': self.error,
+        }
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_detector_pool():
+    """The process-wide DetectorPool."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = DetectorPool()
+    return _pool
+
+
+def is_server_process(argv=None):
+    """Whether this process serves requests or jobs, as opposed to e.g. migrate or shell."""
+    argv = sys.argv if argv is None else argv
+    command = argv[1] if len(argv) > 1 else ''
+    if command == 'runserver':
+        # With the autoreloader only the child process (RUN_MAIN) serves requests
+        return os.environ.get('RUN_MAIN') == 'true' or '--noreload' in argv
+    return command in WORKER_COMMANDS or any(name in (argv[0] if argv else '') for name in SERVER_PROGRAMS)
+
+
+def should_warm_up():
+    """
+    DETECTOR_WARMUP: True/False forces warm-up at startup on or off; None
+    warms up server and worker processes that run detection themselves.
+    """
+    configured = getattr(settings, 'DETECTOR_WARMUP', None)
+    if configured is not None:
+        return bool(configured)
+    if not is_server_process():
+        return False
+    command = sys.argv[1] if len(sys.argv) > 1 else ''
+    # Web servers only detect in-process when jobs run in their worker threads
+    return command in WORKER_COMMANDS or getattr(settings, 'JOB_RUN_IN_PROCESS', True)
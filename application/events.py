@@ -0,0 +1,211 @@
+import json
+import asyncio
+import threading
+import time
+from datetime import timedelta
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import close_old_connections, transaction
+from django.db.models import Max
+from django.utils.module_loading import import_string
+from django.utils.timezone import now
+from .models import BrokerEvent
+from .services import signal_stats
+from .utils import number_to_letter
+
+
+def junction_topic(junction_id):
+    return f'junction.{junction_id}'
+
+
+class Subscription:
+    """
+    A subscriber's queue of events, read on its asyncio loop. Events may be
+    delivered from any thread; when the queue is full the oldest event is
+    dropped so a slow client can't hold memory.
+    """
+
+    def __init__(self, broker, topic, loop, max_queued=100):
+        self.broker = broker
+        self.topic = topic
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize=max_queued)
+
+    def deliver(self, event):
+        try:
+            self.loop.call_soon_threadsafe(self._put, event)
+        except RuntimeError:
+            # The client's loop is gone
+            self.close()
+
+    def _put(self, event):
+        if self.queue.full():
+            self.queue.get_nowait()
+        self.queue.put_nowait(event)
+
+    async def get(self, timeout=None):
+        return await asyncio.wait_for(self.queue.get(), timeout)
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+class InProcessBroker:
+    """
+    Fans published events out to subscribers in this process. Events
+    published by other processes (run_jobs workers, ingest_streams, signal
+    worker processes) are not seen; use DatabaseBroker when those run
+    separately from the web server.
+    """
+
+    def __init__(self):
+        self._subscribers = {}
+        self._lock = threading.Lock()
+
+    def publish(self, topic, event):
+        self.deliver(topic, event)
+
+    def deliver(self, topic, event):
+        with self._lock:
+            subscribers = list(self._subscribers.get(topic, ()))
+        for subscription in subscribers:
+            subscription.deliver(event)
+
+    def subscribe(self, topic, loop=None, max_queued=100):
+        subscription = Subscription(self, topic, loop or asyncio.get_running_loop(), max_queued)
+        with self._lock:
+            self._subscribers.setdefault(topic, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.topic)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[subscription.topic]
+
+    def has_subscribers(self):
+        with self._lock:
+            return bool(self._subscribers)
+
+
+class DatabaseBroker(InProcessBroker):
+    """
+    Cross-process stand-in for an external broker. publish() inserts a
+    BrokerEvent row; each web process runs one poller thread that reads new
+    rows every EVENT_POLL_INTERVAL seconds, while it has subscribers, and
+    fans them out locally. Rows older than EVENT_RETENTION seconds are
+    deleted by the poller.
+
+    Ids are taken at insert but rows become visible at commit, so a row can
+    show up after rows with higher ids. Each poll reads again from
+    EVENT_POLL_OVERLAP ids below the highest delivered one and skips the
+    ids it already delivered.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.poll_interval = getattr(settings, 'EVENT_POLL_INTERVAL', 0.5)
+        self.retention = getattr(settings, 'EVENT_RETENTION', 300)
+        self.overlap = getattr(settings, 'EVENT_POLL_OVERLAP', 100)
+        self._poller = None
+        self._poller_lock = threading.Lock()
+        self._last_id = None
+        self._delivered = set()  # delivered ids within the overlap window
+        self._last_cleanup = time.monotonic()
+
+    def publish(self, topic, event):
+        BrokerEvent.objects.create(topic=topic, payload=event)
+
+    def subscribe(self, topic, loop=None, max_queued=100):
+        with self._poller_lock:
+            if self._poller is None:
+                self._poller = threading.Thread(target=self._poll, daemon=True, name='event-poller')
+                self._poller.start()
+        return super().subscribe(topic, loop, max_queued)
+
+    def _poll(self):
+        while True:
+            time.sleep(self.poll_interval)
+            try:
+                close_old_connections()
+                self.poll_once()
+            except Exception as e:
+                print(f"[ERROR] Event poller failed: {e}")
+
+    def poll_once(self):
+        """Deletes expired rows when due and delivers the rows committed since the previous poll."""
+        if time.monotonic() - self._last_cleanup > self.retention:
+            BrokerEvent.objects.filter(created_at__lt=now() - timedelta(seconds=self.retention)).delete()
+            self._last_cleanup = time.monotonic()
+        if not self.has_subscribers():
+            # Nobody listening: skip ahead instead of replaying a backlog later
+            self._last_id = None
+            return
+        if self._last_id is None:
+            self._last_id = BrokerEvent.objects.aggregate(last=Max('id'))['last'] or 0
+            self._delivered = set(BrokerEvent.objects.filter(
+                id__gt=self._last_id - self.overlap).values_list('id', flat=True))
+            return
+
+        rows = BrokerEvent.objects.filter(
+            id__gt=self._last_id - self.overlap
+        ).exclude(id__in=self._delivered).order_by('id')[:500]
+        for row in rows:
+            self.deliver(row.topic, row.payload)
+            self._delivered.add(row.id)
+            self._last_id = max(self._last_id, row.id)
+        self._delivered = {row_id for row_id in self._delivered if row_id > self._last_id - self.overlap}
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker():
+    """The process-wide broker named by EVENT_BROKER."""
+    global _broker
+    with _broker_lock:
+        if _broker is None:
+            _broker = import_string(getattr(settings, 'EVENT_BROKER', 'application.events.InProcessBroker'))()
+    return _broker
+
+
+def publish_event(junction_id, event_type, data):
+    """
+    Publishes an event to a junction's subscribers once the current
+    transaction commits. Publishing never raises into the caller.
+    """
+    if junction_id is None:
+        return
+    # Round-trip through JSON so datetimes etc. survive any broker
+    event = json.loads(json.dumps({
+        'type': event_type,
+        'junction_id': int(junction_id),
+        'time': now(),
+        'data': data,
+    }, cls=DjangoJSONEncoder))
+
+    def send():
+        try:
+            get_broker().publish(junction_topic(junction_id), event)
+        except Exception as e:
+            print(f"[ERROR] Failed to publish {event_type} event: {e}")
+
+    transaction.on_commit(send)
+
+
+def publish_traffic_logs(logs):
+    """Publishes a traffic_log event with the dashboard stats of each log."""
+    for log in logs:
+        publish_event(log.junction_id, 'traffic_log', {
+            'log_id': log.id,
+            'timestamp': log.timestamp,
+            'signal': signal_stats(number_to_letter(log.signal_id), log),
+        })
+
+
+def format_sse(event):
+    """One event in text/event-stream framing, named after its type."""
+    return f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
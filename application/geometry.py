@@ -0,0 +1,151 @@
+import os
+import json
+import threading
+from functools import lru_cache
+import numpy as np
+import cv2
+
+AREAS_PATH = os.path.join(os.path.dirname(__file__), 'areas.json')
+SIGNAL_LETTERS = ['A', 'B', 'C', 'D']
+
+# Frontend canvas size the detection areas are drawn on
+CANVAS_WIDTH = 640
+CANVAS_HEIGHT = 360
+
+
+def scale_points(points, actual_width, actual_height):
+    return [
+        [int(p[0] * actual_width / CANVAS_WIDTH), int(p[1] * actual_height / CANVAS_HEIGHT)]
+        for p in points
+    ]
+
+
+def polygon_edges(polygon):
+    """The per-edge arrays points_in_polygon tests against, for reuse across calls."""
+    polygon = np.asarray(polygon, dtype=np.float64).reshape(-1, 2)
+    p1x, p1y = polygon[:, 0], polygon[:, 1]
+    p2x, p2y = np.roll(p1x, -1), np.roll(p1y, -1)
+    return (p1x, p1y, np.minimum(p1y, p2y), np.maximum(p1y, p2y), np.maximum(p1x, p2x),
+            p1x == p2x, p2x - p1x, p2y - p1y)
+
+
+def points_in_polygon(points, polygon, edges=None):
+    """
+    Ray-casts every point against every polygon edge at once, returned as a
+    boolean array. A point is inside when a ray to its right crosses an odd
+    number of edges. `edges` are polygon_edges(polygon) when precomputed.
+    """
+    p1x, p1y, ymin, ymax, xmax, vertical, dx, dy = polygon_edges(polygon) if edges is None else edges
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    x, y = points[:, 0:1], points[:, 1:2]
+    crosses = (y > ymin) & (y <= ymax) & (x <= xmax)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        xinters = (y - p1y) * dx / dy + p1x
+    crosses &= vertical | (x <= xinters)
+    return (np.count_nonzero(crosses, axis=1) % 2) == 1
+
+
+class AreaGeometry:
+    """
+    A detection area scaled to one frame size, with everything per-frame
+    code needs precomputed: the int32 polygon, the bounding box and the
+    edge arrays used for containment tests.
+    """
+
+    def __init__(self, points, width, height):
+        self.points = [[int(x), int(y)] for x, y in points]
+        self.width = width
+        self.height = height
+        self.polygon = np.array(self.points, dtype=np.int32)
+
+        x, y, w, h = cv2.boundingRect(self.polygon)
+        self.bbox = (max(x, 0), max(y, 0), min(x + w, width), min(y + h, height))
+        self._edges = polygon_edges(self.polygon)
+
+    def contains(self, points):
+        """Boolean array telling which (x, y) points lie inside the area."""
+        return points_in_polygon(points, self.polygon, self._edges)
+
+
+@lru_cache(maxsize=64)
+def _geometry_for_key(points_key, width, height):
+    return AreaGeometry(points_key, width, height)
+
+
+def geometry_for_points(points, width, height):
+    """AreaGeometry for already-scaled frame coordinates, memoized on the points."""
+    return _geometry_for_key(tuple((int(x), int(y)) for x, y in points), width, height)
+
+
+_lock = threading.Lock()
+_areas = None
+_areas_mtime = None
+_geometry_cache = {}
+
+
+def _normalize_areas(data):
+    # Older files store a plain list of polygons in A, B, C, D order
+    if isinstance(data, list):
+        return {SIGNAL_LETTERS[i]: area for i, area in enumerate(data) if i < len(SIGNAL_LETTERS)}
+    return {str(key).upper(): area for key, area in data.items()}
+
+
+def load_areas():
+    """
+    Returns {signal_id: canvas points} from areas.json. The file is read once
+    and re-read only when its modification time changes, so edits made by
+    another process are picked up too.
+    """
+    global _areas, _areas_mtime
+    with _lock:
+        try:
+            mtime = os.path.getmtime(AREAS_PATH)
+        except OSError:
+            _areas, _areas_mtime = {}, None
+            return {}
+        if _areas is None or mtime != _areas_mtime:
+            with open(AREAS_PATH, 'r') as f:
+                _areas = _normalize_areas(json.load(f))
+            _areas_mtime = mtime
+        return dict(_areas)
+
+
+def save_areas(areas):
+    with open(AREAS_PATH, 'w') as f:
+        json.dump(areas, f, indent=4)
+    invalidate_area_cache()
+
+
+def get_area_geometry(signal_id, width, height, area=None):
+    """
+    Cached AreaGeometry for a signal at a frame size. `area` (canvas points)
+    defaults to the signal's entry in areas.json; a cached entry built from
+    different points is rebuilt.
+    """
+    if area is None:
+        area = load_areas().get(signal_id)
+        if area is None:
+            return None
+    source = tuple((float(x), float(y)) for x, y in area)
+    key = (signal_id, width, height)
+    with _lock:
+        cached = _geometry_cache.get(key)
+        if cached is not None and cached[0] == source:
+            return cached[1]
+    geometry = AreaGeometry(scale_points(area, width, height), width, height)
+    with _lock:
+        _geometry_cache[key] = (source, geometry)
+    return geometry
+
+
+def invalidate_area_cache(signal_id=None):
+    """Drops cached geometry for one signal, or for all signals and the areas file."""
+    global _areas, _areas_mtime
+    with _lock:
+        if signal_id is None:
+            _geometry_cache.clear()
+            _areas, _areas_mtime = None, None
+            return
+        for key in [key for key in _geometry_cache if key[0] == signal_id]:
+            del _geometry_cache[key]
+        _areas, _areas_mtime = None, None
@@ -0,0 +1,199 @@
+import json
+import math
+from datetime import datetime, timezone
+from django.db import IntegrityError, transaction
+from django.utils.dateparse import parse_datetime
+from django.utils.timezone import is_naive, make_aware, now
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser
+from .detecter import VEHICLE_WEIGHTS
+from .events import publish_traffic_logs
+from .models import TrafficLog
+from .processing import efficiency_score
+from .rollups import record_logs
+from .utils import letter_to_number
+
+# Record field -> TrafficLog field for per-class counts
+CLASS_FIELDS = {
+    'car': 'Car',
+    'truck': 'Truck',
+    'bus': 'Bus',
+    'motorcycle': 'Motorcycle',
+    'bicycle': 'Bicycle',
+}
+
+
+class IngestError(Exception):
+    """Raised for a malformed batch. `errors` lists the problems per record."""
+
+    def __init__(self, message, errors=None):
+        super().__init__(message)
+        self.errors = errors or []
+
+
+class JSONLinesParser(BaseParser):
+    """
+    Parses newline-delimited JSON, one record per line. The batch's
+    device_id and junction_id are given as query parameters.
+    """
+    media_type = 'application/x-ndjson'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        records = []
+        for number, line in enumerate(stream.read().decode('utf-8').splitlines(), start=1):
+            if not line.strip():
+                continue
+            try:
+                records.append(json.loads(line))
+            except ValueError as e:
+                raise ParseError(f'Line {number}: {e}')
+        return {'records': records}
+
+
+def batch_records(data):
+    """
+    Records of a payload, from either a `records` list of objects or a
+    columnar `columns` dict of equal-length lists.
+    """
+    if 'columns' in data:
+        columns = data['columns']
+        if not isinstance(columns, dict) or not columns:
+            raise IngestError('columns must be an object of equal-length lists')
+        lengths = {len(values) for values in columns.values() if isinstance(values, list)}
+        if len(lengths) != 1 or not all(isinstance(values, list) for values in columns.values()):
+            raise IngestError('columns must be an object of equal-length lists')
+        names = list(columns)
+        return [dict(zip(names, row)) for row in zip(*columns.values())]
+
+    records = data.get('records')
+    if not isinstance(records, list):
+        raise IngestError('Payload must contain a records list or a columns object')
+    return records
+
+
+def parse_timestamp(value):
+    if value is None or value == '':
+        return now()
+    if isinstance(value, bool):
+        raise ValueError(f'invalid timestamp {value!r}')
+    if isinstance(value, (int, float)):
+        try:
+            return datetime.fromtimestamp(value, tz=timezone.utc)
+        except (OverflowError, OSError, ValueError):
+            # Out of the platform's range, or NaN
+            raise ValueError(f'invalid timestamp {value!r}')
+    parsed = parse_datetime(str(value))
+    if parsed is None:
+        raise ValueError(f'invalid timestamp {value!r}')
+    return make_aware(parsed) if is_naive(parsed) else parsed
+
+
+def parse_number(record, name, default, cast=int, minimum=0):
+    """
+    A numeric field of a record, or `default` when it is missing. Booleans,
+    NaN, infinities and values below `minimum` (None for no limit) are
+    rejected.
+    """
+    value = record.get(name)
+    if value is None or value == '':
+        return default
+    if isinstance(value, bool):
+        raise ValueError(f'{name} must be a number, not {value!r}')
+    try:
+        number = cast(value)
+    except OverflowError:
+        raise ValueError(f'{name} must be finite')
+    if not math.isfinite(number):
+        raise ValueError(f'{name} must be finite')
+    if minimum is not None and number < minimum:
+        raise ValueError(f'{name} must not be negative')
+    return number
+
+
+def parse_signal(value):
+    if isinstance(value, bool):
+        raise ValueError(f'invalid signal_id {value!r}')
+    if isinstance(value, str) and value.isdigit():
+        value = int(value)
+    if isinstance(value, int) and 1 <= value <= 4:
+        return value
+    letter = str(value).upper()
+    if letter not in ('A', 'B', 'C', 'D'):
+        raise ValueError(f'invalid signal_id {value!r}')
+    return letter_to_number(letter)
+
+
+def build_log(record, device_id, junction_id):
+    """An unsaved TrafficLog for one record. Raises ValueError/TypeError on bad fields."""
+    if not isinstance(record, dict):
+        raise ValueError('record must be an object')
+    if record.get('sequence') is None:
+        raise ValueError('sequence is required')
+    sequence = parse_number(record, 'sequence', None, minimum=None)
+    class_counts = {name: parse_number(record, name, 0) for name in CLASS_FIELDS}
+    vehicle_count = parse_number(record, 'vehicle_count', sum(class_counts.values()))
+    traffic_weight = parse_number(record, 'traffic_weight', None, cast=float)
+    if traffic_weight is None:
+        traffic_weight = sum(VEHICLE_WEIGHTS[name] * count for name, count in class_counts.items())
+
+    return TrafficLog(
+        junction_id=junction_id,
+        device_id=device_id,
+        sequence=sequence,
+        signal_id=parse_signal(record.get('signal_id')),
+        timestamp=parse_timestamp(record.get('timestamp')),
+        vehicle_count=vehicle_count,
+        traffic_weight=traffic_weight,
+        green_time=parse_number(record, 'green_time', 10),
+        efficiency_score=efficiency_score(vehicle_count, traffic_weight),
+        entries=parse_number(record, 'entries', 0),
+        exits=parse_number(record, 'exits', 0),
+        avg_dwell_time=parse_number(record, 'avg_dwell_time', 0.0, cast=float),
+        **{field: class_counts[name] for name, field in CLASS_FIELDS.items()}
+    )
+
+
+def ingest_records(device_id, junction_id, records):
+    """
+    Validates a batch of per-interval count records from an edge device
+    and stores the new ones with one bulk_create, together with their
+    rollups, in one transaction. Records whose (device_id, sequence) is
+    already stored are skipped, so a retried batch is harmless.
+    Returns (created_logs, duplicate_count).
+    """
+    logs = []
+    errors = []
+    for index, record in enumerate(records):
+        try:
+            logs.append(build_log(record, device_id, junction_id))
+        except (ValueError, TypeError, OverflowError, OSError) as e:
+            errors.append({'index': index, 'error': str(e)})
+    if errors:
+        raise IngestError(f'{len(errors)} invalid record(s)', errors)
+
+    # The last copy of a sequence repeated inside the batch wins
+    by_sequence = {log.sequence: log for log in logs}
+
+    for attempt in range(2):
+        try:
+            with transaction.atomic():
+                existing = set(TrafficLog.objects.filter(
+                    device_id=device_id, sequence__in=list(by_sequence)
+                ).values_list('sequence', flat=True))
+                new_logs = [log for sequence, log in sorted(by_sequence.items()) if sequence not in existing]
+                created = TrafficLog.objects.bulk_create(new_logs, batch_size=500)
+                record_logs(created)
+            break
+        except IntegrityError:
+            # A concurrent retry of the same batch got in first; the re-check skips its rows
+            if attempt:
+                raise
+
+    # One live update per signal is enough for dashboards
+    latest = {}
+    for log in created:
+        if log.signal_id not in latest or log.timestamp >= latest[log.signal_id].timestamp:
+            latest[log.signal_id] = log
+    publish_traffic_logs(latest.values())
+
+    return created, len(logs) - len(created)
@@ -0,0 +1,263 @@
+import sys
+import time
+import threading
+from datetime import timedelta
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, transaction
+from django.utils.timezone import now
+from .detector_pool import WORKER_COMMANDS, is_server_process
+from .events import publish_event, publish_traffic_logs
+from .metrics import FAILURES, JOBS, record_timings
+from .models import ProcessingJob, TrafficLog
+from .processing import count_frames, process_signal_video, render_traffic_log
+from .rollups import rebuild_rollups
+from .workers import process_signals_in_pool, signal_worker_count
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """Lazily starts the in-process worker pool (JOB_WORKERS threads)."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'JOB_WORKERS', 2),
+                thread_name_prefix='video-job'
+            )
+    return _executor
+
+
+def create_job(junction_id, inputs, options, kind=ProcessingJob.KIND_ANALYZE):
+    return ProcessingJob.objects.create(junction_id=junction_id, inputs=inputs, options=options, kind=kind)
+
+
+def enqueue_job(job):
+    """
+    Hands a queued job to the local worker pool once its row is committed.
+    With JOB_RUN_IN_PROCESS disabled the job stays queued in the database
+    for `manage.py run_jobs` workers to pick up.
+    """
+    if getattr(settings, 'JOB_RUN_IN_PROCESS', True):
+        transaction.on_commit(lambda: get_executor().submit(_run_in_worker, job.id))
+
+
+def _run_in_worker(job_id):
+    close_old_connections()
+    try:
+        run_job(job_id)
+    except Exception as e:
+        print(f"[ERROR] Job {job_id} crashed: {e}")
+    finally:
+        close_old_connections()
+
+
+def claim_job(job_id):
+    """Atomically moves a job from queued to running. Returns False if another worker got it first."""
+    return ProcessingJob.objects.filter(
+        id=job_id, status=ProcessingJob.STATUS_QUEUED
+    ).update(status=ProcessingJob.STATUS_RUNNING, started_at=now(), updated_at=now()) == 1
+
+
+def requeue_stale_jobs(stale_after=None):
+    """
+    Puts running jobs whose row hasn't been touched for `stale_after`
+    seconds (JOB_STALE_SECONDS) back in the queue: their worker died or
+    lost the database. Running jobs update their row at least every second
+    while they make progress. Returns the number of requeued jobs.
+    """
+    stale_after = stale_after or getattr(settings, 'JOB_STALE_SECONDS', 600)
+    return ProcessingJob.objects.filter(
+        status=ProcessingJob.STATUS_RUNNING, updated_at__lt=now() - timedelta(seconds=stale_after)
+    ).update(status=ProcessingJob.STATUS_QUEUED, progress=0.0, started_at=None, updated_at=now())
+
+
+def discard_job_logs(job_id):
+    """
+    Deletes the TrafficLog rows, and their processed videos, that an earlier
+    run of the job wrote before it was interrupted, and rebuilds the rollups
+    they were counted in, so a requeued job doesn't count its videos twice.
+    Returns the number of deleted logs.
+    """
+    logs = list(TrafficLog.objects.filter(job_id=job_id))
+    if not logs:
+        return 0
+    for log in logs:
+        if log.processed_videos:
+            log.processed_videos.delete(save=False)
+    TrafficLog.objects.filter(id__in=[log.id for log in logs]).delete()
+    timestamps = [log.timestamp for log in logs]
+    rebuild_rollups(min(timestamps), max(timestamps))
+    print(f"[INFO] Discarded {len(logs)} log(s) of an earlier run of job {job_id}")
+    return len(logs)
+
+
+def resume_jobs(stale_after=None):
+    """
+    Hands jobs left behind by a restart to the local worker pool: running
+    jobs gone stale are requeued, then every queued job is submitted.
+    Workers claim jobs atomically, so several server processes resuming at
+    once run each job only once. Returns the number of submitted jobs.
+    """
+    requeued = requeue_stale_jobs(stale_after)
+    if requeued:
+        print(f"[INFO] Requeued {requeued} abandoned job(s)")
+    queued = list(ProcessingJob.objects.filter(
+        status=ProcessingJob.STATUS_QUEUED
+    ).order_by('created_at').values_list('id', flat=True))
+    for job_id in queued:
+        get_executor().submit(_run_in_worker, job_id)
+    return len(queued)
+
+
+def should_resume_jobs():
+    """Web server processes that run jobs in their own worker threads pick up left-over jobs at startup."""
+    command = sys.argv[1] if len(sys.argv) > 1 else ''
+    return (getattr(settings, 'JOB_RUN_IN_PROCESS', True) and is_server_process()
+            and command not in WORKER_COMMANDS)
+
+
+def resume_jobs_in_background():
+    """
+    Resumes left-over jobs at startup, then keeps requeueing jobs whose
+    worker thread died every JOB_STALE_SECONDS, like `run_jobs` does.
+    """
+    interval = getattr(settings, 'JOB_STALE_SECONDS', 600)
+
+    def loop():
+        while True:
+            close_old_connections()
+            try:
+                resume_jobs()
+            except Exception as e:
+                print(f"[WARN] Could not resume queued jobs: {e}")
+            finally:
+                close_old_connections()
+            time.sleep(interval)
+
+    thread = threading.Thread(target=loop, daemon=True, name='job-resume')
+    thread.start()
+    return thread
+
+
+def claim_next_job():
+    queued = ProcessingJob.objects.filter(
+        status=ProcessingJob.STATUS_QUEUED
+    ).order_by('created_at').values_list('id', flat=True)[:10]
+    for job_id in queued:
+        if claim_job(job_id):
+            return job_id
+    return None
+
+
+class ProgressReporter:
+    """
+    Turns per-video frame counts into an overall job percentage and writes it
+    to the job row, and publishes it to the junction's live subscribers, at
+    most once per `interval` seconds.
+    """
+
+    def __init__(self, job_id, frame_totals, interval=1.0, junction_id=None):
+        self.job_id = job_id
+        self.junction_id = junction_id
+        self.frame_totals = frame_totals
+        self.total = max(sum(frame_totals), 1)
+        self.interval = interval
+        self.offset = 0
+        self.last_write = 0.0
+
+    def start_video(self, index):
+        self.offset = sum(self.frame_totals[:index])
+
+    def __call__(self, frames_done):
+        self.report(self.offset + frames_done)
+
+    def report(self, frames_done):
+        current = time.monotonic()
+        if current - self.last_write < self.interval:
+            return
+        self.last_write = current
+        percent = min(99.0, 100.0 * frames_done / self.total)
+        ProcessingJob.objects.filter(id=self.job_id).update(progress=round(percent, 1), updated_at=now())
+        publish_event(self.junction_id, 'job', {
+            'job_id': str(self.job_id), 'status': ProcessingJob.STATUS_RUNNING, 'progress': round(percent, 1)
+        })
+
+
+def run_job(job_id, claimed=False, raise_errors=False):
+    """
+    Processes every video of a job in order and stores the per-signal results.
+    Returns the refreshed job, or None if the job was claimed elsewhere.
+    """
+    if not claimed and not claim_job(job_id):
+        return None
+
+    results = []
+    try:
+        # Inside the try, so a database or broker error here fails the job instead of leaving it running
+        job = ProcessingJob.objects.get(id=job_id)
+        publish_job(job)
+        reporter = ProgressReporter(job.id, [count_frames(default_storage.path(item['video'])) for item in job.inputs],
+                                    junction_id=job.junction_id)
+        if job.kind == ProcessingJob.KIND_ANALYZE:
+            discard_job_logs(job.id)
+        if job.kind == ProcessingJob.KIND_RENDER:
+            for index, item in enumerate(job.inputs):
+                reporter.start_video(index)
+                results.append(render_traffic_log(item['log_id'], job.options, progress_callback=reporter))
+        elif len(job.inputs) > 1 and signal_worker_count() > 1:
+            # One worker process per signal stream
+            process_signals_in_pool(job, reporter, results)
+        else:
+            for index, item in enumerate(job.inputs):
+                reporter.start_video(index)
+                results.append(process_signal_video(
+                    item['video'], item['signal_id'], job.junction_id, item['area'], job.options,
+                    progress_callback=reporter, content_hash=item.get('content_hash'), job_id=job.id
+                ))
+    except Exception as e:
+        print(f"[ERROR] Job {job_id} failed: {e}")
+        FAILURES.inc(stage='job')
+        JOBS.inc(status=ProcessingJob.STATUS_FAILED)
+        ProcessingJob.objects.filter(id=job_id).update(
+            status=ProcessingJob.STATUS_FAILED, error=str(e), result=results,
+            finished_at=now(), updated_at=now()
+        )
+        job = ProcessingJob.objects.get(id=job_id)
+        # The videos that did finish keep their logs and are reported in the job result
+        publish_traffic_logs(TrafficLog.objects.filter(id__in=[item['log_id'] for item in results]).order_by('id'))
+        publish_job(job)
+        if raise_errors:
+            raise
+        return job
+
+    for item, result in zip(job.inputs, results):
+        if 'timings' not in result:
+            continue
+        if item.get('upload_seconds') is not None:
+            result['timings']['seconds']['upload_write'] = item['upload_seconds']
+        record_timings(result['timings'], cached=result.get('cached', False))
+    JOBS.inc(status=ProcessingJob.STATUS_COMPLETED)
+
+    ProcessingJob.objects.filter(id=job.id).update(
+        status=ProcessingJob.STATUS_COMPLETED, progress=100.0, result=results,
+        finished_at=now(), updated_at=now()
+    )
+    job.refresh_from_db()
+    # Logs may have been written by worker processes, so publish them from here
+    publish_traffic_logs(TrafficLog.objects.filter(id__in=[item['log_id'] for item in results]).order_by('id'))
+    publish_job(job)
+    return job
+
+
+def publish_job(job):
+    publish_event(job.junction_id, 'job', {
+        'job_id': str(job.id),
+        'kind': job.kind,
+        'status': job.status,
+        'progress': job.progress,
+        'error': job.error,
+    })
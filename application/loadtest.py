@@ -0,0 +1,236 @@
+import os
+import json
+import time
+import uuid
+import threading
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from .synthetic import TrafficScene
+
+SIGNALS = ('A', 'B', 'C', 'D')
+
+# Seconds between job status polls of one upload
+JOB_POLL_INTERVAL = 0.25
+
+
+def encode_multipart(fields, files):
+    """
+    multipart/form-data body of `fields` [(name, value)] and `files`
+    [(name, filename, bytes)]; returns (body, content type).
+    """
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields:
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+    for name, filename, content in files:
+        parts.append(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+            f'Content-Type: video/mp4\r\n\r\n'.encode() + content + b'\r\n'
+        )
+    parts.append(f'--{boundary}--\r\n'.encode())
+    return b''.join(parts), f'multipart/form-data; boundary={boundary}'
+
+
+def request(method, url, body=None, headers=None, timeout=60):
+    """
+    (status, parsed JSON body or None, seconds) of one HTTP request. Error
+    responses are returned like any other. Connection failures come back as
+    status 0.
+    """
+    started = time.perf_counter()
+    req = urllib.request.Request(url, data=body, headers=headers or {}, method=method)
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as response:
+            status, content = response.status, response.read()
+    except urllib.error.HTTPError as e:
+        status, content = e.code, e.read()
+    except (urllib.error.URLError, OSError) as e:
+        return 0, {'error': str(getattr(e, 'reason', e))}, time.perf_counter() - started
+    seconds = time.perf_counter() - started
+    try:
+        return status, json.loads(content), seconds
+    except ValueError:
+        return status, None, seconds
+
+
+def latency_summary(latencies, wall_seconds):
+    """Requests per wall-clock second and latency percentiles of one kind of request."""
+    if not latencies:
+        return {'requests': 0}
+    per_request_ms = np.asarray(latencies, dtype=np.float64) * 1000
+    p50, p90, p99 = np.percentile(per_request_ms, [50, 90, 99])
+    return {
+        'requests': len(latencies),
+        'per_sec': round(len(latencies) / wall_seconds, 2) if wall_seconds else None,
+        'p50_ms': round(float(p50), 1),
+        'p90_ms': round(float(p90), 1),
+        'p99_ms': round(float(p99), 1),
+        'max_ms': round(float(per_request_ms.max()), 1),
+    }
+
+
+def make_clips(directory, uploads, signals, area_polygons, width, height, frames, lanes=4, rate=0.5,
+               seed=0, counting_mode='tracked', min_hits=1):
+    """
+    Writes one synthetic clip per signal per upload to `directory`. Every
+    clip has its own seed, so no upload is answered by the result cache.
+    Returns a list with one {signal_id: (path, expected vehicle_count)}
+    dict per upload. The expected count comes from the scene's ground
+    truth and the signal's area, counting vehicles seen in at least
+    `min_hits` frames, or is None when the signal has no area.
+    """
+    clips = []
+    for upload in range(uploads):
+        clip_set = {}
+        for offset, signal_id in enumerate(signals):
+            clip_seed = seed + upload * len(SIGNALS) + offset
+            scene = TrafficScene(width, height, frames, lanes=lanes, rate=rate, seed=clip_seed)
+            path = os.path.join(directory, f'loadtest_{clip_seed}.mp4')
+            scene.write(path)
+            expected = None
+            if area_polygons.get(signal_id):
+                truth = scene.ground_truth(area_polygons[signal_id], min_hits=min_hits)
+                expected = truth['frame_vehicle_count' if counting_mode == 'frames' else 'vehicle_count']
+            clip_set[signal_id] = (path, expected)
+        clips.append(clip_set)
+    return clips
+
+
+class LoadTest:
+    """
+    Sends `len(clips)` multi-signal uploads to /api/log/ from `concurrency`
+    threads. Each upload is followed to its finished job, while `pollers`
+    threads poll /api/latest-stats/ like open dashboards. The server is
+    only reached over HTTP, so it can be any deployment. For meaningful
+    counts it runs with DETECTOR_BACKEND = 'scene' and the same areas.json.
+    """
+
+    def __init__(self, base_url, junction_id, clips, concurrency=4, pollers=2, poll_interval=1.0,
+                 options=None, timeout=300):
+        self.base_url = base_url.rstrip('/') + '/'
+        self.junction_id = junction_id
+        self.clips = clips
+        self.concurrency = concurrency
+        self.pollers = pollers
+        self.poll_interval = poll_interval
+        self.options = dict(options or {})
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+        self.upload_latencies = []
+        self.job_latencies = []
+        self.poll_latencies = []
+        self.errors = {}
+        self.counts = []  # (signal_id, expected, counted) per processed video
+        self.frames = 0
+
+    def url(self, path):
+        return urllib.parse.urljoin(self.base_url, path)
+
+    def error(self, kind, status):
+        with self._lock:
+            key = f'{kind}:{status}'
+            self.errors[key] = self.errors.get(key, 0) + 1
+
+    def upload(self, index):
+        clip_set = self.clips[index]
+        fields = [('junction_id', self.junction_id)] + [(name, value) for name, value in self.options.items()]
+        fields += [('signal_id', signal_id) for signal_id in clip_set]
+        files = []
+        for signal_id, (path, _) in clip_set.items():
+            with open(path, 'rb') as f:
+                files.append(('video', os.path.basename(path), f.read()))
+        body, content_type = encode_multipart(fields, files)
+
+        started = time.perf_counter()
+        status, payload, seconds = request('POST', self.url('api/log/'), body, {'Content-Type': content_type},
+                                           self.timeout)
+        with self._lock:
+            self.upload_latencies.append(seconds)
+        if status == 200:
+            results = payload
+        elif status == 202:
+            results = self.wait_for_job(payload['status_url'], started)
+            if results is None:
+                return
+        else:
+            self.error('upload', status)
+            return
+
+        with self._lock:
+            self.job_latencies.append(time.perf_counter() - started)
+            for result in results:
+                expected = clip_set.get(result.get('signal_id'), (None, None))[1]
+                self.counts.append((result.get('signal_id'), expected, result.get('vehicle_count')))
+                self.frames += result.get('frames_analyzed') or 0
+
+    def wait_for_job(self, status_url, started):
+        """Polls a queued job until it finishes; returns its results, or None when it failed."""
+        while time.perf_counter() - started < self.timeout:
+            time.sleep(JOB_POLL_INTERVAL)
+            status, payload, _ = request('GET', status_url, timeout=self.timeout)
+            if status != 200:
+                self.error('job_status', status)
+                return None
+            if payload['status'] == 'completed':
+                return payload['results']
+            if payload['status'] == 'failed':
+                self.error('job', payload.get('error') or 'failed')
+                return None
+        self.error('job', 'timeout')
+        return None
+
+    def poll(self):
+        url = self.url(f'api/latest-stats/?junction_id={self.junction_id}')
+        while not self._done.is_set():
+            status, _, seconds = request('GET', url, timeout=self.timeout)
+            with self._lock:
+                self.poll_latencies.append(seconds)
+            if status != 200:
+                self.error('latest_stats', status)
+            self._done.wait(self.poll_interval)
+
+    def run(self):
+        """Runs the test and returns the report dict."""
+        pollers = [threading.Thread(target=self.poll, daemon=True) for _ in range(self.pollers)]
+        started = time.perf_counter()
+        for thread in pollers:
+            thread.start()
+        try:
+            with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+                list(executor.map(self.upload, range(len(self.clips))))
+        finally:
+            self._done.set()
+            for thread in pollers:
+                thread.join()
+        wall_seconds = time.perf_counter() - started
+        return self.report(wall_seconds)
+
+    def report(self, wall_seconds):
+        videos = len(self.counts)
+        checked = [(expected, counted) for _, expected, counted in self.counts
+                   if expected is not None and counted is not None]
+        errors = [abs(counted - expected) for expected, counted in checked]
+        return {
+            'base_url': self.base_url,
+            'concurrency': self.concurrency,
+            'pollers': self.pollers,
+            'seconds': round(wall_seconds, 2),
+            'videos': videos,
+            'videos_per_sec': round(videos / wall_seconds, 3) if wall_seconds else None,
+            'frames_per_sec': round(self.frames / wall_seconds, 1) if wall_seconds else None,
+            'uploads': latency_summary(self.upload_latencies, wall_seconds),
+            'jobs': latency_summary(self.job_latencies, wall_seconds),
+            'latest_stats': latency_summary(self.poll_latencies, wall_seconds),
+            'errors': dict(self.errors),
+            'counts': {
+                'checked': len(checked),
+                'exact': sum(1 for error in errors if error == 0),
+                'mean_abs_error': round(float(np.mean(errors)), 2) if errors else None,
+                'expected_total': sum(expected for expected, _ in checked),
+                'counted_total': sum(counted for _, counted in checked),
+            },
+        }
@@ -0,0 +1,64 @@
+import json
+from django.core.management.base import BaseCommand, CommandError
+from application.benchmarks import BENCHMARKS, DETECTORS, BenchmarkError, compare_results, run_suite
+from application.synthetic import RESOLUTIONS
+
+
+class Command(BaseCommand):
+    help = ('Benchmarks point_in_polygon, detect_vehicles_in_area, the upload pipeline on synthetic clips '
+            'and adaptive green time calculation; writes the results as JSON for comparison between commits')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--only', action='append', choices=BENCHMARKS,
+                            help='Benchmark to run; can be repeated (default: all)')
+        parser.add_argument('--resolution', action='append', choices=list(RESOLUTIONS),
+                            help='Synthetic clip resolution; can be repeated (default: all)')
+        parser.add_argument('--detector', action='append', choices=DETECTORS,
+                            help="'stub' (no model) or 'model' (DETECTOR_BACKEND); can be repeated (default: both)")
+        parser.add_argument('--frames', type=int, default=48, help='Frames per clip and per detection run')
+        parser.add_argument('--repeat', type=int, default=3, help='Uploads per clip in the pipeline benchmark')
+        parser.add_argument('--seed', type=int, default=0, help='Seed of the synthetic scenes and data')
+        parser.add_argument('--output', default='benchmark.json', help='JSON file the results are written to')
+        parser.add_argument('--compare', help='Results JSON of an earlier run to compare against')
+
+    def handle(self, *args, **options):
+        baseline = None
+        if options['compare']:
+            try:
+                with open(options['compare']) as f:
+                    baseline = json.load(f)
+            except (OSError, ValueError) as e:
+                raise CommandError(f"Cannot read {options['compare']}: {e}")
+
+        try:
+            report = run_suite(
+                options['only'] or BENCHMARKS,
+                progress=lambda name: self.stdout.write(f'Running {name}...'),
+                resolutions=options['resolution'] or list(RESOLUTIONS),
+                detectors=options['detector'] or DETECTORS,
+                frames=options['frames'],
+                repeat=options['repeat'],
+                seed=options['seed'],
+            )
+        except BenchmarkError as e:
+            raise CommandError(str(e))
+
+        for name, result in report['results'].items():
+            if 'skipped' in result:
+                self.stdout.write(f"{name}: skipped ({result['skipped']})")
+                continue
+            self.stdout.write(
+                f"{name}: {result['per_sec']}/s, p50 {result['p50_ms']:.3f} ms, p90 {result['p90_ms']:.3f} ms, "
+                f"p99 {result['p99_ms']:.3f} ms, peak RSS {result['peak_rss_mb']} MB"
+            )
+
+        with open(options['output'], 'w') as f:
+            json.dump(report, f, indent=2)
+        self.stdout.write(f"Results written to {options['output']}")
+
+        if baseline is not None:
+            commit = baseline.get('environment', {}).get('commit')
+            self.stdout.write(f"Compared with {options['compare']} ({commit or 'unknown commit'}):")
+            for name, before, after, change, p50_change in compare_results(baseline, report):
+                p50 = f', p50 {p50_change:+.1%}' if p50_change is not None else ''
+                self.stdout.write(f'  {name}: {before}/s -> {after}/s ({change:+.1%}{p50})')
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_datetime
+from django.utils.timezone import is_naive, make_aware
+from application.rollups import prune_rollups, rebuild_rollups
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds traffic rollup buckets from raw logs and prunes expired buckets'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rebuild', action='store_true',
+                            help='Recompute buckets from TrafficLog rows (all of them unless --since/--until)')
+        parser.add_argument('--since', help='Rebuild from this ISO 8601 date-time')
+        parser.add_argument('--until', help='Rebuild up to this ISO 8601 date-time')
+        parser.add_argument('--no-prune', action='store_true',
+                            help='Keep buckets older than ROLLUP_RETENTION_DAYS')
+
+    def parse_time(self, value):
+        if value is None:
+            return None
+        parsed = parse_datetime(value)
+        if parsed is None:
+            raise CommandError(f'Invalid date-time: {value}')
+        return make_aware(parsed) if is_naive(parsed) else parsed
+
+    def handle(self, *args, **options):
+        if options['rebuild']:
+            written = rebuild_rollups(self.parse_time(options['since']), self.parse_time(options['until']))
+            self.stdout.write(f'Rebuilt {written} rollup buckets')
+        if not options['no_prune']:
+            self.stdout.write(f'Pruned {prune_rollups()} expired rollup buckets')
@@ -0,0 +1,97 @@
+import time
+import cv2
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from application.backends import BACKENDS
+from application.detector_pool import build_detector
+from application.geometry import CANVAS_HEIGHT, CANVAS_WIDTH, AreaGeometry, load_areas, scale_points
+from application.processing import VALID_SIGNALS, build_tracker
+from application.video import read_frame_batches
+
+FULL_FRAME = [[0, 0], [CANVAS_WIDTH, 0], [CANVAS_WIDTH, CANVAS_HEIGHT], [0, CANVAS_HEIGHT]]
+
+
+class Command(BaseCommand):
+    help = ('Runs two detector backends over the same clips and compares their vehicle counts and speed; '
+            'exits with an error when counts differ by more than --tolerance')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--video', action='append', required=True, help='Clip to compare on; can be repeated')
+        parser.add_argument('--signal', choices=VALID_SIGNALS,
+                            help="Count inside this signal's detection area instead of the whole frame")
+        parser.add_argument('--baseline', choices=list(BACKENDS), default='torch')
+        parser.add_argument('--baseline-model', help='Model file of the baseline backend')
+        parser.add_argument('--candidate', choices=list(BACKENDS), default='onnx')
+        parser.add_argument('--candidate-model', help='Model file of the candidate backend')
+        parser.add_argument('--max-frames', type=int, default=None, help='Frames read per clip')
+        parser.add_argument('--tolerance', type=float, default=0.05,
+                            help='Largest accepted relative difference in unique vehicles per clip')
+
+    def run_backend(self, detector, path, area, max_frames):
+        cap = cv2.VideoCapture(path)
+        if not cap.isOpened():
+            raise CommandError(f'Cannot open video {path}')
+        fps = cap.get(cv2.CAP_PROP_FPS) or 25
+        width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        geometry = AreaGeometry(scale_points(area, width, height), width, height)
+        tracker = build_tracker(detector, fps, (width, height))
+
+        per_frame = []
+        seconds = 0.0
+        try:
+            for indices, frames in read_frame_batches(cap, getattr(settings, 'DETECTION_BATCH_SIZE', 8),
+                                                      with_indices=True):
+                if max_frames and indices[0] >= max_frames:
+                    break
+                started = time.perf_counter()
+                detections = detector.detect_objects_batch(frames, geometry)
+                seconds += time.perf_counter() - started
+                for index, (xyxy, class_ids, confidences, inside) in zip(indices, detections):
+                    tracker.update(xyxy, detector.class_index(class_ids), confidences, inside, index / fps)
+                    per_frame.append(int(inside.sum()))
+        finally:
+            cap.release()
+        return {
+            'unique_vehicles': tracker.summary()['unique_vehicles'],
+            'per_frame': per_frame,
+            'ms_per_frame': 1000 * seconds / len(per_frame) if per_frame else 0.0,
+        }
+
+    def handle(self, *args, **options):
+        area = FULL_FRAME
+        if options['signal']:
+            area = load_areas().get(options['signal'])
+            if area is None:
+                raise CommandError(f"Area not defined for signal {options['signal']}")
+
+        detectors = {}
+        for role in ('baseline', 'candidate'):
+            detector = build_detector(options[role], options[f'{role}_model'])
+            if detector.model is None:
+                raise CommandError(f"The {options[role]} backend could not be loaded")
+            detectors[role] = detector
+
+        failures = []
+        for path in options['video']:
+            baseline = self.run_backend(detectors['baseline'], path, area, options['max_frames'])
+            candidate = self.run_backend(detectors['candidate'], path, area, options['max_frames'])
+            frames = min(len(baseline['per_frame']), len(candidate['per_frame']))
+            frame_diff = (sum(abs(a - b) for a, b in zip(baseline['per_frame'], candidate['per_frame'])) / frames
+                          if frames else 0.0)
+            expected = baseline['unique_vehicles']
+            relative = abs(candidate['unique_vehicles'] - expected) / max(expected, 1)
+            speedup = baseline['ms_per_frame'] / candidate['ms_per_frame'] if candidate['ms_per_frame'] else 0.0
+
+            self.stdout.write(
+                f"{path}: {frames} frames, unique vehicles {expected} ({options['baseline']}) vs "
+                f"{candidate['unique_vehicles']} ({options['candidate']}), relative difference {relative:.1%}, "
+                f"mean per-frame count difference {frame_diff:.2f}, "
+                f"{baseline['ms_per_frame']:.1f} vs {candidate['ms_per_frame']:.1f} ms/frame ({speedup:.1f}x)"
+            )
+            if relative > options['tolerance']:
+                failures.append(path)
+
+        if failures:
+            raise CommandError(f"Counts differ by more than {options['tolerance']:.0%} on: {', '.join(failures)}")
+        self.stdout.write('Backends agree within tolerance')
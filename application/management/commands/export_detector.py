@@ -0,0 +1,84 @@
+import os
+import shutil
+import cv2
+from django.core.management.base import BaseCommand, CommandError
+
+
+class VideoCalibrationReader:
+    """Feeds letterboxed frames of a clip to ONNX Runtime's static INT8 calibration."""
+
+    def __init__(self, backend, video_path, frames, imgsz):
+        self.backend = backend
+        self.imgsz = imgsz
+        self.batches = iter(self.read(video_path, frames))
+
+    def read(self, video_path, frames):
+        cap = cv2.VideoCapture(video_path)
+        if not cap.isOpened():
+            raise CommandError(f'Cannot open calibration video {video_path}')
+        total = int(cap.get(cv2.CAP_PROP_FRAME_COUNT)) or frames
+        step = max(1, total // frames)
+        try:
+            for index in range(0, total, step):
+                cap.set(cv2.CAP_PROP_POS_FRAMES, index)
+                ret, frame = cap.read()
+                if not ret:
+                    break
+                # Same channel order the detector passes to its backend
+                batch, _ = self.backend.preprocess([cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)], self.imgsz)
+                yield batch
+        finally:
+            cap.release()
+
+    def get_next(self):
+        batch = next(self.batches, None)
+        return None if batch is None else {self.backend.input_name: batch}
+
+
+class Command(BaseCommand):
+    help = 'Exports the YOLOv8 detector to ONNX for DETECTOR_BACKEND = "onnx", optionally quantized to INT8'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--weights', default='yolov8n.pt', help='PyTorch weights to export')
+        parser.add_argument('--output', default='yolov8n.onnx', help='Path of the ONNX model to write')
+        parser.add_argument('--imgsz', type=int, default=640, help='Input size of a fixed-size export')
+        parser.add_argument('--dynamic', action='store_true',
+                            help='Export with free batch size and input size (rectangular inference like torch)')
+        parser.add_argument('--int8', action='store_true', help='Quantize the exported model to INT8')
+        parser.add_argument('--calibration-video',
+                            help='Clip used to calibrate static INT8 quantization; without it weights '
+                                 'are quantized dynamically')
+        parser.add_argument('--calibration-frames', type=int, default=64,
+                            help='Frames sampled from the calibration clip')
+
+    def handle(self, *args, **options):
+        try:
+            from ultralytics import YOLO
+        except ImportError:
+            raise CommandError('Exporting needs ultralytics (and torch) installed')
+
+        exported = YOLO(options['weights']).export(format='onnx', imgsz=options['imgsz'],
+                                                   dynamic=options['dynamic'])
+        output = options['output']
+        if not options['int8']:
+            if os.path.abspath(exported) != os.path.abspath(output):
+                shutil.move(exported, output)
+            self.stdout.write(f'Exported {output}')
+            return
+
+        try:
+            from onnxruntime.quantization import QuantFormat, QuantType, quantize_dynamic, quantize_static
+        except ImportError:
+            raise CommandError('INT8 quantization needs onnxruntime installed')
+
+        if options['calibration_video']:
+            from application.backends import OnnxBackend
+            reader = VideoCalibrationReader(OnnxBackend(exported), options['calibration_video'],
+                                            options['calibration_frames'], options['imgsz'])
+            quantize_static(exported, output, reader, quant_format=QuantFormat.QDQ, per_channel=True,
+                            activation_type=QuantType.QUInt8, weight_type=QuantType.QInt8)
+        else:
+            quantize_dynamic(exported, output, weight_type=QuantType.QUInt8)
+        if os.path.abspath(exported) != os.path.abspath(output):
+            os.remove(exported)
+        self.stdout.write(f'Exported INT8 model {output}; check it with `manage.py compare_backends` before use')
@@ -0,0 +1,53 @@
+from django.core.management.base import BaseCommand, CommandError
+from application.models import JunctionSignals
+from application.processing import VALID_SIGNALS
+from application.streams import StreamIngestor, load_sources
+
+
+class Command(BaseCommand):
+    help = 'Runs continuous vehicle detection on the live camera streams of a junction'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--junction', type=int, required=True,
+                            help='JunctionSignals id whose signal sources are ingested')
+        parser.add_argument('--source', action='append', default=[], metavar='SIGNAL=SOURCE',
+                            help='Stream URL, camera index or file for a signal, e.g. A=rtsp://cam-a/live. '
+                                 'Overrides the stored source; can be repeated')
+        parser.add_argument('--interval', type=float, default=None,
+                            help='Seconds per aggregate row (default STREAM_AGGREGATE_INTERVAL)')
+        parser.add_argument('--queue-size', type=int, default=None,
+                            help='Frames buffered per stream before the oldest are dropped')
+        parser.add_argument('--replay', action='store_true',
+                            help='Treat sources as files and replay them in real time, looping')
+        parser.add_argument('--duration', type=float, default=None,
+                            help='Stop after this many seconds instead of running until interrupted')
+
+    def handle(self, *args, **options):
+        junction_id = options['junction']
+        if not JunctionSignals.objects.filter(id=junction_id).exists():
+            raise CommandError(f'No junction found with id {junction_id}')
+
+        sources = load_sources(junction_id)
+        for item in options['source']:
+            signal_id, sep, source = item.partition('=')
+            signal_id = signal_id.strip().upper()
+            if not sep or signal_id not in VALID_SIGNALS or not source:
+                raise CommandError(f'Invalid --source {item!r}, expected e.g. A=rtsp://host/stream')
+            sources[signal_id] = source
+        if not sources:
+            raise CommandError(f'No stream sources configured for junction {junction_id}')
+
+        ingestor = StreamIngestor(junction_id, sources, interval=options['interval'],
+                                  replay=options['replay'], queue_size=options['queue_size'])
+        self.stdout.write(f"Ingesting signals {', '.join(sorted(sources))} of junction {junction_id}")
+        ingestor.start()
+        try:
+            ingestor.wait(options['duration'])
+        except KeyboardInterrupt:
+            pass
+        finally:
+            ingestor.stop()
+
+        for stream in ingestor.streams:
+            self.stdout.write(f'Signal {stream.signal_id}: {stream.frames_analyzed} frames analysed, '
+                              f'{stream.grabber.frames_dropped} dropped')
@@ -0,0 +1,84 @@
+import json
+import shutil
+import tempfile
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from application.geometry import load_areas
+from application.loadtest import SIGNALS, LoadTest, make_clips
+from application.synthetic import RESOLUTIONS
+
+
+class Command(BaseCommand):
+    help = ('Load-tests a running server over HTTP: concurrent multi-signal uploads of synthetic clips to '
+            '/api/log/ plus dashboard polling of /api/latest-stats/; reports throughput, latency and how '
+            'far counts are from the ground truth (exact with DETECTOR_BACKEND = "scene" on the server)')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://127.0.0.1:8000/', help='Base URL of the server')
+        parser.add_argument('--junction', type=int, required=True, help='Junction id the uploads are logged to')
+        parser.add_argument('--uploads', type=int, default=8, help='Number of multi-signal uploads')
+        parser.add_argument('--concurrency', type=int, default=4, help='Uploads in flight at once')
+        parser.add_argument('--pollers', type=int, default=2, help='Threads polling /api/latest-stats/')
+        parser.add_argument('--poll-interval', type=float, default=1.0, help='Seconds between polls per thread')
+        parser.add_argument('--signal', action='append', choices=SIGNALS,
+                            help='Signal uploaded with every request; can be repeated (default: all)')
+        parser.add_argument('--resolution', choices=list(RESOLUTIONS), default='480p', help='Clip resolution')
+        parser.add_argument('--frames', type=int, default=100, help='Frames per clip')
+        parser.add_argument('--lanes', type=int, default=4, help='Lanes per clip')
+        parser.add_argument('--rate', type=float, default=0.5, help='Mean vehicles entering each lane per second')
+        parser.add_argument('--seed', type=int, default=0, help='Seed of the first clip')
+        parser.add_argument('--option', action='append', default=[], metavar='NAME=VALUE',
+                            help='Extra upload field, e.g. counting_mode=frames or async=false; can be repeated')
+        parser.add_argument('--timeout', type=float, default=300, help='Seconds to wait for a request or job')
+        parser.add_argument('--output', default='loadtest.json', help='JSON file the report is written to')
+
+    def handle(self, *args, **options):
+        extra = {}
+        for option in options['option']:
+            name, sep, value = option.partition('=')
+            if not sep or not name:
+                raise CommandError(f'Invalid --option {option}; expected NAME=VALUE')
+            extra[name] = value
+        if options['uploads'] < 1 or options['concurrency'] < 1:
+            raise CommandError('--uploads and --concurrency must be at least 1')
+
+        signals = options['signal'] or list(SIGNALS)
+        counting_mode = extra.get('counting_mode') or getattr(settings, 'VEHICLE_COUNTING_MODE', 'tracked')
+        directory = tempfile.mkdtemp(prefix='loadtest-')
+        try:
+            self.stdout.write(f"Writing {options['uploads'] * len(signals)} synthetic clips...")
+            try:
+                clips = make_clips(directory, options['uploads'], signals, load_areas(),
+                                   *RESOLUTIONS[options['resolution']], options['frames'], lanes=options['lanes'],
+                                   rate=options['rate'], seed=options['seed'], counting_mode=counting_mode,
+                                   min_hits=getattr(settings, 'TRACKER_MIN_HITS', 2))
+            except OSError as e:
+                raise CommandError(str(e))
+
+            self.stdout.write(f"Uploading to {options['url']} with {options['concurrency']} concurrent uploads...")
+            report = LoadTest(options['url'], options['junction'], clips, concurrency=options['concurrency'],
+                              pollers=options['pollers'], poll_interval=options['poll_interval'],
+                              options=extra, timeout=options['timeout']).run()
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+
+        self.stdout.write(f"{report['videos']} videos in {report['seconds']}s: {report['videos_per_sec']} videos/s, "
+                          f"{report['frames_per_sec']} frames/s")
+        for name in ('uploads', 'jobs', 'latest_stats'):
+            result = report[name]
+            if not result['requests']:
+                self.stdout.write(f'{name}: none')
+                continue
+            self.stdout.write(f"{name}: {result['requests']} ({result['per_sec']}/s), p50 {result['p50_ms']} ms, "
+                              f"p90 {result['p90_ms']} ms, p99 {result['p99_ms']} ms, max {result['max_ms']} ms")
+        counts = report['counts']
+        if counts['checked']:
+            self.stdout.write(f"counts: {counts['exact']}/{counts['checked']} exact, mean abs error "
+                              f"{counts['mean_abs_error']} ({counts['counted_total']} counted, "
+                              f"{counts['expected_total']} expected)")
+        if report['errors']:
+            self.stdout.write(self.style.WARNING(f"errors: {report['errors']}"))
+
+        with open(options['output'], 'w') as f:
+            json.dump(report, f, indent=2)
+        self.stdout.write(f"Report written to {options['output']}")
@@ -0,0 +1,35 @@
+import time
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from application.jobs import claim_next_job, requeue_stale_jobs, run_job
+
+
+class Command(BaseCommand):
+    help = 'Processes queued video upload jobs from the database'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--poll-interval', type=float, default=2.0,
+                            help='Seconds to wait between checks when the queue is empty')
+        parser.add_argument('--once', action='store_true',
+                            help='Exit when the queue is empty instead of polling')
+        parser.add_argument('--stale-after', type=float, default=None,
+                            help='Requeue running jobs not updated for this many seconds '
+                                 '(default JOB_STALE_SECONDS)')
+
+    def handle(self, *args, **options):
+        self.stdout.write('Waiting for queued jobs...')
+        while True:
+            close_old_connections()
+            requeued = requeue_stale_jobs(options['stale_after'])
+            if requeued:
+                self.stdout.write(f'Requeued {requeued} abandoned job(s)')
+            job_id = claim_next_job()
+            if job_id is None:
+                if options['once']:
+                    return
+                time.sleep(options['poll_interval'])
+                continue
+
+            self.stdout.write(f'Processing job {job_id}')
+            job = run_job(job_id, claimed=True)
+            self.stdout.write(f'Job {job_id} {job.status}')
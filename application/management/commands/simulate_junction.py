@@ -0,0 +1,53 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_datetime
+from django.utils.timezone import is_naive, make_aware
+from application.controller import POLICIES
+from application.rollups import GRANULARITIES
+from application.simulation import compare_policies
+
+
+class Command(BaseCommand):
+    help = "Replays a junction's recorded traffic against signal timing policies and compares queues and delays"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--junction', type=int, required=True, help='Junction id')
+        parser.add_argument('--policy', action='append', choices=list(POLICIES),
+                            help='Policy to simulate; repeat to compare several (default: all)')
+        parser.add_argument('--since', help='Replay from this ISO 8601 date-time')
+        parser.add_argument('--until', help='Replay up to this ISO 8601 date-time')
+        parser.add_argument('--granularity', choices=list(GRANULARITIES), default='1m',
+                            help='Rollup buckets the demand is read from')
+        parser.add_argument('--max-cycle', type=float, help='Longest cycle in seconds (default SIGNAL_MAX_CYCLE)')
+        parser.add_argument('--repeat', type=int, default=1, help='Replay the period this many times')
+
+    def parse_time(self, value):
+        if value is None:
+            return None
+        parsed = parse_datetime(value)
+        if parsed is None:
+            raise CommandError(f'Invalid date-time: {value}')
+        return make_aware(parsed) if is_naive(parsed) else parsed
+
+    def handle(self, *args, **options):
+        policies = options['policy'] or list(POLICIES)
+        results = compare_policies(
+            options['junction'], policies,
+            start=self.parse_time(options['since']),
+            end=self.parse_time(options['until']),
+            granularity=options['granularity'],
+            repeat=max(1, options['repeat']),
+            max_cycle=options['max_cycle'],
+        )
+        if not results:
+            raise CommandError(f"No {options['granularity']} rollups for junction {options['junction']} in that period")
+
+        self.stdout.write(f"{'policy':<14}{'cycles':>8}{'avg delay s':>13}{'avg queue':>11}{'max queue':>11}{'throughput':>12}{'cycles/s':>10}")
+        for result in results:
+            self.stdout.write(
+                f"{result['policy']:<14}{result['cycles']:>8}{result['avg_delay']:>13}{result['avg_queue']:>11}"
+                f"{result['max_queue']:>11}{result['throughput']:>12}{result['cycles_per_second'] or '-':>10}"
+            )
+            for signal_id, stats in result['signals'].items():
+                self.stdout.write(
+                    f"  {signal_id}: avg delay {stats['avg_delay']}s, avg queue {stats['avg_queue']}, max queue {stats['max_queue']}"
+                )
@@ -0,0 +1,175 @@
+import time
+import threading
+from contextlib import contextmanager, nullcontext
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Upper bounds (seconds) of the per-video stage time buckets
+STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+REGISTRY = []
+
+
+def format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+class Counter:
+    """A monotonically increasing Prometheus counter, optionally with labels."""
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        return [f'{self.name}{format_labels(self.labels, key)} {value}' for key, value in values]
+
+
+class Histogram:
+    """A Prometheus histogram with fixed buckets, optionally with labels."""
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=STAGE_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._values = {}  # label values -> [per-bucket counts, sum, count]
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.labels)
+        with self._lock:
+            counts, total, count = self._values.get(key) or ([0] * len(self.buckets), 0.0, 0)
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+                    break
+            self._values[key] = (counts, total + value, count + 1)
+
+    def samples(self):
+        with self._lock:
+            values = sorted((key, list(counts), total, count) for key, (counts, total, count) in self._values.items())
+        lines = []
+        for key, counts, total, count in values:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f'{self.name}_bucket{format_labels(self.labels, key, [("le", bound)])} {cumulative}')
+            lines.append(f'{self.name}_bucket{format_labels(self.labels, key, [("le", "+Inf")])} {count}')
+            lines.append(f'{self.name}_sum{format_labels(self.labels, key)} {total}')
+            lines.append(f'{self.name}_count{format_labels(self.labels, key)} {count}')
+        return lines
+
+
+STAGE_SECONDS = Histogram('traffic_stage_seconds', 'Seconds one video spent in each pipeline stage', ['stage'])
+FRAMES = Counter('traffic_frames_total', 'Video frames decoded and analysed', ['kind'])
+DETECTIONS = Counter('traffic_detections_total', 'Vehicle boxes returned by the detector')
+FAILURES = Counter('traffic_failures_total', 'Failures by pipeline stage', ['stage'])
+VIDEOS = Counter('traffic_videos_total', 'Videos processed, by whether the result cache answered', ['result'])
+JOBS = Counter('traffic_jobs_total', 'Finished processing jobs by status', ['status'])
+
+
+def render_metrics():
+    """All metrics of this process in the Prometheus text exposition format."""
+    lines = []
+    for metric in REGISTRY:
+        lines.append(f'# HELP {metric.name} {metric.documentation}')
+        lines.append(f'# TYPE {metric.name} {metric.kind}')
+        lines.extend(metric.samples())
+    return '\n'.join(lines) + '\n'
+
+
+class StageTimer:
+    """
+    Seconds spent per pipeline stage and event counts of one video. Stages
+    repeat per frame or batch and their times add up. Timers travel back
+    from worker processes in the result dict (as_dict()) and are added to
+    the process metrics with record_timings().
+    """
+
+    def __init__(self):
+        self.seconds = {}
+        self.counts = {}
+
+    @contextmanager
+    def stage(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - started)
+
+    def add(self, name, seconds):
+        self.seconds[name] = self.seconds.get(name, 0.0) + seconds
+
+    def count(self, name, amount=1):
+        self.counts[name] = self.counts.get(name, 0) + amount
+
+    def iterate(self, name, iterable):
+        """Yields from `iterable`, timing the production of each item as stage `name`."""
+        iterator = iter(iterable)
+        while True:
+            started = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.add(name, time.perf_counter() - started)
+                return
+            self.add(name, time.perf_counter() - started)
+            yield item
+
+    def as_dict(self):
+        return {
+            'seconds': {name: round(value, 4) for name, value in self.seconds.items()},
+            'counts': dict(self.counts),
+        }
+
+
+class NullTimer:
+    """Stand-in for StageTimer when nothing is being measured."""
+
+    def stage(self, name):
+        return nullcontext()
+
+    def add(self, name, seconds):
+        pass
+
+    def count(self, name, amount=1):
+        pass
+
+    def iterate(self, name, iterable):
+        return iter(iterable)
+
+
+NULL_TIMER = NullTimer()
+
+
+def record_timings(timings, cached=False):
+    """Adds one video's StageTimer.as_dict() to the process metrics."""
+    for stage, seconds in timings.get('seconds', {}).items():
+        STAGE_SECONDS.observe(seconds, stage=stage)
+    counts = timings.get('counts', {})
+    FRAMES.inc(counts.get('frames_decoded', 0), kind='decoded')
+    FRAMES.inc(counts.get('frames_analyzed', 0), kind='analyzed')
+    DETECTIONS.inc(counts.get('detections', 0))
+    if counts.get('detection_errors'):
+        FAILURES.inc(counts['detection_errors'], stage='detection')
+    VIDEOS.inc(result='cached' if cached else 'analyzed')
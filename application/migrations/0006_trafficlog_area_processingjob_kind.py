@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('application', '0005_processingjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='processingjob',
+            name='kind',
+            field=models.CharField(choices=[('analyze', 'Analyze uploads'), ('render', 'Render processed video')], default='analyze', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='trafficlog',
+            name='area',
+            field=models.JSONField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('application', '0006_trafficlog_area_processingjob_kind'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='trafficlog',
+            name='avg_dwell_time',
+            field=models.FloatField(default=0.0),
+        ),
+        migrations.AddField(
+            model_name='trafficlog',
+            name='entries',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='trafficlog',
+            name='exits',
+            field=models.IntegerField(default=0),
+        ),
+    ]
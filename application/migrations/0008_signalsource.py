@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:30
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('application', '0007_trafficlog_tracking'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SignalSource',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('signal_id', models.IntegerField()),
+                ('source', models.CharField(max_length=500)),
+                ('enabled', models.BooleanField(default=True)),
+                ('junction', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='sources', to='application.junctionsignals')),
+            ],
+            options={
+                'unique_together': {('junction', 'signal_id')},
+            },
+        ),
+    ]
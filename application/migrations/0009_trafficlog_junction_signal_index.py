@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('application', '0008_signalsource'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='trafficlog',
+            index=models.Index(fields=['junction', 'signal_id', '-timestamp'], name='trafficlog_junction_signal_ts'),
+        ),
+    ]
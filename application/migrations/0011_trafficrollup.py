@@ -0,0 +1,42 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:35
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('application', '0010_brokerevent'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TrafficRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('signal_id', models.IntegerField()),
+                ('granularity', models.CharField(choices=[('1m', '1 minute'), ('15m', '15 minutes'), ('1h', '1 hour')], max_length=3)),
+                ('bucket_start', models.DateTimeField()),
+                ('samples', models.IntegerField(default=0)),
+                ('vehicle_count_sum', models.IntegerField(default=0)),
+                ('vehicle_count_max', models.IntegerField(default=0)),
+                ('traffic_weight_sum', models.FloatField(default=0.0)),
+                ('traffic_weight_max', models.FloatField(default=0.0)),
+                ('car_sum', models.IntegerField(default=0)),
+                ('car_max', models.IntegerField(default=0)),
+                ('truck_sum', models.IntegerField(default=0)),
+                ('truck_max', models.IntegerField(default=0)),
+                ('bus_sum', models.IntegerField(default=0)),
+                ('bus_max', models.IntegerField(default=0)),
+                ('motorcycle_sum', models.IntegerField(default=0)),
+                ('motorcycle_max', models.IntegerField(default=0)),
+                ('bicycle_sum', models.IntegerField(default=0)),
+                ('bicycle_max', models.IntegerField(default=0)),
+                ('junction', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='application.junctionsignals')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('junction', 'granularity', 'signal_id', 'bucket_start'), name='trafficrollup_unique_bucket')],
+            },
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:36
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('application', '0011_trafficrollup'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='trafficlog',
+            name='device_id',
+            field=models.CharField(blank=True, max_length=100, null=True),
+        ),
+        migrations.AddField(
+            model_name='trafficlog',
+            name='sequence',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='trafficlog',
+            name='timestamp',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddConstraint(
+            model_name='trafficlog',
+            constraint=models.UniqueConstraint(condition=models.Q(('device_id__isnull', False)), fields=('device_id', 'sequence'), name='trafficlog_unique_device_sequence'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:41
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('application', '0012_trafficlog_device_sequence'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SignalState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('signal_id', models.IntegerField()),
+                ('min_green_time', models.IntegerField()),
+                ('max_green_time', models.IntegerField()),
+                ('current_state', models.CharField(default='RED', max_length=10)),
+                ('remaining_time', models.FloatField(default=0)),
+                ('vehicle_history', models.JSONField(default=list)),
+                ('calculated_green_time', models.IntegerField(default=15)),
+                ('last_log_id', models.BigIntegerField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('junction', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='signal_states', to='application.junctionsignals')),
+            ],
+            options={
+                'unique_together': {('junction', 'signal_id')},
+            },
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:44
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('application', '0014_resultcacheentry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='trafficlog',
+            name='job',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='logs', to='application.processingjob'),
+        ),
+    ]
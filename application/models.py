@@ -1,4 +1,6 @@
+import uuid
 from django.db import models
+from django.utils.timezone import now
 
 class JunctionSignals(models.Model):
     name = models.CharField(max_length=255)
@@ -7,7 +9,8 @@ class TrafficLog(models.Model):
     junction = models.ForeignKey(JunctionSignals, on_delete=models.CASCADE, null= True, blank= True)
     videos = models.FileField(upload_to='videos/', null=True, blank=True)
     processed_videos = models.FileField(upload_to='processed_videos/', null=True, blank=True)
-    timestamp = models.DateTimeField(auto_now_add=True)
+    area = models.JSONField(null=True, blank=True)  # detection polygon (canvas points) used for this log
+    timestamp = models.DateTimeField(default=now)  # not auto_now_add, so ingested records keep their device time
     signal_id = models.IntegerField()
     vehicle_count = models.IntegerField()
     traffic_weight = models.FloatField()
@@ -18,7 +21,165 @@ class TrafficLog(models.Model):
     Motorcycle = models.IntegerField(default=0)
     Bicycle = models.IntegerField(default=0)
     Bus = models.IntegerField(default=0)
+    entries = models.IntegerField(default=0)        # tracked vehicles that crossed into the area
+    exits = models.IntegerField(default=0)          # tracked vehicles that left the area
+    avg_dwell_time = models.FloatField(default=0.0) # seconds a counted vehicle spent inside the area
+    # Set for records pushed by edge devices; (device_id, sequence) makes retried batches idempotent
+    device_id = models.CharField(max_length=100, null=True, blank=True)
+    sequence = models.BigIntegerField(null=True, blank=True)
+    # The upload job that wrote this log, so a re-run of the job can replace its logs
+    job = models.ForeignKey('ProcessingJob', on_delete=models.SET_NULL, null=True, blank=True, related_name='logs')
     last_update = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            # Latest-row-per-signal lookups for a junction (snapshot, latest stats)
+            models.Index(fields=['junction', 'signal_id', '-timestamp'], name='trafficlog_junction_signal_ts'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['device_id', 'sequence'], condition=models.Q(device_id__isnull=False),
+                                    name='trafficlog_unique_device_sequence'),
+        ]
+
+    def __str__(self):
+        return f"Signal {self.signal_id} @ {self.timestamp}"
+
+class SignalSource(models.Model):
+    junction = models.ForeignKey(JunctionSignals, on_delete=models.CASCADE, related_name='sources')
+    signal_id = models.IntegerField()
+    source = models.CharField(max_length=500)  # RTSP/HTTP URL, camera index or device path, or a file to replay
+    enabled = models.BooleanField(default=True)
+
+    class Meta:
+        unique_together = ('junction', 'signal_id')
+
+    def __str__(self):
+        return f"Junction {self.junction_id} signal {self.signal_id}: {self.source}"
+
+class ProcessingJob(models.Model):
+    STATUS_QUEUED = 'queued'
+    STATUS_RUNNING = 'running'
+    STATUS_COMPLETED = 'completed'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_QUEUED, 'Queued'),
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_COMPLETED, 'Completed'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+    KIND_ANALYZE = 'analyze'
+    KIND_RENDER = 'render'
+    KIND_CHOICES = [
+        (KIND_ANALYZE, 'Analyze uploads'),
+        (KIND_RENDER, 'Render processed video'),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    junction = models.ForeignKey(JunctionSignals, on_delete=models.CASCADE, null=True, blank=True)
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES, default=KIND_ANALYZE)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_QUEUED)
+    progress = models.FloatField(default=0.0)  # percentage, 0-100
+    inputs = models.JSONField(default=list)    # [{'signal_id', 'video', 'area'}, ...] or [{'signal_id', 'log_id'}] to render
+    options = models.JSONField(default=dict)
+    result = models.JSONField(null=True, blank=True)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"Job {self.id} ({self.status})"
+
+class TrafficRollup(models.Model):
+    """
+    TrafficLog aggregates per junction, signal and time bucket, kept at
+    1-minute, 15-minute and hourly granularity (see rollups.py).
+    """
+    GRANULARITY_CHOICES = [
+        ('1m', '1 minute'),
+        ('15m', '15 minutes'),
+        ('1h', '1 hour'),
+    ]
+
+    junction = models.ForeignKey(JunctionSignals, on_delete=models.CASCADE, null=True, blank=True)
+    signal_id = models.IntegerField()
+    granularity = models.CharField(max_length=3, choices=GRANULARITY_CHOICES)
+    bucket_start = models.DateTimeField()
+    samples = models.IntegerField(default=0)  # TrafficLog rows folded into the bucket
+    vehicle_count_sum = models.IntegerField(default=0)
+    vehicle_count_max = models.IntegerField(default=0)
+    traffic_weight_sum = models.FloatField(default=0.0)
+    traffic_weight_max = models.FloatField(default=0.0)
+    car_sum = models.IntegerField(default=0)
+    car_max = models.IntegerField(default=0)
+    truck_sum = models.IntegerField(default=0)
+    truck_max = models.IntegerField(default=0)
+    bus_sum = models.IntegerField(default=0)
+    bus_max = models.IntegerField(default=0)
+    motorcycle_sum = models.IntegerField(default=0)
+    motorcycle_max = models.IntegerField(default=0)
+    bicycle_sum = models.IntegerField(default=0)
+    bicycle_max = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['junction', 'granularity', 'signal_id', 'bucket_start'],
+                                    name='trafficrollup_unique_bucket'),
+        ]
+
+    def __str__(self):
+        return f"Signal {self.signal_id} {self.granularity} @ {self.bucket_start}"
+
+class BrokerEvent(models.Model):
+    # Live update events relayed between processes by events.DatabaseBroker
+    topic = models.CharField(max_length=100, db_index=True)
+    payload = models.JSONField()
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    def __str__(self):
+        return f"{self.topic} #{self.id}"
+
+class SignalState(models.Model):
+    """
+    Shared state of a signal's EnhancedTrafficSignal: its timing limits
+    (seeded from config.json), current state and recent traffic history.
+    Every process reads and updates it through signal_state.py, so the
+    adaptive timing history survives between requests and workers.
+    """
+    junction = models.ForeignKey(JunctionSignals, on_delete=models.CASCADE, null=True, blank=True,
+                                 related_name='signal_states')
+    signal_id = models.IntegerField()
+    min_green_time = models.IntegerField()
+    max_green_time = models.IntegerField()
+    current_state = models.CharField(max_length=10, default='RED')
+    remaining_time = models.FloatField(default=0)
+    vehicle_history = models.JSONField(default=list)  # recent traffic weights, oldest first
+    calculated_green_time = models.IntegerField(default=15)
+    last_log_id = models.BigIntegerField(null=True, blank=True)  # latest TrafficLog folded into the history
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ('junction', 'signal_id')
+
+    def __str__(self):
+        return f"Junction {self.junction_id} signal {self.signal_id}: {self.current_state}"
+
+
+class ResultCacheEntry(models.Model):
+    """
+    Cached analysis of one upload (by content hash) under one set of
+    processing inputs, see result_cache.py. `processed_video` is the cache's
+    own hard link to the rendered clip, empty for stats-only analyses.
+    """
+    key = models.CharField(max_length=64, unique=True)
+    content_hash = models.CharField(max_length=64, db_index=True)
+    result = models.JSONField(default=dict)
+    processed_video = models.CharField(max_length=255, blank=True, default='')
+    size = models.BigIntegerField(default=0)  # bytes of processed_video
+    hits = models.IntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_used_at = models.DateTimeField(default=now, db_index=True)
+
     def __str__(self):
-        return f"Signal {self.signal_id} @ {self.timestamp}"
\ No newline at end of file
+        return f"{self.content_hash[:12]} ({self.hits} hits)"
@@ -0,0 +1,484 @@
+import os
+import shutil
+import cv2
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.utils.timezone import now
+from .models import TrafficLog
+from .rollups import record_logs
+from .detector_pool import DetectorUnavailable, get_detector_pool, load_error
+from .geometry import get_area_geometry, load_areas
+from .metrics import NULL_TIMER, StageTimer
+from .result_cache import get_result_cache, link_file, result_key
+from .tracking import COUNTING_MODES, VehicleTracker
+from .utils import letter_to_number, number_to_letter
+from .video import (BackgroundWriter, EncoderError, FFmpegWriter, FrameSampler, FrameScaler, ReadAhead, open_video,
+                    read_frame_batches)
+
+VALID_SIGNALS = ['A', 'B', 'C', 'D']
+
+
+class ProcessingError(Exception):
+    """
+    Raised when a video cannot be processed. `status` is the HTTP status the
+    API should answer with.
+    """
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+    def __reduce__(self):
+        # Keep the status when the error crosses a process boundary
+        return (self.__class__, (str(self), self.status))
+
+
+def load_area_polygons():
+    try:
+        return load_areas()
+    except Exception as e:
+        raise ProcessingError(f'Failed to load area definitions: {e}', status=500)
+
+
+def parse_bool(value, default=False):
+    if value is None or value == '':
+        return default
+    return str(value).lower() not in ('0', 'false', 'no', 'off')
+
+
+def inference_size(signal_id, options):
+    """Model input size: the upload's imgsz, else DETECTION_IMGSZ_PER_SIGNAL, else DETECTION_IMGSZ."""
+    if options.get('imgsz'):
+        return options['imgsz']
+    per_signal = getattr(settings, 'DETECTION_IMGSZ_PER_SIGNAL', {})
+    return per_signal.get(signal_id) or getattr(settings, 'DETECTION_IMGSZ', 640)
+
+
+def parse_height(value, default):
+    """A max frame height option: a positive int, or None (also for 0) to keep the source size."""
+    if value is None or value == '':
+        value = default
+    if value in (None, 0, '0'):
+        return None
+    height = int(value)
+    if height < 0:
+        raise ValueError('Frame heights must not be negative')
+    return height
+
+
+def parse_processing_options(data):
+    """
+    Reads per-upload processing options from request data, falling back to
+    the defaults in settings.
+    """
+    try:
+        options = {
+            'batch_size': int(data.get('batch_size') or getattr(settings, 'DETECTION_BATCH_SIZE', 8)),
+            'sampling_mode': data.get('sampling_mode') or getattr(settings, 'VIDEO_SAMPLING_MODE', 'all'),
+            'sampling_value': data.get('sampling_value') or getattr(settings, 'VIDEO_SAMPLING_VALUE', None),
+            'roi_crop': parse_bool(data.get('roi_crop'), getattr(settings, 'DETECTION_ROI_CROP', False)),
+            'stats_only': parse_bool(data.get('stats_only'), getattr(settings, 'VIDEO_STATS_ONLY', False)),
+            'imgsz': int(data['imgsz']) if data.get('imgsz') else None,
+            'counting_mode': data.get('counting_mode') or getattr(settings, 'VEHICLE_COUNTING_MODE', 'tracked'),
+            'timings': parse_bool(data.get('timings'), False),
+            'analysis_height': parse_height(data.get('analysis_height'), getattr(settings, 'VIDEO_ANALYSIS_HEIGHT', None)),
+            'output_height': parse_height(data.get('output_height'), getattr(settings, 'VIDEO_OUTPUT_HEIGHT', None)),
+        }
+        FrameSampler(options['sampling_mode'], options['sampling_value'])
+    except ValueError as e:
+        raise ProcessingError(str(e))
+    if options['counting_mode'] not in COUNTING_MODES:
+        raise ProcessingError(f"Invalid counting mode: {options['counting_mode']}. Must be one of: {', '.join(COUNTING_MODES)}")
+    return options
+
+
+def count_frames(video_path):
+    cap = cv2.VideoCapture(video_path)
+    try:
+        return max(int(cap.get(cv2.CAP_PROP_FRAME_COUNT)), 0)
+    finally:
+        cap.release()
+
+
+def get_ffmpeg_path():
+    """FFMPEG_PATH from settings, otherwise the ffmpeg found on PATH."""
+    return getattr(settings, 'FFMPEG_PATH', None) or shutil.which('ffmpeg') or 'ffmpeg'
+
+
+def efficiency_score(vehicle_count, traffic_weight):
+    return round(vehicle_count / max(traffic_weight, 1.0) * 10, 2)
+
+
+def build_tracker(detector, fps, frame_size=None):
+    """
+    A VehicleTracker for one video or stream at `fps` with (width, height)
+    `frame_size`, configured from the TRACKER_* settings.
+    """
+    return VehicleTracker(
+        detector.vehicle_classes,
+        [detector.vehicle_weights.get(name, 1.0) for name in detector.vehicle_classes],
+        iou_threshold=getattr(settings, 'TRACKER_IOU_THRESHOLD', 0.3),
+        max_age=getattr(settings, 'TRACKER_MAX_AGE', 1.0),
+        min_hits=getattr(settings, 'TRACKER_MIN_HITS', 2),
+        distance_threshold=getattr(settings, 'TRACKER_DISTANCE_THRESHOLD', 1.0),
+        distance_max_misses=getattr(settings, 'TRACKER_DISTANCE_MAX_MISSES', 1),
+        frame_duration=1.0 / fps,
+        frame_size=frame_size
+    )
+
+
+def reserve_storage_name(name):
+    """
+    Picks a free name in default storage and creates the empty file, so two
+    workers can't choose the same name before either has written to it.
+    """
+    while True:
+        name = default_storage.get_available_name(name)
+        path = default_storage.path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        try:
+            os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            return name
+        except FileExistsError:
+            continue
+
+
+def analyze_video(video_name, signal_id, area, options, render=True, progress_callback=None, detector=None,
+                  timer=None):
+    """
+    Runs detection over one stored video. With `render` the annotated clip
+    is streamed into an H.264 encoder under processed_videos; without it no
+    frame is copied, drawn or encoded.
+
+    In the default 'tracked' counting mode every vehicle is counted once
+    through a VehicleTracker, whatever the number of frames it appears in.
+    'frames' mode sums per-frame counts like earlier versions, scaled back
+    to full rate when frames are sampled.
+
+    Frames are shrunk to `analysis_height` right after decoding and the
+    area is scaled to that size, so colour conversion, copies and
+    inference never touch full-resolution frames. Rendered clips are drawn
+    at `output_height` (by default the analysis size), with boxes mapped
+    to that size.
+
+    `video_name` is the video's name in default storage and `area` the
+    detection polygon in canvas coordinates. `progress_callback`, when
+    given, is called with the number of frames read so far.
+    Returns a dict with the aggregated counts, entries/exits/dwell (tracked
+    mode only), frame counters and the processed video's storage name
+    (None when not rendered). Without a `detector` one is leased from the
+    process's DetectorPool for the duration of the video. A detector whose
+    model failed to load (other than the stub) raises a 503 ProcessingError
+    instead of simulating counts. Time spent per
+    stage (decode, resize, colour conversion, inference, polygon filter,
+    tracking, drawing, encode, ffmpeg) is added to `timer`, a StageTimer.
+
+    Decoding runs up to VIDEO_DECODE_AHEAD batches ahead on its own thread
+    and annotated frames are encoded on another, so both overlap with
+    inference on the calling thread; 'decode_wait' and 'encode_wait' are
+    the times this thread still waited for them.
+    """
+    if detector is None:
+        try:
+            with get_detector_pool().lease() as detector:
+                return analyze_video(video_name, signal_id, area, options, render, progress_callback, detector, timer)
+        except DetectorUnavailable as e:
+            raise ProcessingError(f'Detector unavailable: {e}', status=503)
+    error = load_error(detector)
+    if error:
+        raise ProcessingError(f'Detector unavailable: {error}', status=503)
+    timer = timer or NULL_TIMER
+
+    imgsz = inference_size(signal_id, options)
+    roi_crop = options.get('roi_crop', False)
+    input_path = default_storage.path(video_name)
+
+    cap = open_video(input_path, getattr(settings, 'VIDEO_DECODER', 'opencv'),
+                     getattr(settings, 'VIDEO_DECODER_THREADS', None))
+    if not cap.isOpened():
+        raise ProcessingError('Cannot open video')
+
+    fps = cap.get(cv2.CAP_PROP_FPS) or 25
+    width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+    height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    sampler = FrameSampler(options['sampling_mode'], options['sampling_value'], source_fps=fps)
+
+    analysis = FrameScaler(width, height, options.get('analysis_height'))
+    output = FrameScaler(width, height, options.get('output_height') or analysis.size[1])
+
+    # ---- RESCALE COORDINATES TO MATCH VIDEO SIZE ----
+    # Cached per (signal, frame size): polygon, bounding box and edge arrays are built once
+    geometry = get_area_geometry(signal_id, *analysis.size, area=area)
+    output_geometry = get_area_geometry(signal_id, *output.size, area=area) if render else None
+
+    # Annotated frames are encoded once, straight into their final storage path.
+    # Only analysed frames are written, so the output runs at the effective fps to keep the clip's duration.
+    processed_name = None
+    out = None
+    # Frames are piped into ffmpeg from a separate thread unless VIDEO_ENCODE_QUEUE is 0
+    encode_queue = getattr(settings, 'VIDEO_ENCODE_QUEUE', 8)
+    if render:
+        processed_name = reserve_storage_name(f'processed_videos/processed_video_{signal_id}.mp4')
+        try:
+            out = FFmpegWriter(
+                default_storage.path(processed_name), *output.size, sampler.effective_fps,
+                ffmpeg_path=get_ffmpeg_path(),
+                preset=getattr(settings, 'VIDEO_ENCODER_PRESET', 'veryfast'),
+                crf=getattr(settings, 'VIDEO_ENCODER_CRF', 23)
+            )
+        except OSError as e:
+            cap.release()
+            default_storage.delete(processed_name)
+            raise ProcessingError(f'ffmpeg could not be started: {e}', status=500)
+        if encode_queue:
+            out = BackgroundWriter(out, encode_queue, timer=timer)
+
+    tracked = options.get('counting_mode', 'tracked') == 'tracked'
+    tracker = build_tracker(detector, sampler.effective_fps, analysis.size) if tracked else None
+
+    # Per-frame sums ('frames' mode)
+    total_vehicle_count = 0
+    total_weight = 0.0
+    vehicle_type_counts = {v: 0 for v in detector.vehicle_classes}
+
+    def decoded_batches():
+        batches = read_frame_batches(cap, options['batch_size'], sampler, with_indices=True)
+        for indices, source_frames in timer.iterate('decode', batches):
+            with timer.stage('resize'):
+                frames = [analysis(frame) for frame in source_frames]
+            yield indices, source_frames, frames
+
+    # Decoding and resizing run ahead on their own thread while this one detects
+    decode_ahead = getattr(settings, 'VIDEO_DECODE_AHEAD', 2)
+    reader = ReadAhead(decoded_batches(), decode_ahead) if decode_ahead else None
+
+    detector.timer = timer
+    try:
+        batches = timer.iterate('decode_wait', reader) if reader is not None else decoded_batches()
+        for indices, source_frames, frames in batches:
+            if tracked:
+                detections = detector.detect_objects_batch(frames, geometry, imgsz=imgsz, roi_crop=roi_crop)
+                for index, source_frame, frame, (xyxy, class_ids, confidences, inside) in zip(
+                        indices, source_frames, frames, detections):
+                    with timer.stage('tracking'):
+                        track_ids = tracker.update(xyxy, detector.class_index(class_ids), confidences, inside,
+                                                   index / sampler.source_fps)
+                    if out is not None:
+                        vc, wt, _ = detector.summarize_detections(class_ids[inside])
+                        with timer.stage('output_resize'):
+                            canvas = output.rescale(source_frame, frame, analysis)
+                        annotated = detector.annotate_frame(canvas, output_geometry,
+                                                            output.boxes_from(xyxy[inside], analysis),
+                                                            class_ids[inside], confidences[inside], vc, wt,
+                                                            track_ids=track_ids[inside])
+                        with timer.stage('encode_wait' if encode_queue else 'encode'):
+                            out.write(annotated)
+            else:
+                detections = detector.detect_vehicles_batch(frames, geometry, imgsz=imgsz,
+                                                            roi_crop=roi_crop, annotate=render)
+                for vc, wt, processed_frame, type_counts in detections:
+                    total_vehicle_count += vc
+                    total_weight += wt
+                    for vt, count in type_counts.items():
+                        vehicle_type_counts[vt] += count
+
+                    if out is not None:
+                        # Annotated at the analysis size; resized only when the output size differs
+                        if output.size != analysis.size:
+                            with timer.stage('output_resize'):
+                                processed_frame = cv2.resize(processed_frame, output.size,
+                                                             interpolation=cv2.INTER_AREA)
+                        with timer.stage('encode_wait' if encode_queue else 'encode'):
+                            out.write(processed_frame)
+            if progress_callback:
+                progress_callback(sampler.frames_seen)
+        if out is not None:
+            # Waits for ffmpeg to encode what is still buffered and finish the file
+            with timer.stage('ffmpeg'):
+                out.release()
+    except EncoderError as e:
+        out.release_quietly()
+        default_storage.delete(processed_name)
+        raise ProcessingError(f'ffmpeg encoding failed: {e}', status=500)
+    except Exception:
+        if out is not None:
+            out.release_quietly()
+            default_storage.delete(processed_name)
+        raise
+    finally:
+        if reader is not None:
+            reader.close()
+        cap.release()
+        detector.timer = NULL_TIMER
+    timer.count('frames_decoded', sampler.frames_seen)
+    timer.count('frames_analyzed', sampler.frames_analyzed)
+
+    if tracked:
+        # Unique vehicles don't depend on how many frames were analysed, so no scaling
+        summary = tracker.summary()
+        return {
+            'vehicle_count': summary['unique_vehicles'],
+            'traffic_weight': summary['traffic_weight'],
+            'vehicle_type_counts': summary['vehicle_type_counts'],
+            'entries': summary['entries'],
+            'exits': summary['exits'],
+            'avg_dwell_time': summary['avg_dwell_time'],
+            'frames_total': sampler.frames_seen,
+            'frames_analyzed': sampler.frames_analyzed,
+            'processed_name': processed_name,
+            'simulated': detector.model is None,
+        }
+
+    # Scale sums over sampled frames back to full-rate equivalents
+    scale = sampler.scale_factor()
+    if scale != 1.0:
+        total_vehicle_count = int(round(total_vehicle_count * scale))
+        total_weight *= scale
+        vehicle_type_counts = {vt: int(round(count * scale)) for vt, count in vehicle_type_counts.items()}
+
+    return {
+        'vehicle_count': total_vehicle_count,
+        'traffic_weight': total_weight,
+        'vehicle_type_counts': vehicle_type_counts,
+        'entries': 0,
+        'exits': 0,
+        'avg_dwell_time': 0.0,
+        'frames_total': sampler.frames_seen,
+        'frames_analyzed': sampler.frames_analyzed,
+        'processed_name': processed_name,
+        'simulated': detector.model is None,
+    }
+
+
+def cached_analysis(cache, key, signal_id, render):
+    """
+    The cached analyze_video() result for `key` with its clip linked to a
+    new processed_videos name, or None on a miss.
+    """
+    entry = cache.get(key, with_video=render)
+    if entry is None:
+        return None
+    processed_name = None
+    if render:
+        processed_name = reserve_storage_name(f'processed_videos/processed_video_{signal_id}.mp4')
+        try:
+            link_file(default_storage.path(entry.processed_video), default_storage.path(processed_name))
+        except OSError as e:
+            # Evicted since the lookup
+            print(f"[WARN] Cached video {entry.processed_video} unavailable: {e}")
+            default_storage.delete(processed_name)
+            return None
+    return dict(entry.result, processed_name=processed_name)
+
+
+def process_signal_video(video_name, signal_id, junction_id, area, options, progress_callback=None,
+                         content_hash=None, job_id=None):
+    """
+    Analyses one stored upload and writes a TrafficLog row, linked to the
+    job `job_id` when it runs as part of one. With the
+    `stats_only` option no processed video is produced; it can be rendered
+    later with render_traffic_log. When the upload's `content_hash` is
+    known, a previous analysis of the same video with the same inputs is
+    reused from the result cache instead.
+    Returns a result dict for the API response, with the time spent per
+    stage under 'timings'.
+    """
+    render = not options.get('stats_only', False)
+    timer = StageTimer()
+    cache = key = analysis = None
+    if content_hash and getattr(settings, 'RESULT_CACHE_ENABLED', True):
+        cache = get_result_cache()
+        key = result_key(content_hash, area, options, inference_size(signal_id, options))
+        with timer.stage('cache_lookup'):
+            analysis = cached_analysis(cache, key, signal_id, render)
+    cached = analysis is not None
+    if cached:
+        print(f"[INFO] Result cache hit for signal {signal_id} ({content_hash[:12]})")
+    else:
+        analysis = analyze_video(video_name, signal_id, area, options, render=render,
+                                 progress_callback=progress_callback, timer=timer)
+        if cache is not None and not analysis['simulated']:
+            with timer.stage('cache_store'):
+                cache.put(key, content_hash, analysis)
+    total_vehicle_count = analysis['vehicle_count']
+    total_weight = analysis['traffic_weight']
+    vehicle_type_counts = analysis['vehicle_type_counts']
+
+    with timer.stage('db_write'):
+        log = TrafficLog.objects.create(
+            junction_id=junction_id,
+            job_id=job_id,
+            videos=video_name,  # the upload is already in storage, don't save a second copy
+            processed_videos=analysis['processed_name'],
+            area=area,
+            signal_id=letter_to_number(signal_id),  # Use numeric ID for database
+            vehicle_count=total_vehicle_count,
+            traffic_weight=total_weight,
+            green_time=10,
+            efficiency_score=efficiency_score(total_vehicle_count, total_weight),
+            Car=vehicle_type_counts.get('car', 0),
+            Truck=vehicle_type_counts.get('truck', 0),
+            Bus=vehicle_type_counts.get('bus', 0),
+            Motorcycle=vehicle_type_counts.get('motorcycle', 0),
+            Bicycle=vehicle_type_counts.get('bicycle', 0),
+            entries=analysis['entries'],
+            exits=analysis['exits'],
+            avg_dwell_time=analysis['avg_dwell_time'],
+            timestamp=now()
+        )
+        record_logs([log])
+
+    return {
+        'message': f'Video for signal {signal_id} processed',
+        'signal_id': signal_id,
+        'log_id': log.id,
+        'vehicle_count': total_vehicle_count,
+        'vehicle_type_counts': vehicle_type_counts,
+        'entries': analysis['entries'],
+        'exits': analysis['exits'],
+        'avg_dwell_time': analysis['avg_dwell_time'],
+        'frames_total': analysis['frames_total'],
+        'frames_analyzed': analysis['frames_analyzed'],
+        'cached': cached,
+        'timings': timer.as_dict(),
+        'video_url': log.processed_videos.url if log.processed_videos else ''
+    }
+
+
+def render_traffic_log(log_id, options, progress_callback=None):
+    """
+    Produces the annotated video for an existing TrafficLog from its stored
+    upload, e.g. one analysed in stats-only mode. Counts are left untouched.
+    """
+    try:
+        log = TrafficLog.objects.get(id=log_id)
+    except TrafficLog.DoesNotExist:
+        raise ProcessingError(f'No traffic log found with id {log_id}', status=404)
+    if not log.videos:
+        raise ProcessingError('The original video for this log is not available', status=404)
+
+    signal_id = number_to_letter(log.signal_id)
+    area = log.area or load_area_polygons().get(signal_id)
+    if not area:
+        raise ProcessingError(f'Area not defined for signal {signal_id}')
+
+    timer = StageTimer()
+    analysis = analyze_video(log.videos.name, signal_id, area, options,
+                             render=True, progress_callback=progress_callback, timer=timer)
+    previous = log.processed_videos.name if log.processed_videos else None
+    log.processed_videos = analysis['processed_name']
+    with timer.stage('db_write'):
+        log.save(update_fields=['processed_videos', 'last_update'])
+    if previous:
+        default_storage.delete(previous)
+
+    return {
+        'message': f'Video for signal {signal_id} rendered',
+        'signal_id': signal_id,
+        'log_id': log.id,
+        'vehicle_count': log.vehicle_count,
+        'frames_total': analysis['frames_total'],
+        'frames_analyzed': analysis['frames_analyzed'],
+        'timings': timer.as_dict(),
+        'video_url': log.processed_videos.url
+    }
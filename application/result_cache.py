@@ -0,0 +1,191 @@
+import os
+import json
+import uuid
+import shutil
+import hashlib
+import threading
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.core.files.uploadhandler import FileUploadHandler
+from django.db.models import F, Sum
+from django.utils.timezone import now
+from .backends import DEFAULT_MODEL_PATHS
+from .models import ResultCacheEntry
+
+# Bump when a change to detection, tracking or rendering alters results for the same inputs
+CACHE_VERSION = 2
+
+CACHE_DIR = 'result_cache'
+
+# Processing options that change counts or the rendered clip (batch_size and stats_only don't)
+RESULT_OPTIONS = ('sampling_mode', 'sampling_value', 'counting_mode', 'roi_crop', 'analysis_height', 'output_height')
+
+TRACKER_SETTINGS = ('TRACKER_IOU_THRESHOLD', 'TRACKER_MAX_AGE', 'TRACKER_MIN_HITS', 'TRACKER_DISTANCE_THRESHOLD',
+                    'TRACKER_DISTANCE_MAX_MISSES')
+
+
+class HashingUploadHandler(FileUploadHandler):
+    """
+    Upload handler placed first in FILE_UPLOAD_HANDLERS: hashes every file
+    (SHA-256) as its chunks stream in and passes them on unchanged to the
+    handlers that store it. The hex digests end up in
+    request.upload_digests as {field name: [digest, ...]} in upload order.
+    """
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.digest = hashlib.sha256()
+
+    def receive_data_chunk(self, raw_data, start):
+        self.digest.update(raw_data)
+        return raw_data
+
+    def file_complete(self, file_size):
+        if not hasattr(self.request, 'upload_digests'):
+            self.request.upload_digests = {}
+        self.request.upload_digests.setdefault(self.field_name, []).append(self.digest.hexdigest())
+        return None  # the next handler builds the file object
+
+
+def hash_file(file_obj):
+    digest = hashlib.sha256()
+    for chunk in file_obj.chunks():
+        digest.update(chunk)
+    file_obj.seek(0)
+    return digest.hexdigest()
+
+
+def store_upload(file_obj, digest=None):
+    """
+    Saves an uploaded video under its content hash and returns (name,
+    digest). An identical video already in storage is not written again,
+    so re-uploads share one file. `digest` is the hash HashingUploadHandler
+    computed while the upload arrived; without it the file is read once more.
+    """
+    digest = digest or hash_file(file_obj)
+    name = f'videos/{digest}{os.path.splitext(file_obj.name)[1].lower()}'
+    if not default_storage.exists(name):
+        stored = default_storage.save(name, file_obj)
+        if stored != name:
+            # Another request stored the same video meanwhile; keep that copy
+            default_storage.delete(stored)
+    return name, digest
+
+
+def link_file(source, target):
+    """
+    Makes `target` a hard link to `source` (a copy where links aren't
+    possible), replacing any file at `target`.
+    """
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    temp = f'{target}.{uuid.uuid4().hex}.tmp'
+    try:
+        os.link(source, temp)
+    except OSError:
+        shutil.copyfile(source, temp)
+    os.replace(temp, target)
+
+
+def model_version():
+    """Detector backend and model file identity (name, size, mtime) for cache keys."""
+    backend = getattr(settings, 'DETECTOR_BACKEND', 'torch')
+    path = getattr(settings, 'DETECTOR_MODEL_PATH', None) or DEFAULT_MODEL_PATHS.get(backend, '')
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return [backend, os.path.basename(path)]
+    return [backend, os.path.basename(path), stat.st_size, int(stat.st_mtime)]
+
+
+def result_key(content_hash, area, options, imgsz):
+    """
+    Cache key of one analysis: the video's content hash, the detection
+    area (with the content it fixes the polygon scaled to the frame), the
+    result-changing options, model input size, model version and detector
+    and tracker thresholds.
+    """
+    from .detecter import EnhancedVehicleDetector
+    payload = {
+        'version': CACHE_VERSION,
+        'content': content_hash,
+        'area': area,
+        'options': {name: options.get(name) for name in RESULT_OPTIONS},
+        'imgsz': imgsz,
+        'model': model_version(),
+        'detector': [EnhancedVehicleDetector.confidence_threshold, EnhancedVehicleDetector.iou_threshold,
+                     EnhancedVehicleDetector.max_detections, getattr(settings, 'DETECTION_ROI_PADDING', 32)],
+        'tracker': {name: getattr(settings, name, None) for name in TRACKER_SETTINGS},
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+
+class ResultCache:
+    """
+    Analysis results of uploads by result_key(), in ResultCacheEntry rows,
+    with the rendered clip hard-linked under result_cache/. A hit hands out
+    another hard link, so it costs no extra disk space. When the cached
+    clips exceed RESULT_CACHE_MAX_BYTES the least recently used entries are
+    dropped; their clip's space is freed once no TrafficLog links to it.
+    """
+
+    def __init__(self, max_bytes=None):
+        self.max_bytes = getattr(settings, 'RESULT_CACHE_MAX_BYTES', 2 * 1024 ** 3) if max_bytes is None else max_bytes
+        self._lock = threading.Lock()
+
+    def get(self, key, with_video=True):
+        """The entry for `key`, or None; with `with_video` only if it has a processed clip."""
+        entry = ResultCacheEntry.objects.filter(key=key).first()
+        if entry is None:
+            return None
+        if with_video and not entry.processed_video:
+            return None
+        ResultCacheEntry.objects.filter(id=entry.id).update(hits=F('hits') + 1, last_used_at=now())
+        return entry
+
+    def put(self, key, content_hash, analysis):
+        """Caches an analyze_video() result, linking its processed clip if it has one."""
+        processed_video = ''
+        size = 0
+        if analysis.get('processed_name'):
+            processed_video = f'{CACHE_DIR}/{key}.mp4'
+            path = default_storage.path(processed_video)
+            link_file(default_storage.path(analysis['processed_name']), path)
+            size = os.path.getsize(path)
+        elif ResultCacheEntry.objects.filter(key=key).exclude(processed_video='').exists():
+            return  # a stats-only run; keep the entry that has a clip
+
+        ResultCacheEntry.objects.update_or_create(key=key, defaults={
+            'content_hash': content_hash,
+            'result': {name: value for name, value in analysis.items() if name != 'processed_name'},
+            'processed_video': processed_video,
+            'size': size,
+            'last_used_at': now(),
+        })
+        self.evict()
+
+    def evict(self):
+        """Drops least recently used entries until the cached clips fit in max_bytes."""
+        with self._lock:
+            total = ResultCacheEntry.objects.aggregate(total=Sum('size'))['total'] or 0
+            if total <= self.max_bytes:
+                return
+            for entry in ResultCacheEntry.objects.filter(size__gt=0).order_by('last_used_at').iterator():
+                if total <= self.max_bytes:
+                    break
+                default_storage.delete(entry.processed_video)
+                entry.delete()
+                total -= entry.size
+            print(f"[INFO] Result cache evicted down to {total} bytes")
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_result_cache():
+    """The process-wide ResultCache."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ResultCache()
+    return _cache
@@ -0,0 +1,194 @@
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Max, Sum, Value
+from django.db.models.functions import Greatest, TruncMinute
+from django.utils.timezone import now
+from .models import TrafficLog, TrafficRollup
+from .utils import number_to_letter
+
+# Granularity name -> bucket length in seconds
+GRANULARITIES = {'1m': 60, '15m': 900, '1h': 3600}
+
+# TrafficLog field -> rollup column prefix (<prefix>_sum / <prefix>_max)
+MEASURES = {
+    'vehicle_count': 'vehicle_count',
+    'traffic_weight': 'traffic_weight',
+    'Car': 'car',
+    'Truck': 'truck',
+    'Bus': 'bus',
+    'Motorcycle': 'motorcycle',
+    'Bicycle': 'bicycle',
+}
+
+
+def bucket_start(timestamp, seconds):
+    """Start of the `seconds`-long UTC bucket containing `timestamp`."""
+    epoch = int(timestamp.timestamp())
+    return datetime.fromtimestamp(epoch - epoch % seconds, tz=timezone.utc)
+
+
+class _Bucket:
+    __slots__ = ('samples', 'sums', 'maxes')
+
+    def __init__(self):
+        self.samples = 0
+        self.sums = {prefix: 0 for prefix in MEASURES.values()}
+        self.maxes = {prefix: 0 for prefix in MEASURES.values()}
+
+    def add(self, samples, sums, maxes):
+        self.samples += samples
+        for prefix in MEASURES.values():
+            self.sums[prefix] += sums[prefix]
+            self.maxes[prefix] = max(self.maxes[prefix], maxes[prefix])
+
+    def columns(self):
+        columns = {'samples': self.samples}
+        for prefix in MEASURES.values():
+            columns[f'{prefix}_sum'] = self.sums[prefix]
+            columns[f'{prefix}_max'] = self.maxes[prefix]
+        return columns
+
+
+def _bucket_key(key):
+    junction_id, signal_id, granularity, start = key
+    return {'junction_id': junction_id, 'signal_id': signal_id, 'granularity': granularity, 'bucket_start': start}
+
+
+def _rollup_row(key, bucket):
+    return TrafficRollup(**_bucket_key(key), **bucket.columns())
+
+
+def _add_to_bucket(key, bucket):
+    """Folds a bucket's values into its row with one UPDATE, creating the row when it doesn't exist yet."""
+    updates = {'samples': F('samples') + bucket.samples}
+    for prefix in MEASURES.values():
+        updates[f'{prefix}_sum'] = F(f'{prefix}_sum') + bucket.sums[prefix]
+        updates[f'{prefix}_max'] = Greatest(F(f'{prefix}_max'), Value(bucket.maxes[prefix]))
+    if TrafficRollup.objects.filter(**key).update(**updates):
+        return
+    try:
+        with transaction.atomic():
+            TrafficRollup.objects.create(**key, **bucket.columns())
+    except IntegrityError:
+        # Another writer created the row first
+        TrafficRollup.objects.filter(**key).update(**updates)
+
+
+def record_logs(logs):
+    """
+    Adds newly inserted TrafficLog rows to their 1m/15m/1h buckets. Logs
+    sharing a bucket are combined first; buckets that already exist get one
+    UPDATE each and new ones are inserted with a single bulk_create.
+    """
+    buckets = defaultdict(_Bucket)
+    for log in logs:
+        values = {prefix: getattr(log, field) or 0 for field, prefix in MEASURES.items()}
+        for granularity, seconds in GRANULARITIES.items():
+            key = (log.junction_id, log.signal_id, granularity, bucket_start(log.timestamp, seconds))
+            buckets[key].add(1, values, values)
+
+    keys = list(buckets)
+    pending = keys
+    # NULL junctions aren't covered by the unique constraint, so those always take the upsert path
+    if len(keys) > 3 and all(key[0] is not None for key in keys):
+        # Find the buckets that already exist with one query and insert the rest in bulk
+        existing = set(TrafficRollup.objects.filter(
+            junction_id__in={key[0] for key in keys},
+            signal_id__in={key[1] for key in keys},
+            bucket_start__gte=min(key[3] for key in keys),
+            bucket_start__lte=max(key[3] for key in keys),
+        ).values_list('junction_id', 'signal_id', 'granularity', 'bucket_start'))
+        try:
+            with transaction.atomic():
+                TrafficRollup.objects.bulk_create([
+                    _rollup_row(key, buckets[key]) for key in keys if key not in existing
+                ])
+            pending = [key for key in keys if key in existing]
+        except IntegrityError:
+            # Another writer created some of them; upsert every bucket one by one
+            pass
+
+    for key in pending:
+        _add_to_bucket(_bucket_key(key), buckets[key])
+
+
+def rebuild_rollups(start=None, end=None):
+    """
+    Recomputes every bucket between `start` and `end` (widened to whole
+    hours) from the raw TrafficLog rows. The database aggregates raw rows
+    per minute and the minute buckets are folded into 15m and 1h buckets
+    here. Returns the number of rollup rows written.
+    """
+    hour = GRANULARITIES['1h']
+    logs = TrafficLog.objects.all()
+    rollups = TrafficRollup.objects.all()
+    if start is not None:
+        start = bucket_start(start, hour)
+        logs = logs.filter(timestamp__gte=start)
+        rollups = rollups.filter(bucket_start__gte=start)
+    if end is not None:
+        end = bucket_start(end, hour) + timedelta(seconds=hour)
+        logs = logs.filter(timestamp__lt=end)
+        rollups = rollups.filter(bucket_start__lt=end)
+
+    aggregates = {'samples': Count('id')}
+    for field, prefix in MEASURES.items():
+        aggregates[f'{prefix}_sum'] = Sum(field)
+        aggregates[f'{prefix}_max'] = Max(field)
+    minutes = (logs.annotate(minute=TruncMinute('timestamp'))
+               .values('junction_id', 'signal_id', 'minute')
+               .annotate(**aggregates)
+               .order_by())
+
+    buckets = defaultdict(_Bucket)
+    for row in minutes.iterator():
+        sums = {prefix: row[f'{prefix}_sum'] or 0 for prefix in MEASURES.values()}
+        maxes = {prefix: row[f'{prefix}_max'] or 0 for prefix in MEASURES.values()}
+        for granularity, seconds in GRANULARITIES.items():
+            key = (row['junction_id'], row['signal_id'], granularity, bucket_start(row['minute'], seconds))
+            buckets[key].add(row['samples'], sums, maxes)
+
+    with transaction.atomic():
+        rollups.delete()
+        TrafficRollup.objects.bulk_create([_rollup_row(key, bucket) for key, bucket in buckets.items()],
+                                          batch_size=1000)
+    return len(buckets)
+
+
+def prune_rollups():
+    """
+    Deletes buckets older than their granularity's retention in
+    ROLLUP_RETENTION_DAYS (None keeps them forever). Returns the number of
+    rows deleted.
+    """
+    retention = getattr(settings, 'ROLLUP_RETENTION_DAYS', {'1m': 7, '15m': 90, '1h': None})
+    deleted = 0
+    for granularity, days in retention.items():
+        if days is None:
+            continue
+        deleted += TrafficRollup.objects.filter(
+            granularity=granularity, bucket_start__lt=now() - timedelta(days=days)
+        ).delete()[0]
+    return deleted
+
+
+def history_series(junction_id, signal_ids, granularity, start, end):
+    """
+    Buckets of each numeric signal id in [start, end), oldest first, as
+    [{'signal_id': letter, 'buckets': [...]}, ...].
+    """
+    fields = ['samples'] + [f'{prefix}_{kind}' for prefix in MEASURES.values() for kind in ('sum', 'max')]
+    rows = TrafficRollup.objects.filter(
+        junction_id=junction_id, granularity=granularity, signal_id__in=signal_ids,
+        bucket_start__gte=start, bucket_start__lt=end
+    ).order_by('signal_id', 'bucket_start').values('signal_id', 'bucket_start', *fields)
+
+    series = {signal_id: [] for signal_id in signal_ids}
+    for row in rows:
+        signal_id = row.pop('signal_id')
+        row['start'] = row.pop('bucket_start')
+        series[signal_id].append(row)
+    return [{'signal_id': number_to_letter(signal_id), 'buckets': buckets}
+            for signal_id, buckets in series.items()]
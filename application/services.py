@@ -1,8 +1,11 @@
+from django.db.models import F, Window
+from django.db.models.functions import RowNumber
 from .models import TrafficLog
+from .rollups import record_logs
 
 def log_traffic_data(signal_id, vehicle_count, traffic_weight, green_time, efficiency_score, vehicle_type_counts):
     try:
-        TrafficLog.objects.create(
+        log = TrafficLog.objects.create(
             signal_id=signal_id,
             vehicle_count=vehicle_count,
             traffic_weight=traffic_weight,
@@ -14,6 +17,60 @@ def log_traffic_data(signal_id, vehicle_count, traffic_weight, green_time, effic
             Bicycle=vehicle_type_counts.get('bicycle', 0),
             Bus=vehicle_type_counts.get('bus', 0),
         )
+        record_logs([log])
         print(f"Traffic data logged successfully for signal {signal_id}")
     except Exception as e:
         print(f"Error logging traffic data: {e}")
+
+
+def latest_logs(signal_ids, junction_id=None):
+    """
+    Latest TrafficLog of each numeric signal id, optionally within one
+    junction, fetched in a single query with a ROW_NUMBER() window over
+    (signal_id, timestamp). Returns {signal_id: log}; signals without logs
+    are missing from the dict.
+    """
+    queryset = TrafficLog.objects.filter(signal_id__in=signal_ids)
+    if junction_id:
+        queryset = queryset.filter(junction_id=junction_id)
+    queryset = queryset.annotate(row_number=Window(
+        expression=RowNumber(),
+        partition_by=[F('signal_id')],
+        order_by=[F('timestamp').desc(), F('id').desc()]
+    )).filter(row_number=1)
+    return {log.signal_id: log for log in queryset}
+
+
+def signal_stats(signal_letter, log, request=None):
+    """
+    Dashboard entry for one signal from its latest log (or the empty
+    defaults). Video URLs are absolute when a request is given.
+    """
+    if log is None:
+        return {
+            'id': signal_letter,
+            'vehicles': 0,
+            'weight': 0.0,
+            'efficiency': 0.0,
+            'time': 0,
+            'status': 'red',
+            'video': '',
+            'entries': 0,
+            'exits': 0,
+            'dwell': 0.0
+        }
+    video_url = log.processed_videos.url if log.processed_videos else ''
+    if video_url and request is not None:
+        video_url = request.build_absolute_uri(video_url)
+    return {
+        'id': signal_letter,
+        'vehicles': log.vehicle_count,
+        'weight': log.traffic_weight,
+        'efficiency': log.efficiency_score,
+        'time': log.green_time,
+        'status': 'green',
+        'video': video_url,
+        'entries': log.entries,
+        'exits': log.exits,
+        'dwell': log.avg_dwell_time
+    }
@@ -0,0 +1,153 @@
+import os
+import json
+import threading
+import time
+from functools import lru_cache
+from django.conf import settings
+from django.db import transaction
+from .EnhancedTrafficSignal import EnhancedTrafficSignal
+from .models import SignalState
+from .utils import letter_to_number, number_to_letter
+
+CONFIG_PATH = os.path.join(os.path.dirname(__file__), 'config.json')
+
+# EnhancedTrafficSignal attributes stored in SignalState columns of the same name
+STATE_FIELDS = ('min_green_time', 'max_green_time', 'current_state', 'remaining_time',
+                'calculated_green_time', 'last_log_id')
+
+
+@lru_cache(maxsize=None)
+def load_signal_config(path=CONFIG_PATH):
+    """
+    Per-signal timing limits from config.json as {letter: {'min_green_time',
+    'max_green_time'}}; the file's signal_0..signal_3 entries are signals
+    A..D. Read once per process.
+    """
+    try:
+        with open(path) as f:
+            signals = json.load(f).get('signals', {})
+    except (OSError, ValueError) as e:
+        print(f"[WARN] Failed to read signal config {path}: {e}")
+        return {}
+
+    config = {}
+    for key, values in signals.items():
+        index = key.rsplit('_', 1)[-1]
+        if not index.isdigit():
+            continue
+        config[number_to_letter(int(index) + 1)] = {
+            name: int(values[name]) for name in ('min_green_time', 'max_green_time') if name in values
+        }
+    return config
+
+
+def configured_signal(signal_id):
+    """A new EnhancedTrafficSignal with its config.json timing limits applied."""
+    signal = EnhancedTrafficSignal(signal_id)
+    for name, value in load_signal_config().get(signal_id, {}).items():
+        setattr(signal, name, value)
+    signal.default_green_time = max(signal.min_green_time, min(signal.default_green_time, signal.max_green_time))
+    signal.calculated_green_time = signal.default_green_time
+    signal.last_log_id = None
+    return signal
+
+
+def signal_from_state(state):
+    signal = configured_signal(number_to_letter(state.signal_id))
+    for name in STATE_FIELDS:
+        setattr(signal, name, getattr(state, name))
+    signal.default_green_time = max(signal.min_green_time, min(signal.default_green_time, signal.max_green_time))
+    signal.vehicle_history.extend(state.vehicle_history)
+    return signal
+
+
+def apply_to_state(signal, state):
+    for name in STATE_FIELDS:
+        setattr(state, name, getattr(signal, name))
+    state.vehicle_history = list(signal.vehicle_history)
+
+
+class SignalStateStore:
+    """
+    EnhancedTrafficSignal objects of each junction's signals, cached in
+    process and backed by SignalState rows so every worker shares them.
+
+    signals() serves reads from the cache, reloading a junction's rows at
+    most every SIGNAL_STATE_TTL seconds. update() locks the rows, hands
+    signals rebuilt from them to a function that changes them, and writes
+    them back in the same transaction, so concurrent processes never lose
+    each other's history. Signals without a row start from config.json.
+    Besides the usual attributes each signal carries `last_log_id`, the
+    latest TrafficLog folded into its history.
+    """
+
+    def __init__(self, ttl=None):
+        self.ttl = getattr(settings, 'SIGNAL_STATE_TTL', 1.0) if ttl is None else ttl
+        self._cache = {}  # junction_id -> (loaded_at, {letter: signal})
+        self._lock = threading.Lock()
+
+    def _rows(self, junction_id, signal_ids):
+        rows = SignalState.objects.filter(signal_id__in=[letter_to_number(signal_id) for signal_id in signal_ids])
+        if junction_id is None:
+            return rows.filter(junction__isnull=True)
+        return rows.filter(junction_id=junction_id)
+
+    def signals(self, junction_id, signal_ids):
+        """
+        {letter: EnhancedTrafficSignal} of a junction, possibly up to
+        SIGNAL_STATE_TTL seconds old. Treat them as read-only; change state
+        through update().
+        """
+        with self._lock:
+            loaded_at, cached = self._cache.get(junction_id, (None, {}))
+        if loaded_at is None or time.monotonic() - loaded_at > self.ttl or any(s not in cached for s in signal_ids):
+            cached = {number_to_letter(state.signal_id): signal_from_state(state)
+                      for state in self._rows(junction_id, signal_ids)}
+            for signal_id in signal_ids:
+                cached.setdefault(signal_id, configured_signal(signal_id))
+            with self._lock:
+                self._cache[junction_id] = (time.monotonic(), cached)
+        return {signal_id: cached[signal_id] for signal_id in signal_ids}
+
+    def update(self, junction_id, signal_ids, change):
+        """
+        Calls change({letter: signal}) on the current state of the signals
+        with their rows locked, saves what it changed and returns its result.
+        """
+        with transaction.atomic():
+            states = {state.signal_id: state for state in self._rows(junction_id, signal_ids).select_for_update()}
+            signals = {}
+            for signal_id in signal_ids:
+                state = states.get(letter_to_number(signal_id))
+                signals[signal_id] = signal_from_state(state) if state else configured_signal(signal_id)
+
+            result = change(signals)
+
+            for signal_id, signal in signals.items():
+                state = states.get(letter_to_number(signal_id))
+                if state is None:
+                    state = SignalState(junction_id=junction_id, signal_id=letter_to_number(signal_id))
+                apply_to_state(signal, state)
+                state.save()
+
+        with self._lock:
+            loaded_at, cached = self._cache.get(junction_id, (time.monotonic(), {}))
+            self._cache[junction_id] = (loaded_at, {**cached, **signals})
+        return result
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_signal_store():
+    """The process-wide SignalStateStore."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = SignalStateStore()
+    return _store
@@ -0,0 +1,245 @@
+import time
+import threading
+from collections import deque
+import cv2
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils.timezone import now
+from .events import publish_traffic_logs
+from .models import SignalSource, TrafficLog
+from .rollups import record_logs
+from .geometry import get_area_geometry
+from .detector_pool import DetectorUnavailable, get_detector_pool
+from .processing import build_tracker, efficiency_score, inference_size, parse_processing_options
+from .utils import letter_to_number, number_to_letter
+from .video import FrameScaler
+
+
+def load_sources(junction_id):
+    """Enabled stream sources of a junction as {signal letter: source}."""
+    return {
+        number_to_letter(item.signal_id): item.source
+        for item in SignalSource.objects.filter(junction_id=junction_id, enabled=True)
+    }
+
+
+class FrameGrabber:
+    """
+    Reads a capture source on its own thread and keeps only the newest
+    `queue_size` frames. When detection falls behind, the oldest frames are
+    dropped instead of queueing up, so what is analysed is always recent.
+
+    `source` is anything cv2.VideoCapture opens; a string of digits is used
+    as a camera index. With `replay` a file is read at its own frame rate
+    and restarted at the end, standing in for a live camera. Live sources
+    are reopened after `reconnect_delay` seconds when they fail.
+    """
+
+    def __init__(self, source, queue_size=2, replay=False, reconnect_delay=2.0):
+        self.source = source
+        self.replay = replay
+        self.reconnect_delay = reconnect_delay
+        self.frames = deque(maxlen=max(1, int(queue_size)))
+        self.fps = None
+        self.frames_read = 0
+        self.frames_dropped = 0
+        self._condition = threading.Condition()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True, name=f'grabber-{source}')
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        with self._condition:
+            self._condition.notify_all()
+        self._thread.join(timeout=5)
+
+    def open_capture(self):
+        source = int(self.source) if str(self.source).isdigit() else self.source
+        cap = cv2.VideoCapture(source)
+        if not self.replay:
+            # Don't let the backend buffer frames we would only drop later
+            cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+        return cap
+
+    def _run(self):
+        while not self._stop.is_set():
+            cap = self.open_capture()
+            if not cap.isOpened():
+                print(f"[WARN] Cannot open stream {self.source}, retrying in {self.reconnect_delay}s")
+                cap.release()
+                self._stop.wait(self.reconnect_delay)
+                continue
+
+            self.fps = cap.get(cv2.CAP_PROP_FPS) or 25
+            frame_interval = 1.0 / self.fps
+            next_frame = time.monotonic()
+            try:
+                while not self._stop.is_set():
+                    ret, frame = cap.read()
+                    if not ret:
+                        break
+                    if self.replay:
+                        next_frame += frame_interval
+                        delay = next_frame - time.monotonic()
+                        if delay > 0:
+                            self._stop.wait(delay)
+                    with self._condition:
+                        if len(self.frames) == self.frames.maxlen:
+                            self.frames_dropped += 1
+                        self.frames.append((time.monotonic(), frame))
+                        self.frames_read += 1
+                        self._condition.notify()
+            finally:
+                cap.release()
+
+            if not self._stop.is_set() and not self.replay:
+                print(f"[WARN] Stream {self.source} ended, reconnecting in {self.reconnect_delay}s")
+                self._stop.wait(self.reconnect_delay)
+
+    def take(self, timeout=0.5):
+        """Waits up to `timeout` seconds for frames and returns every buffered (timestamp, frame), oldest first."""
+        with self._condition:
+            if not self.frames:
+                self._condition.wait(timeout)
+            frames = list(self.frames)
+            self.frames.clear()
+        return frames
+
+
+class SignalStream:
+    """
+    Continuous detection for one signal: frames from a FrameGrabber go
+    through the detector and a VehicleTracker, and every `interval` seconds
+    the window's aggregates are written as a TrafficLog row.
+    """
+
+    def __init__(self, junction_id, signal_id, source, options, interval=5.0, replay=False, queue_size=2):
+        self.junction_id = junction_id
+        self.signal_id = signal_id
+        self.options = options
+        self.interval = interval
+        self.grabber = FrameGrabber(source, queue_size=queue_size, replay=replay)
+        self.frames_analyzed = 0
+        self.latest = None
+
+    def run(self, stop_event):
+        # A stream keeps its detector for as long as it runs
+        try:
+            with get_detector_pool().lease() as detector:
+                self.detect(stop_event, detector)
+        except DetectorUnavailable as e:
+            print(f"[ERROR] Stream of signal {self.signal_id} stopped, no detector: {e}")
+
+    def detect(self, stop_event, detector):
+        close_old_connections()
+        imgsz = inference_size(self.signal_id, self.options)
+        tracker = None
+        scaler = None
+        window_started = now()
+        next_flush = time.monotonic() + self.interval
+
+        self.grabber.start()
+        try:
+            while not stop_event.is_set():
+                batch = self.grabber.take(timeout=min(0.5, self.interval))
+                if batch:
+                    timestamps, frames = zip(*batch)
+                    height, width = frames[0].shape[:2]
+                    if tracker is None or scaler.source_size != (width, height):
+                        scaler = FrameScaler(width, height, self.options.get('analysis_height'))
+                        tracker = build_tracker(detector, self.grabber.fps or 25, scaler.size)
+                    frames = [scaler(frame) for frame in frames]
+                    # Looked up per batch so a redrawn area applies without a restart
+                    geometry = get_area_geometry(self.signal_id, *scaler.size)
+                    if geometry is None:
+                        print(f"[ERROR] Area not defined for signal {self.signal_id}, stopping its stream")
+                        break
+                    detections = detector.detect_objects_batch(frames, geometry, imgsz=imgsz,
+                                                               roi_crop=self.options.get('roi_crop', False))
+                    for timestamp, (xyxy, class_ids, confidences, inside) in zip(timestamps, detections):
+                        tracker.update(xyxy, detector.class_index(class_ids), confidences, inside, timestamp)
+                    self.frames_analyzed += len(frames)
+
+                if time.monotonic() >= next_flush:
+                    self.flush(tracker, window_started)
+                    window_started = now()
+                    next_flush += self.interval
+        finally:
+            self.grabber.stop()
+            if tracker is not None:
+                self.flush(tracker, window_started)
+            close_old_connections()
+
+    def flush(self, tracker, window_started):
+        if tracker is None:
+            return None
+        summary = tracker.window_summary()
+        vehicle_type_counts = summary['vehicle_type_counts']
+        log = TrafficLog.objects.create(
+            junction_id=self.junction_id,
+            signal_id=letter_to_number(self.signal_id),
+            vehicle_count=summary['unique_vehicles'],
+            traffic_weight=summary['traffic_weight'],
+            green_time=10,
+            efficiency_score=efficiency_score(summary['unique_vehicles'], summary['traffic_weight']),
+            Car=vehicle_type_counts.get('car', 0),
+            Truck=vehicle_type_counts.get('truck', 0),
+            Bus=vehicle_type_counts.get('bus', 0),
+            Motorcycle=vehicle_type_counts.get('motorcycle', 0),
+            Bicycle=vehicle_type_counts.get('bicycle', 0),
+            entries=summary['entries'],
+            exits=summary['exits'],
+            avg_dwell_time=summary['avg_dwell_time'],
+            timestamp=now()
+        )
+        record_logs([log])
+        publish_traffic_logs([log])
+        self.latest = dict(summary, log_id=log.id, window_started=window_started,
+                           frames_read=self.grabber.frames_read, frames_dropped=self.grabber.frames_dropped)
+        return log
+
+
+class StreamIngestor:
+    """
+    Runs a SignalStream per signal of a junction, each on its own thread
+    with its own detector from the DetectorPool (grown to one per stream),
+    until stop() is called.
+    `sources` maps signal letters to capture sources.
+    """
+
+    def __init__(self, junction_id, sources, options=None, interval=None, replay=False, queue_size=None):
+        self.junction_id = junction_id
+        options = options or parse_processing_options({})
+        interval = interval or getattr(settings, 'STREAM_AGGREGATE_INTERVAL', 5.0)
+        queue_size = queue_size or getattr(settings, 'STREAM_QUEUE_SIZE', 2)
+        self.streams = [
+            SignalStream(junction_id, signal_id, source, options, interval=interval,
+                         replay=replay, queue_size=queue_size)
+            for signal_id, source in sorted(sources.items())
+        ]
+        self._stop = threading.Event()
+        self._threads = []
+
+    def start(self):
+        get_detector_pool().reserve(len(self.streams))
+        for stream in self.streams:
+            thread = threading.Thread(target=stream.run, args=(self._stop,), daemon=True,
+                                      name=f'stream-{self.junction_id}-{stream.signal_id}')
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        self._stop.set()
+        for thread in self._threads:
+            thread.join()
+
+    def wait(self, duration=None):
+        """Blocks until stop() is called, every stream has ended, or `duration` seconds have passed."""
+        deadline = time.monotonic() + duration if duration else None
+        while not self._stop.is_set() and any(thread.is_alive() for thread in self._threads):
+            if deadline is not None and time.monotonic() >= deadline:
+                break
+            self._stop.wait(0.5)
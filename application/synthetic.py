@@ -0,0 +1,166 @@
+import numpy as np
+import cv2
+from .geometry import AreaGeometry, scale_points
+
+# Clip sizes offered by the benchmark, synthetic_video and loadtest commands
+RESOLUTIONS = {
+    '480p': (854, 480),
+    '1080p': (1920, 1080),
+    '4k': (3840, 2160),
+}
+
+# Vehicle sprites: COCO class id, BGR colour, (length, thickness) as a share of
+# the lane pitch, and the share of the traffic. The colours are far apart from
+# each other and from the gray road, so SceneBackend can read the boxes back
+# from a decoded clip.
+SPRITES = {
+    'car': (2, (40, 40, 220), (1.3, 0.55), 0.55),
+    'truck': (7, (220, 60, 30), (2.4, 0.7), 0.1),
+    'bus': (5, (0, 210, 250), (2.8, 0.7), 0.07),
+    'motorcycle': (3, (220, 40, 220), (0.6, 0.3), 0.18),
+    'bicycle': (1, (40, 220, 40), (0.5, 0.25), 0.1),
+}
+
+ROAD_COLOR = (90, 90, 90)
+MARKING_COLOR = (200, 200, 200)
+
+
+class TrafficScene:
+    """
+    A seeded clip of vehicles driving along horizontal lanes, with its
+    ground truth. Each lane has a direction and a speed shared by all its
+    vehicles, and arrivals are spaced so vehicles never overlap. The same
+    arguments always give the same frames and boxes.
+
+    `rate` is the mean number of vehicles entering each lane per second.
+    The road is already filled at frame 0.
+    """
+
+    def __init__(self, width, height, frames, lanes=4, rate=0.5, fps=25, seed=0):
+        rng = np.random.default_rng(seed)
+        self.width = width
+        self.height = height
+        self.frames = frames
+        self.fps = fps
+        self.pitch = 0.8 * height / lanes
+        self.lane_y = 0.1 * height + self.pitch * (np.arange(lanes) + 0.5)
+        self.directions = np.where(np.arange(lanes) % 2 == 0, 1, -1)
+        self.speeds = rng.uniform(0.004, 0.012, lanes) * width  # pixels per frame
+
+        names = list(SPRITES)
+        shares = np.array([SPRITES[name][3] for name in names])
+        longest = max(length for _, _, (length, _), _ in SPRITES.values()) * self.pitch
+        lane, kind, entry = [], [], []
+        for index in range(lanes):
+            # Start early enough that vehicles are spread over the road at frame 0
+            time = -(width + longest) / self.speeds[index]
+            while time < frames:
+                choice = rng.choice(len(names), p=shares / shares.sum())
+                lane.append(index)
+                kind.append(choice)
+                entry.append(time)
+                # Next arrival, but never before this vehicle plus a gap has cleared the lane start
+                length = SPRITES[names[choice]][2][0] * self.pitch
+                time += max(rng.exponential(fps / rate), (length + 0.6 * self.pitch) / self.speeds[index])
+
+        self.class_names = [names[i] for i in kind]
+        self.lanes = np.array(lane, dtype=np.int64)
+        self.entries = np.array(entry, dtype=np.float64)
+        self.class_ids = np.array([SPRITES[name][0] for name in self.class_names], dtype=np.int64)
+        self.colors = np.array([SPRITES[name][1] for name in self.class_names], dtype=np.uint8).reshape(-1, 3)
+        sizes = np.array([SPRITES[name][2] for name in self.class_names], dtype=np.float64).reshape(-1, 2)
+        self.lengths = sizes[:, 0] * self.pitch
+        self.thicknesses = sizes[:, 1] * self.pitch
+
+        self.background = np.full((height, width, 3), ROAD_COLOR, dtype=np.uint8)
+        for y in (0.1 * height + self.pitch * np.arange(lanes + 1)).astype(int):
+            cv2.line(self.background, (0, y), (width, y), MARKING_COLOR, max(1, height // 240))
+
+    def boxes(self, index):
+        """
+        (vehicle ids, xyxy boxes, COCO class ids) of the vehicles visible in
+        frame `index`, as drawn: integer pixel boxes clipped to the frame.
+        """
+        elapsed = index - self.entries
+        travelled = self.speeds[self.lanes] * elapsed
+        forward = self.directions[self.lanes] > 0
+        x1 = np.where(forward, travelled - self.lengths, self.width - travelled)
+        y1 = self.lane_y[self.lanes] - self.thicknesses / 2
+        xyxy = np.rint(np.stack([x1, y1, x1 + self.lengths, y1 + self.thicknesses], axis=1))
+        xyxy[:, [0, 2]] = xyxy[:, [0, 2]].clip(0, self.width)
+        xyxy[:, [1, 3]] = xyxy[:, [1, 3]].clip(0, self.height)
+        visible = np.flatnonzero((elapsed >= 0) & (xyxy[:, 2] > xyxy[:, 0]))
+        return visible, xyxy[visible].astype(np.int64), self.class_ids[visible]
+
+    def frame(self, index):
+        frame = self.background.copy()
+        ids, xyxy, _ = self.boxes(index)
+        for vehicle, (x1, y1, x2, y2) in zip(ids, xyxy):
+            frame[y1:y2, x1:x2] = self.colors[vehicle]
+        return frame
+
+    def write(self, path, fps=None):
+        """Writes all frames of the scene as an MP4 clip."""
+        fps = fps or self.fps
+        writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'mp4v'), fps, (self.width, self.height))
+        if not writer.isOpened():
+            raise OSError(f'Cannot write synthetic clip {path}')
+        try:
+            for index in range(self.frames):
+                writer.write(self.frame(index))
+        finally:
+            writer.release()
+
+    def ground_truth(self, area, indices=None, min_hits=1):
+        """
+        What a perfect detector and tracker would report for detection area
+        `area` (canvas points, as in areas.json) over frames `indices`
+        (default: all). vehicle_count is the number of vehicles seen in at
+        least `min_hits` of those frames whose box centre lies inside the
+        area in at least one of them. That is the tracked count of a
+        tracker with the same min_hits. frame_vehicle_count sums the
+        vehicles inside per frame, which is the per-frame counting mode.
+        Entries and exits of counted vehicles are outside->inside and
+        inside->outside changes between consecutive observations. Dwell is
+        the time from the first to the last observation inside, plus one
+        sampling interval, as VehicleTracker reports it.
+        """
+        geometry = AreaGeometry(scale_points(area, self.width, self.height), self.width, self.height)
+        indices = list(range(self.frames) if indices is None else indices)
+        step = (indices[1] - indices[0]) if len(indices) > 1 else 1
+        seen = set()
+        last_state = {}  # vehicle -> inside at its previous observation
+        hits, first_inside, last_inside = {}, {}, {}
+        entries, exits = {}, {}
+        frame_vehicle_count = 0
+        for index in indices:
+            ids, xyxy, _ = self.boxes(index)
+            centers = (xyxy[:, :2] + xyxy[:, 2:]) // 2
+            for vehicle, inside in zip(ids.tolist(), geometry.contains(centers).tolist()):
+                previous = last_state.get(vehicle)
+                if previous is not None and inside != previous:
+                    changes = entries if inside else exits
+                    changes[vehicle] = changes.get(vehicle, 0) + 1
+                last_state[vehicle] = inside
+                hits[vehicle] = hits.get(vehicle, 0) + 1
+                if inside:
+                    first_inside.setdefault(vehicle, index)
+                    last_inside[vehicle] = index
+                    frame_vehicle_count += 1
+            seen.update(ids.tolist())
+
+        counted = [vehicle for vehicle in first_inside if hits[vehicle] >= min_hits]
+        vehicle_type_counts = {name: 0 for name in SPRITES}
+        for vehicle in counted:
+            vehicle_type_counts[self.class_names[vehicle]] += 1
+        dwell = [(last_inside[vehicle] - first_inside[vehicle] + step) / self.fps for vehicle in counted]
+        return {
+            'frames': len(indices),
+            'vehicles_visible': len(seen),
+            'vehicle_count': len(counted),
+            'vehicle_type_counts': vehicle_type_counts,
+            'frame_vehicle_count': frame_vehicle_count,
+            'entries': sum(entries.get(vehicle, 0) for vehicle in counted),
+            'exits': sum(exits.get(vehicle, 0) for vehicle in counted),
+            'avg_dwell_time': round(sum(dwell) / len(dwell), 2) if dwell else 0.0,
+        }
@@ -1,3 +1,1209 @@
-from django.test import TestCase
+import os
+import glob
+import json
+import time
+import shutil
+import asyncio
+import tempfile
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from unittest import skipUnless
+from unittest.mock import MagicMock, patch
+import cv2
+import numpy as np
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import override_settings
+from django.utils.timezone import now
+from .backends import SceneBackend, StubBackend
+from .benchmarks import compare_results, pooled_detector, run_suite
+from .controller import POLICIES, JunctionController
+from .detecter import VEHICLE_WEIGHTS, EnhancedVehicleDetector
+from .detector_pool import WARMUP_AREA, DetectorPool, DetectorUnavailable
+from .events import DatabaseBroker
+from .geometry import AreaGeometry, geometry_for_points, invalidate_area_cache, points_in_polygon
+from .geometry import scale_points
+from .jobs import claim_job, create_job, requeue_stale_jobs, resume_jobs, run_job
+from .metrics import FRAMES, JOBS, REGISTRY, STAGE_SECONDS, VIDEOS, Counter, Histogram, StageTimer
+from .metrics import record_timings
+from .models import BrokerEvent, JunctionSignals, ProcessingJob, ResultCacheEntry, TrafficLog, TrafficRollup
+from .processing import ProcessingError, build_tracker, parse_processing_options, process_signal_video
+from .processing import render_traffic_log
+from .result_cache import ResultCache, result_key, store_upload
+from .rollups import bucket_start, rebuild_rollups, record_logs
+from .simulation import JunctionSimulator
+from .streams import SignalStream
+from .synthetic import TrafficScene
+from .tracking import VehicleTracker
+from .video import SAMPLING_MODES, FrameSampler, FrameScaler
+from .workers import process_signals_in_pool
 
-# Create your tests here.
+
+def ffmpeg_available():
+    return shutil.which(getattr(settings, 'FFMPEG_PATH', None) or 'ffmpeg') is not None
+
+
+class BenchmarkSmokeTests(TestCase):
+    """The benchmark suite runs end to end on small inputs with the stub detector."""
+
+    options = {'resolutions': ['480p'], 'detectors': ['stub'], 'frames': 8, 'repeat': 1, 'seed': 0,
+               'points': 2000, 'signals': 200, 'updates': 5}
+
+    def assert_measured(self, result):
+        self.assertNotIn('skipped', result)
+        self.assertGreater(result['items'], 0)
+        self.assertGreater(result['per_sec'], 0)
+        self.assertLessEqual(result['p50_ms'], result['p99_ms'])
+
+    def test_run_suite_with_stub_detector(self):
+        report = run_suite(['point_in_polygon', 'detect_vehicles_in_area', 'adaptive_green_time'], **self.options)
+        self.assertIn('commit', report['environment'])
+        self.assertEqual(set(report['results']), {
+            'point_in_polygon', 'point_in_polygon/area_geometry', 'point_in_polygon/area_geometry_uncached',
+            'detect_vehicles_in_area/stub/480p',
+            'adaptive_green_time',
+        })
+        for result in report['results'].values():
+            self.assert_measured(result)
+
+    @skipUnless(ffmpeg_available(), 'ffmpeg is not installed')
+    def test_pipeline_with_stub_detector(self):
+        report = run_suite(['pipeline'], **self.options)
+        self.assert_measured(report['results']['pipeline/stub/480p'])
+
+    def test_compare_results_flags_regression(self):
+        baseline = {'results': {
+            'fast': {'per_sec': 100.0, 'p50_ms': 10.0},
+            'slow': {'per_sec': 100.0, 'p50_ms': 10.0},
+            'skipped': {'skipped': 'no model'},
+        }}
+        current = {'results': {
+            'fast': {'per_sec': 150.0, 'p50_ms': 8.0},
+            'slow': {'per_sec': 50.0, 'p50_ms': 20.0},
+            'skipped': {'per_sec': 10.0, 'p50_ms': 1.0},
+            'new': {'per_sec': 10.0, 'p50_ms': 1.0},
+        }}
+        rows = {name: (before, after, change, p50_change)
+                for name, before, after, change, p50_change in compare_results(baseline, current)}
+        self.assertEqual(set(rows), {'fast', 'slow'})
+        self.assertAlmostEqual(rows['slow'][2], -0.5)
+        self.assertAlmostEqual(rows['slow'][3], 1.0)
+        self.assertAlmostEqual(rows['fast'][2], 0.5)
+
+
+class TrackerTests(TestCase):
+    """VehicleTracker fed the exact boxes of a TrafficScene reports the scene's ground truth."""
+
+    area = [[100, 100], [700, 100], [700, 500], [100, 500]]
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.detector = EnhancedVehicleDetector(backend='stub')
+
+    def replay(self, scene, stride):
+        geometry = AreaGeometry(scale_points(self.area, scene.width, scene.height), scene.width, scene.height)
+        tracker = build_tracker(self.detector, scene.fps / stride, (scene.width, scene.height))
+        for index in range(0, scene.frames, stride):
+            _, xyxy, class_ids = scene.boxes(index)
+            centers = (xyxy[:, :2] + xyxy[:, 2:]) // 2
+            tracker.update(xyxy, self.detector.class_index(class_ids), np.full(len(xyxy), 0.9),
+                           geometry.contains(centers), index / scene.fps)
+        return tracker.summary()
+
+    def test_counts_match_ground_truth(self):
+        for seed in (0, 3, 5, 7):
+            scene = TrafficScene(1280, 720, 250, seed=seed)
+            for stride in (1, 3, 5):
+                with self.subTest(seed=seed, stride=stride):
+                    summary = self.replay(scene, stride)
+                    truth = scene.ground_truth(self.area, range(0, scene.frames, stride),
+                                               min_hits=settings.TRACKER_MIN_HITS)
+                    self.assertEqual(summary['unique_vehicles'], truth['vehicle_count'])
+                    self.assertEqual(summary['vehicle_type_counts'], truth['vehicle_type_counts'])
+                    self.assertEqual(summary['entries'], truth['entries'])
+                    self.assertEqual(summary['exits'], truth['exits'])
+                    self.assertAlmostEqual(summary['avg_dwell_time'], truth['avg_dwell_time'], delta=0.011)
+
+    def test_track_leaving_the_frame_is_not_continued_by_a_new_vehicle(self):
+        # Vehicle 17 leaves at the right edge in frame 76; vehicle 28 enters there in frame 96
+        scene = TrafficScene(1280, 720, 250, seed=3)
+        summary = self.replay(scene, 1)
+        self.assertEqual(summary['unique_vehicles'], 17)
+
+    def test_window_reports_transitions_of_confirmed_tracks_only(self):
+        tracker = VehicleTracker(['car'], [1.0], min_hits=3)
+        box = np.array([[100, 100, 140, 130]], dtype=np.float64)
+        step = np.array([10, 0, 10, 0])
+        # A false detection seen twice, outside then inside: it never reaches min_hits
+        ghost = np.array([[600, 400, 640, 430]], dtype=np.float64)
+        for frame, inside in enumerate((False, True)):
+            tracker.update(np.vstack([box + frame * step, ghost]), [0, 0], [0.9, 0.9], [inside, inside], frame * 0.04)
+        summary = tracker.window_summary()
+        self.assertEqual((summary['unique_vehicles'], summary['entries'], summary['exits']), (0, 0, 0))
+
+        # The vehicle is confirmed on its third hit; its earlier entry is reported with it
+        tracker.update(box + 2 * step, [0], [0.9], [True], 0.08)
+        summary = tracker.window_summary()
+        self.assertEqual((summary['unique_vehicles'], summary['entries'], summary['exits']), (1, 1, 0))
+
+        tracker.update(box + 3 * step, [0], [0.9], [False], 0.12)
+        summary = tracker.window_summary()
+        self.assertEqual((summary['unique_vehicles'], summary['entries'], summary['exits']), (0, 0, 1))
+        # The ghost has expired without ever being reported
+        tracker.update(box + 4 * step, [0], [0.9], [False], 2.0)
+        summary = tracker.window_summary()
+        self.assertEqual((summary['unique_vehicles'], summary['entries'], summary['exits']), (0, 0, 0))
+        self.assertEqual((tracker.summary()['entries'], tracker.summary()['exits']), (1, 1))
+
+    def test_windows_add_up_to_the_summary(self):
+        scene = TrafficScene(1280, 720, 250, seed=0)
+        geometry = AreaGeometry(scale_points(self.area, scene.width, scene.height), scene.width, scene.height)
+        tracker = build_tracker(self.detector, scene.fps, (scene.width, scene.height))
+        windows = []
+        for index in range(scene.frames):
+            _, xyxy, class_ids = scene.boxes(index)
+            centers = (xyxy[:, :2] + xyxy[:, 2:]) // 2
+            tracker.update(xyxy, self.detector.class_index(class_ids), np.full(len(xyxy), 0.9),
+                           geometry.contains(centers), index / scene.fps)
+            if index % 25 == 24:
+                windows.append(tracker.window_summary())
+        summary = tracker.summary()
+        for name in ('unique_vehicles', 'entries', 'exits'):
+            self.assertEqual(sum(window[name] for window in windows), summary[name])
+
+
+class DetectorPoolTests(TestCase):
+    """A detector whose model failed to load fails the pool instead of silently simulating detections."""
+
+    def missing_model_pool(self):
+        return DetectorPool(size=1, factory=lambda: EnhancedVehicleDetector(backend='onnx',
+                                                                            model_path='/nonexistent/model.onnx'))
+
+    def test_warm_up_fails_without_model(self):
+        pool = self.missing_model_pool()
+        self.assertFalse(pool.warm_up())
+        status = pool.status()
+        self.assertFalse(status['ready'])
+        self.assertEqual(status['state'], 'failed')
+        self.assertIn('onnx', status['error'])
+
+    def test_lease_without_model_fails_cold_pool(self):
+        pool = self.missing_model_pool()
+        with self.assertRaisesRegex(DetectorUnavailable, 'onnx'):
+            with pool.lease():
+                pass
+        status = pool.status()
+        self.assertEqual(status['state'], 'failed')
+        # The failed detector isn't handed out later
+        self.assertEqual(status['loaded'], 0)
+        with self.assertRaises(DetectorUnavailable):
+            pool.acquire(timeout=1)
+
+    def test_stub_backend_is_ready(self):
+        pool = DetectorPool(size=1, factory=lambda: EnhancedVehicleDetector(backend='stub'))
+        self.assertTrue(pool.warm_up())
+        self.assertTrue(pool.status()['ready'])
+
+    def test_readiness_returns_503_without_model(self):
+        pool = self.missing_model_pool()
+        pool.warm_up()
+        with patch('application.views.get_detector_pool', return_value=pool):
+            response = self.client.get('/api/health/ready/')
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.json()['detector']['state'], 'failed')
+
+
+class BackendParityTests(TestCase):
+    """
+    Backends agree on per-class vehicle counts inside the area of a
+    TrafficScene clip; torch and ONNX also on the sample clips in
+    media/videos.
+    """
+
+    area = [[100, 60], [540, 60], [540, 300], [100, 300]]
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.scene = TrafficScene(854, 480, 40, seed=1)
+        cls.frames = [cls.scene.frame(index) for index in range(cls.scene.frames)]
+        cls.geometry = AreaGeometry(scale_points(cls.area, 854, 480), 854, 480)
+
+    def class_counts(self, detector, frames=None, geometry=None):
+        """Detections inside the area per vehicle class, summed over the clip (by default the scene's)."""
+        frames = self.frames if frames is None else frames
+        geometry = geometry or self.geometry
+        counts = np.zeros(len(detector.vehicle_classes), dtype=np.int64)
+        for start in range(0, len(frames), 8):
+            for _, class_ids, _, inside in detector.detect_objects_batch(frames[start:start + 8], geometry):
+                counts += np.bincount(detector.class_index(class_ids[inside]), minlength=len(counts))
+        return dict(zip(detector.vehicle_classes, counts.tolist()))
+
+    def sample_frames(self, path, frames=96, stride=4):
+        """Every `stride`th of the first `frames` frames of a clip, and a full-frame geometry for it."""
+        cap = cv2.VideoCapture(path)
+        width, height = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        sample = []
+        try:
+            for index in range(frames):
+                ok, frame = cap.read()
+                if not ok:
+                    break
+                if index % stride == 0:
+                    sample.append(frame)
+        finally:
+            cap.release()
+        return sample, AreaGeometry(scale_points(WARMUP_AREA, width, height), width, height)
+
+    def truth_counts(self, detector):
+        counts = dict.fromkeys(detector.vehicle_classes, 0)
+        for index in range(self.scene.frames):
+            _, xyxy, class_ids = self.scene.boxes(index)
+            inside = self.geometry.contains((xyxy[:, :2] + xyxy[:, 2:]) // 2)
+            for class_index in detector.class_index(class_ids[inside]):
+                counts[detector.vehicle_classes[class_index]] += 1
+        return counts
+
+    def test_scene_backend_matches_ground_truth(self):
+        detector = EnhancedVehicleDetector(backend='scene')
+        self.assertIsInstance(detector.model, SceneBackend)
+        self.assertEqual(self.class_counts(detector), self.truth_counts(detector))
+
+    def test_stub_backend_counts_agree_between_detection_paths(self):
+        objects = EnhancedVehicleDetector(backend='stub')
+        vehicles = EnhancedVehicleDetector(backend='stub')
+        self.assertIsInstance(objects.model, StubBackend)
+        counts = dict.fromkeys(vehicles.vehicle_classes, 0)
+        for _, _, _, frame_counts in vehicles.detect_vehicles_batch(self.frames, self.geometry, annotate=False):
+            for name, count in frame_counts.items():
+                counts[name] += count
+        self.assertEqual(self.class_counts(objects), counts)
+
+    def test_torch_and_onnx_counts_match(self):
+        clips = sorted(glob.glob(os.path.join(settings.BASE_DIR, 'media', 'videos', '*.mp4')))
+        if not clips:
+            self.skipTest('No sample clips in media/videos')
+        baseline, candidate = [EnhancedVehicleDetector(backend=backend) for backend in ('torch', 'onnx')]
+        for detector in (baseline, candidate):
+            if detector.model is None:
+                self.skipTest(detector.load_error)
+
+        for path in clips:
+            with self.subTest(clip=os.path.basename(path)):
+                frames, geometry = self.sample_frames(path)
+                self.assertTrue(frames, f'Cannot read {path}')
+                expected = self.class_counts(baseline, frames, geometry)
+                counts = self.class_counts(candidate, frames, geometry)
+                # Both must see traffic, or agreeing on nothing proves nothing
+                self.assertGreater(sum(expected.values()), 0)
+                self.assertGreater(sum(counts.values()), 0)
+                # Exported weights differ in the last float bits, which can flip a borderline detection
+                for name, count in expected.items():
+                    self.assertLessEqual(abs(counts[name] - count), max(1, 0.05 * count), name)
+
+
+class SlowDetector(EnhancedVehicleDetector):
+    """A scene detector that takes `delay` seconds per batch, so a stream falls behind its source."""
+
+    delay = 0.1
+
+    def detect_objects_batch(self, frames, area_points, imgsz=None, roi_crop=None):
+        time.sleep(self.delay)
+        return super().detect_objects_batch(frames, area_points, imgsz=imgsz, roi_crop=roi_crop)
+
+
+class SignalStreamTests(TransactionTestCase):
+    """
+    A SignalStream reading a TrafficScene clip replayed at its frame rate,
+    as a camera would deliver it, with the scene backend. Runs the stream
+    on the test thread (TrafficLog rows are written by it) and stops it
+    from a timer before the replay restarts the clip.
+    """
+
+    area = [[100, 60], [540, 60], [540, 300], [100, 300]]
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.scene = TrafficScene(854, 480, 100, seed=4)
+        self.path = os.path.join(self.directory, 'stream.mp4')
+        self.scene.write(self.path)
+        areas_path = os.path.join(self.directory, 'areas.json')
+        with open(areas_path, 'w') as f:
+            json.dump({'A': self.area}, f)
+        areas_patch = patch('application.geometry.AREAS_PATH', areas_path)
+        areas_patch.start()
+        self.addCleanup(areas_patch.stop)
+        invalidate_area_cache()
+        self.addCleanup(invalidate_area_cache)
+        self.junction = JunctionSignals.objects.create(name='Stream test')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def run_stream(self, detector, seconds, interval, queue_size):
+        stream = SignalStream(self.junction.id, 'A', self.path, parse_processing_options({}),
+                              interval=interval, replay=True, queue_size=queue_size)
+        stop = threading.Event()
+        timer = threading.Timer(seconds, stop.set)
+        timer.start()
+        try:
+            stream.detect(stop, detector)
+        finally:
+            timer.cancel()
+        return stream, list(TrafficLog.objects.filter(junction=self.junction).order_by('id'))
+
+    def test_windows_are_written_at_interval_without_double_counting(self):
+        stream, logs = self.run_stream(EnhancedVehicleDetector(backend='scene'), 3.0, 0.5, queue_size=250)
+        self.assertEqual(stream.grabber.frames_dropped, 0)
+        self.assertLess(stream.frames_analyzed, self.scene.frames)
+
+        # One log per interval, then the partial window flushed on stop
+        self.assertTrue(5 <= len(logs) <= 7, len(logs))
+        for previous, log in zip(logs, logs[1:-1]):
+            self.assertAlmostEqual((log.timestamp - previous.timestamp).total_seconds(), 0.5, delta=0.2)
+
+        # Summed over windows, each vehicle of the analysed frames is counted exactly once
+        truth = self.scene.ground_truth(self.area, range(stream.frames_analyzed),
+                                        min_hits=settings.TRACKER_MIN_HITS)
+        self.assertGreater(truth['vehicle_count'], 0)
+        self.assertEqual(sum(log.vehicle_count for log in logs), truth['vehicle_count'])
+
+    def test_bounded_queue_drops_stale_frames(self):
+        stream, logs = self.run_stream(SlowDetector(backend='scene'), 2.0, 0.5, queue_size=2)
+        grabber = stream.grabber
+        self.assertGreater(grabber.frames_dropped, 0)
+        self.assertLess(stream.frames_analyzed, grabber.frames_read)
+        # Every frame read was analysed, dropped, or still queued (at most queue_size) at stop
+        unaccounted = grabber.frames_read - stream.frames_analyzed - grabber.frames_dropped
+        self.assertTrue(0 <= unaccounted <= 2, unaccounted)
+        self.assertEqual(logs[-1].id, stream.latest['log_id'])
+
+
+class ResultCacheTests(TestCase):
+    """Cache keys, hard-linked clips shared between logs, and LRU eviction, in a temporary MEDIA_ROOT."""
+
+    area = [[100, 60], [540, 60], [540, 300], [100, 300]]
+
+    def setUp(self):
+        self.media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media, ignore_errors=True)
+        media_settings = override_settings(MEDIA_ROOT=self.media)
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+        self.junction = JunctionSignals.objects.create(name='Cache test')
+
+    def fake_clip(self, name, size):
+        with open(default_storage.path(name), 'wb') as f:
+            f.write(os.urandom(size))
+        return name
+
+    def analysis(self, processed_name):
+        return {'vehicle_count': 3, 'traffic_weight': 3.0, 'processed_name': processed_name}
+
+    def test_key_depends_on_area_thresholds_and_model(self):
+        options = parse_processing_options({})
+        key = result_key('abc', self.area, options, 640)
+        self.assertEqual(key, result_key('abc', [list(point) for point in self.area], dict(options), 640))
+        # batch_size doesn't change results
+        self.assertEqual(key, result_key('abc', self.area, dict(options, batch_size=1), 640))
+
+        self.assertNotEqual(key, result_key('abd', self.area, options, 640))
+        self.assertNotEqual(key, result_key('abc', self.area[:3], options, 640))
+        self.assertNotEqual(key, result_key('abc', self.area, dict(options, counting_mode='frames'), 640))
+        self.assertNotEqual(key, result_key('abc', self.area, options, 320))
+        with patch.object(EnhancedVehicleDetector, 'confidence_threshold', 0.5):
+            self.assertNotEqual(key, result_key('abc', self.area, options, 640))
+        with override_settings(TRACKER_MIN_HITS=settings.TRACKER_MIN_HITS + 1):
+            self.assertNotEqual(key, result_key('abc', self.area, options, 640))
+
+        model = os.path.join(self.media, 'model.onnx')
+        with override_settings(DETECTOR_BACKEND='onnx', DETECTOR_MODEL_PATH=model):
+            with open(model, 'wb') as f:
+                f.write(b'model v1')
+            first = result_key('abc', self.area, options, 640)
+            with open(model, 'wb') as f:
+                f.write(b'model version 2')
+            self.assertNotEqual(first, result_key('abc', self.area, options, 640))
+        with override_settings(DETECTOR_BACKEND='onnx', DETECTOR_MODEL_PATH=model):
+            self.assertNotEqual(key, result_key('abc', self.area, options, 640))
+
+    def test_least_recently_used_entries_are_evicted(self):
+        os.makedirs(default_storage.path('processed_videos'))
+        cache = ResultCache(max_bytes=2500)
+        names = {key: self.fake_clip(f'processed_videos/{key}.mp4', 1000) for key in ('a', 'b', 'c')}
+        cache.put('a', 'hash-a', self.analysis(names['a']))
+        cache.put('b', 'hash-b', self.analysis(names['b']))
+        self.assertIsNotNone(cache.get('a'))  # now b is the least recently used
+        cache.put('c', 'hash-c', self.analysis(names['c']))
+
+        self.assertEqual(set(ResultCacheEntry.objects.values_list('key', flat=True)), {'a', 'c'})
+        self.assertFalse(os.path.exists(default_storage.path('result_cache/b.mp4')))
+        self.assertIsNone(cache.get('b'))
+        # The upload's own processed clip is a separate link and stays
+        self.assertTrue(os.path.exists(default_storage.path(names['b'])))
+        self.assertLessEqual(sum(ResultCacheEntry.objects.values_list('size', flat=True)), cache.max_bytes)
+
+    @skipUnless(ffmpeg_available(), 'ffmpeg is not installed')
+    def test_shared_clip_survives_rerender(self):
+        path = os.path.join(self.media, 'upload.mp4')
+        TrafficScene(854, 480, 25, seed=2).write(path)
+        with open(path, 'rb') as f:
+            video_name, digest = store_upload(File(f, name='upload.mp4'))
+        options = parse_processing_options({})
+
+        with pooled_detector(EnhancedVehicleDetector(backend='scene')):
+            first = process_signal_video(video_name, 'A', self.junction.id, self.area, options, content_hash=digest)
+            second = process_signal_video(video_name, 'A', self.junction.id, self.area, options,
+                                          content_hash=digest)
+            self.assertFalse(first['cached'])
+            self.assertTrue(second['cached'])
+            entry = ResultCacheEntry.objects.get(content_hash=digest)
+            first_log, second_log = TrafficLog.objects.order_by('id')
+            cached_inode = os.stat(default_storage.path(entry.processed_video)).st_ino
+            for log in (first_log, second_log):
+                self.assertEqual(os.stat(log.processed_videos.path).st_ino, cached_inode)
+
+            # Re-rendering the first log deletes its clip, which is only one of the links
+            previous = first_log.processed_videos.path
+            render_traffic_log(first_log.id, options)
+            self.assertFalse(os.path.exists(previous))
+            self.assertEqual(os.stat(default_storage.path(entry.processed_video)).st_ino, cached_inode)
+            self.assertEqual(os.stat(second_log.processed_videos.path).st_ino, cached_inode)
+
+            third = process_signal_video(video_name, 'A', self.junction.id, self.area, options, content_hash=digest)
+        self.assertTrue(third['cached'])
+        self.assertEqual(third['vehicle_count'], first['vehicle_count'])
+        self.assertEqual(os.stat(TrafficLog.objects.get(id=third['log_id']).processed_videos.path).st_ino,
+                         cached_inode)
+
+
+# More traffic than one green at a time can discharge, with a heavy approach A
+OVERSATURATED = {'A': (50, 80), 'B': (40, 70), 'C': (30, 60), 'D': (30, 60)}
+
+
+class JunctionControllerTests(TestCase):
+    """Cycle plans stay within max_cycle and min green under oversaturated demand, for every policy."""
+
+    def assert_valid_plan(self, controller, plan):
+        self.assertLessEqual(plan['cycle_length'], controller.max_cycle)
+        start = 0.0
+        for phase in plan['phases']:
+            signal = controller.signals[phase['signal_id']]
+            self.assertGreaterEqual(phase['green'], signal.min_green_time)
+            self.assertAlmostEqual(phase['start'], start, places=1)
+            start += phase['green'] + phase['yellow'] + phase['all_red']
+        self.assertAlmostEqual(plan['cycle_length'], start, places=1)
+
+    def test_oversaturated_plans_fit_max_cycle(self):
+        for policy in POLICIES:
+            for max_cycle in (60, 61, 75, 90, 120):
+                with self.subTest(policy=policy, max_cycle=max_cycle):
+                    controller = JunctionController(policy=policy, max_cycle=max_cycle)
+                    for _ in range(3):  # the adaptive policy's history grows every cycle
+                        self.assert_valid_plan(controller, controller.plan(demand=OVERSATURATED))
+
+    def test_rounded_greens_do_not_exceed_max_cycle(self):
+        controller = JunctionController(max_cycle=60)
+        plan = controller.plan(demand=OVERSATURATED)
+        self.assertLessEqual(plan['cycle_length'], 60)
+        self.assertGreater(plan['cycle_length'], 59)
+
+    def test_proportional_favours_heavier_approach(self):
+        controller = JunctionController(policy='proportional', max_cycle=120)
+        greens = {phase['signal_id']: phase['green'] for phase in controller.plan(demand=OVERSATURATED)['phases']}
+        self.assertGreater(greens['A'], greens['C'])
+
+
+class JunctionSimulatorTests(TestCase):
+    """Every policy keeps its cycles within max_cycle while queues build up under oversaturated demand."""
+
+    def setUp(self):
+        start = datetime(2024, 1, 1, 8, tzinfo=timezone.utc)
+        rates = {'A': (0.35, 1.6), 'B': (0.3, 1.75), 'C': (0.25, 2.0), 'D': (0.25, 2.0)}
+        self.demand = [(start + timedelta(minutes=minute), rates) for minute in range(30)]
+        self.arrival_rate = sum(rate for rate, _ in rates.values())
+
+    def test_policies_under_oversaturation(self):
+        simulator = JunctionSimulator(self.demand, 60, saturation_flow=0.5)
+        for policy in POLICIES:
+            with self.subTest(policy=policy):
+                result = simulator.run(policy, max_cycle=60)
+                self.assertGreater(result['cycles'], 0)
+                self.assertGreaterEqual(result['simulated_seconds'], 30 * 60)
+                self.assertLessEqual(result['simulated_seconds'] / result['cycles'], 60)
+                # Only one approach has green at a time, so at most saturation_flow vehicles/s leave
+                arrived = self.arrival_rate * result['simulated_seconds']
+                self.assertLessEqual(result['throughput'], 0.5 * result['simulated_seconds'])
+                self.assertLess(result['throughput'], arrived)
+                self.assertGreater(result['max_queue'], 0)
+                self.assertGreater(result['avg_delay'], 0)
+
+
+class FrameSamplerTests(TestCase):
+    """Which frames each sampling mode analyses, and the rates and scale factors derived from that."""
+
+    def analysed(self, sampler, frames):
+        indices = [index for index in range(frames) if sampler.should_analyze(index)]
+        sampler.frames_seen, sampler.frames_analyzed = frames, len(indices)
+        return indices
+
+    def test_all_analyses_every_frame(self):
+        sampler = FrameSampler('all', source_fps=30)
+        self.assertEqual(self.analysed(sampler, 10), list(range(10)))
+        self.assertEqual(sampler.effective_fps, 30)
+        self.assertEqual(sampler.scale_factor(), 1.0)
+
+    def test_stride(self):
+        sampler = FrameSampler('stride', 3, source_fps=30)
+        self.assertEqual(self.analysed(sampler, 10), [0, 3, 6, 9])
+        self.assertEqual(sampler.effective_fps, 10)
+        self.assertEqual(sampler.scale_factor(), 2.5)
+
+    def test_fps_resamples_evenly(self):
+        sampler = FrameSampler('fps', 5, source_fps=25)
+        indices = self.analysed(sampler, 100)
+        self.assertEqual(len(indices), 20)
+        self.assertEqual(set(np.diff(indices)), {5})
+        self.assertEqual(sampler.effective_fps, 5)
+
+    def test_fps_above_source_rate_keeps_every_frame(self):
+        sampler = FrameSampler('fps', 60, source_fps=25)
+        self.assertEqual(self.analysed(sampler, 25), list(range(25)))
+        self.assertEqual(sampler.effective_fps, 25)
+
+    def test_invalid_modes_and_values(self):
+        self.assertEqual(SAMPLING_MODES, ('all', 'stride', 'fps'))
+        for mode, value in (('keyframes', 2), ('stride', None), ('stride', 'x'), ('fps', 0), ('fps', -1)):
+            with self.subTest(mode=mode, value=value), self.assertRaises(ValueError):
+                FrameSampler(mode, value)
+
+    def test_upload_options_reject_unknown_mode(self):
+        with self.assertRaises(ProcessingError):
+            parse_processing_options({'sampling_mode': 'keyframes', 'sampling_value': '2'})
+        options = parse_processing_options({'sampling_mode': 'stride', 'sampling_value': '4'})
+        self.assertEqual(options['sampling_mode'], 'stride')
+
+
+def loop_point_in_polygon(point, polygon):
+    """The original per-point ray cast that vectorized containment must agree with."""
+    x, y = point
+    inside = False
+    p1x, p1y = polygon[0]
+    for i in range(1, len(polygon) + 1):
+        p2x, p2y = polygon[i % len(polygon)]
+        if min(p1y, p2y) < y <= max(p1y, p2y) and x <= max(p1x, p2x):
+            if p1x == p2x or x <= (y - p1y) * (p2x - p1x) / (p2y - p1y) + p1x:
+                inside = not inside
+        p1x, p1y = p2x, p2y
+    return inside
+
+
+class AreaContainmentTests(TestCase):
+    """Vectorized containment and duplicate suppression give the same answers as the per-box code did."""
+
+    # Concave (an L shape) so a ray can cross the polygon more than once
+    polygon = [[100, 100], [500, 100], [500, 200], [250, 200], [250, 400], [100, 400]]
+
+    def test_contains_matches_per_point_ray_cast(self):
+        geometry = AreaGeometry(self.polygon, 640, 480)
+        points = np.random.default_rng(0).integers(0, 640, (3000, 2))
+        # Vertices and points on edges, where the inclusion rules matter
+        points = np.vstack([points, self.polygon, [[300, 100], [300, 200], [100, 250], [250, 300], [500, 150]]])
+        expected = [loop_point_in_polygon(point, self.polygon) for point in points.tolist()]
+        self.assertEqual(geometry.contains(points).tolist(), expected)
+        self.assertEqual(points_in_polygon(points, self.polygon).tolist(), expected)
+        detector = EnhancedVehicleDetector(backend='stub')
+        self.assertEqual([detector.point_in_polygon(point, self.polygon) for point in points[:200].tolist()],
+                         expected[:200])
+
+    def test_geometry_bbox_is_clipped_to_frame(self):
+        geometry = AreaGeometry([[-50, 20], [700, 20], [700, 500], [-50, 500]], 640, 480)
+        self.assertEqual(geometry.bbox, (0, 20, 640, 480))
+        self.assertTrue(geometry.contains([[0, 100], [639, 479]]).all())
+        self.assertIs(geometry_for_points(self.polygon, 640, 480), geometry_for_points(self.polygon, 640, 480))
+
+    def test_filter_detections_suppresses_duplicates_and_non_vehicles(self):
+        detector = EnhancedVehicleDetector(backend='stub')
+        geometry = AreaGeometry(self.polygon, 640, 480)
+        xyxy = np.array([
+            [120, 120, 180, 160],  # car
+            [125, 125, 185, 165],  # same car again, lower confidence: dropped
+            [300, 120, 360, 160],  # truck
+            [400, 300, 460, 340],  # outside the L: dropped
+            [120, 300, 180, 340],  # person (COCO 0): dropped
+            [160, 300, 220, 340],  # bus
+        ], dtype=np.float32)
+        class_ids = np.array([2, 2, 7, 2, 0, 5])
+        self.assertEqual(detector.filter_detections(xyxy, class_ids, geometry).tolist(), [0, 2, 5])
+        self.assertEqual(detector.filter_detections(xyxy, class_ids, geometry, inside_only=False).tolist(),
+                         [0, 2, 3, 5])
+        count, weight, per_class = detector.summarize_detections(class_ids[[0, 2, 5]])
+        self.assertEqual((count, per_class['car'], per_class['truck'], per_class['bus']), (3, 1, 1, 1))
+        self.assertAlmostEqual(weight, 1.0 + 2.5 + 2.0)
+
+
+class JobLifecycleTests(TestCase):
+    """Upload jobs run to completion, are requeued when abandoned and replace their own logs when run again."""
+
+    area = [[100, 60], [540, 60], [540, 300], [100, 300]]
+
+    def setUp(self):
+        self.media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media, ignore_errors=True)
+        job_settings = override_settings(MEDIA_ROOT=self.media, SIGNAL_WORKER_PROCESSES=0)
+        job_settings.enable()
+        self.addCleanup(job_settings.disable)
+        os.makedirs(default_storage.path('videos'))
+        TrafficScene(854, 480, 25, seed=2).write(default_storage.path('videos/clip.mp4'))
+        self.junction = JunctionSignals.objects.create(name='Job test')
+        self.options = parse_processing_options({'stats_only': 'true'})
+        detector = pooled_detector(EnhancedVehicleDetector(backend='scene'))
+        detector.__enter__()
+        self.addCleanup(detector.__exit__, None, None, None)
+
+    def create_job(self):
+        inputs = [{'signal_id': signal_id, 'video': 'videos/clip.mp4', 'area': self.area} for signal_id in 'AB']
+        return create_job(self.junction.id, inputs, self.options)
+
+    def minute_rollups(self):
+        return TrafficRollup.objects.filter(junction=self.junction, granularity='1m')
+
+    def test_job_runs_to_completion(self):
+        job = run_job(self.create_job().id)
+        self.assertEqual(job.status, ProcessingJob.STATUS_COMPLETED)
+        self.assertEqual(job.progress, 100.0)
+        self.assertEqual([result['signal_id'] for result in job.result], ['A', 'B'])
+        logs = TrafficLog.objects.filter(job=job)
+        self.assertEqual(sorted(log.id for log in logs), sorted(result['log_id'] for result in job.result))
+        self.assertGreater(logs[0].vehicle_count, 0)
+        self.assertEqual(sum(rollup.samples for rollup in self.minute_rollups()), 2)
+        # Claimed once only
+        self.assertIsNone(run_job(job.id))
+
+    def test_job_fails_when_the_model_did_not_load(self):
+        missing = EnhancedVehicleDetector(backend='onnx', model_path='/nonexistent/model.onnx')
+        with pooled_detector(missing):
+            job = run_job(self.create_job().id)
+        self.assertEqual(job.status, ProcessingJob.STATUS_FAILED)
+        self.assertIn('Detector unavailable', job.error)
+        self.assertEqual(job.result, [])
+        # No simulated counts are stored
+        self.assertFalse(TrafficLog.objects.exists())
+        self.assertFalse(TrafficRollup.objects.exists())
+
+        with pooled_detector(missing):
+            with self.assertRaises(ProcessingError) as raised:
+                process_signal_video('videos/clip.mp4', 'A', self.junction.id, self.area, self.options)
+        self.assertEqual(raised.exception.status, 503)
+
+    def test_abandoned_job_is_requeued_and_replaces_its_logs(self):
+        job = run_job(self.create_job().id)
+        first_logs = set(TrafficLog.objects.filter(job=job).values_list('id', flat=True))
+        # The worker died mid-way through a second run
+        ProcessingJob.objects.filter(id=job.id).update(status=ProcessingJob.STATUS_RUNNING)
+        self.assertEqual(requeue_stale_jobs(), 0)
+        ProcessingJob.objects.filter(id=job.id).update(updated_at=now() - timedelta(hours=1))
+        self.assertEqual(requeue_stale_jobs(), 1)
+        self.assertEqual(ProcessingJob.objects.get(id=job.id).status, ProcessingJob.STATUS_QUEUED)
+
+        job = run_job(job.id)
+        self.assertEqual(job.status, ProcessingJob.STATUS_COMPLETED)
+        logs = TrafficLog.objects.filter(junction=self.junction)
+        self.assertEqual(logs.count(), 2)
+        self.assertFalse(first_logs & set(logs.values_list('id', flat=True)))
+        rollups = self.minute_rollups()
+        self.assertEqual(sum(rollup.samples for rollup in rollups), 2)
+        self.assertEqual(sum(rollup.vehicle_count_sum for rollup in rollups), sum(log.vehicle_count for log in logs))
+
+    def test_resume_submits_queued_and_stale_jobs(self):
+        queued = self.create_job()
+        stale = self.create_job()
+        ProcessingJob.objects.filter(id=stale.id).update(status=ProcessingJob.STATUS_RUNNING,
+                                                         updated_at=now() - timedelta(hours=1))
+        running = self.create_job()
+        self.assertTrue(claim_job(running.id))
+        self.assertFalse(claim_job(running.id))
+
+        executor = MagicMock()
+        with patch('application.jobs.get_executor', return_value=executor):
+            self.assertEqual(resume_jobs(), 2)
+        submitted = [call.args[1] for call in executor.submit.call_args_list]
+        self.assertEqual(submitted, [queued.id, stale.id])
+        self.assertEqual(ProcessingJob.objects.get(id=running.id).status, ProcessingJob.STATUS_RUNNING)
+
+
+def fake_signal_task(progress, progress_key, video_name, signal_id, junction_id, area, options, content_hash=None,
+                     job_id=None):
+    """Stands in for a worker process: signal B fails, the others report a result without a log."""
+    progress[progress_key] = 10
+    if signal_id == 'B':
+        raise ValueError('Cannot decode video for signal B')
+    return {'signal_id': signal_id, 'log_id': None}
+
+
+class SignalPoolTests(TestCase):
+    """A job whose signals run on the worker pool reports the signals that finished when one fails."""
+
+    def setUp(self):
+        self.job = ProcessingJob(inputs=[{'signal_id': signal_id, 'video': f'videos/{signal_id}.mp4', 'area': []}
+                                         for signal_id in 'ABC'])
+        self.reporter = MagicMock()
+
+    def test_failed_signal_keeps_sibling_results(self):
+        executor = ThreadPoolExecutor(max_workers=3)
+        self.addCleanup(executor.shutdown)
+        results = []
+        with patch('application.workers.get_signal_pool', return_value=(executor, {})), \
+                patch('application.workers._process_signal_task', fake_signal_task):
+            with self.assertRaisesRegex(ValueError, 'signal B'):
+                process_signals_in_pool(self.job, self.reporter, results, poll_interval=0.01)
+        self.assertEqual(results, [{'signal_id': 'A', 'log_id': None}, {'signal_id': 'C', 'log_id': None}])
+
+    def test_cancelled_signal_fails_with_its_name(self):
+        def submit(task, progress, key, *args):
+            future = Future()
+            if key.endswith(':1'):
+                # As an executor does with a future it cancelled before it started
+                future.cancel()
+                future.set_running_or_notify_cancel()
+            else:
+                future.set_result({'signal_id': args[1], 'log_id': None})
+            return future
+
+        pool = MagicMock()
+        pool.submit.side_effect = submit
+        results = []
+        with patch('application.workers.get_signal_pool', return_value=(pool, {})):
+            with self.assertRaisesRegex(RuntimeError, 'signal B was cancelled'):
+                process_signals_in_pool(self.job, self.reporter, results, poll_interval=0.01)
+        self.assertEqual([result['signal_id'] for result in results], ['A', 'C'])
+
+
+class JunctionSnapshotTests(TestCase):
+    """The snapshot holds the latest log of each signal of one junction and answers unchanged polls with 304."""
+
+    def setUp(self):
+        self.junction = JunctionSignals.objects.create(name='Snapshot test')
+        self.url = f'/api/junctions/{self.junction.id}/snapshot/'
+
+    def log(self, signal_id, vehicle_count, minutes_ago=0, junction=None):
+        return TrafficLog.objects.create(
+            junction=junction or self.junction, signal_id=signal_id, vehicle_count=vehicle_count,
+            traffic_weight=float(vehicle_count), green_time=10, efficiency_score=50.0,
+            timestamp=datetime.now(timezone.utc) - timedelta(minutes=minutes_ago)
+        )
+
+    def test_latest_log_of_each_signal(self):
+        self.log(1, 3, minutes_ago=5)
+        latest = self.log(1, 7)
+        self.log(2, 4)
+        self.log(3, 9, junction=JunctionSignals.objects.create(name='Other junction'))
+
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        signals = {signal['id']: signal for signal in response.data['signals']}
+        self.assertEqual([signals[letter]['vehicles'] for letter in 'ABCD'], [7, 4, 0, 0])
+        self.assertEqual([signals[letter]['status'] for letter in 'ABCD'], ['green', 'green', 'red', 'red'])
+        self.assertEqual(response.data['total_vehicles'], 11)
+        self.assertEqual(response.data['junction_id'], self.junction.id)
+        self.assertEqual(response.data['updated_at'], max(latest.last_update,
+                                                          TrafficLog.objects.get(signal_id=2).last_update))
+
+    def test_empty_junction(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['total_vehicles'], 0)
+        self.assertIsNone(response.data['updated_at'])
+        self.assertIn('ETag', response)
+
+    def test_etag_changes_only_with_the_latest_logs(self):
+        log = self.log(1, 3)
+        etag = self.client.get(self.url)['ETag']
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        self.assertFalse(response.content)
+
+        # An older log of the signal, or a log of another junction, doesn't change the snapshot
+        self.log(1, 2, minutes_ago=5)
+        self.log(1, 8, junction=JunctionSignals.objects.create(name='Other junction'))
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        log.vehicle_count = 4
+        log.save()
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        etag = response['ETag']
+
+        self.log(2, 5)
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=f'"stale", {etag}')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+
+class DatabaseBrokerTests(TestCase):
+    """DatabaseBroker relays each row to local subscribers once, even when it commits late, and expires old rows."""
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self.loop.close)
+        self.broker = DatabaseBroker()
+        self.broker._poller = MagicMock()  # polled by hand instead of from the poller thread
+
+    def received(self, subscription):
+        self.loop.run_until_complete(asyncio.sleep(0))
+        events = []
+        while not subscription.queue.empty():
+            events.append(subscription.queue.get_nowait()['n'])
+        return events
+
+    def test_subscribers_get_their_topic_once(self):
+        self.broker.publish('junction.1', {'n': 0})  # published before anyone listened
+        subscription = self.broker.subscribe('junction.1', self.loop)
+        self.broker.poll_once()
+        self.broker.publish('junction.1', {'n': 1})
+        self.broker.publish('junction.2', {'n': 2})
+        self.broker.publish('junction.1', {'n': 3})
+        self.broker.poll_once()
+        self.assertEqual(self.received(subscription), [1, 3])
+        self.broker.poll_once()
+        self.assertEqual(self.received(subscription), [])
+
+    def test_row_committed_after_later_rows_is_delivered(self):
+        subscription = self.broker.subscribe('junction.1', self.loop)
+        self.broker.poll_once()
+        first = BrokerEvent.objects.create(topic='junction.1', payload={'n': 1})
+        BrokerEvent.objects.create(id=first.id + 2, topic='junction.1', payload={'n': 3})
+        self.broker.poll_once()
+        self.assertEqual(self.received(subscription), [1, 3])
+        # The transaction that took the id in between commits now
+        BrokerEvent.objects.create(id=first.id + 1, topic='junction.1', payload={'n': 2})
+        self.broker.poll_once()
+        self.assertEqual(self.received(subscription), [2])
+
+    def test_expired_rows_are_deleted_without_subscribers(self):
+        self.broker.retention = 60
+        old = BrokerEvent.objects.create(topic='junction.1', payload={'n': 1})
+        BrokerEvent.objects.filter(id=old.id).update(created_at=now() - timedelta(minutes=5))
+        recent = BrokerEvent.objects.create(topic='junction.1', payload={'n': 2})
+        self.broker.poll_once()
+        self.assertEqual(BrokerEvent.objects.count(), 2)
+
+        self.broker._last_cleanup -= 61
+        self.broker.poll_once()
+        self.assertEqual(list(BrokerEvent.objects.values_list('id', flat=True)), [recent.id])
+
+
+class RollupTests(TestCase):
+    """Logs are folded into 1m/15m/1h buckets as they are written, and a rebuild from the raw logs agrees."""
+
+    base = datetime(2026, 3, 2, 10, 0, tzinfo=timezone.utc)
+
+    def setUp(self):
+        self.junction = JunctionSignals.objects.create(name='Rollup test')
+
+    def log(self, seconds, vehicle_count, cars, signal_id=1):
+        return TrafficLog.objects.create(
+            junction=self.junction, signal_id=signal_id, vehicle_count=vehicle_count,
+            traffic_weight=vehicle_count * 1.5, green_time=10, efficiency_score=50.0, Car=cars,
+            timestamp=self.base + timedelta(seconds=seconds)
+        )
+
+    def buckets(self, granularity, signal_id=1):
+        return {
+            rollup.bucket_start: (rollup.samples, rollup.vehicle_count_sum, rollup.vehicle_count_max, rollup.car_sum)
+            for rollup in TrafficRollup.objects.filter(junction=self.junction, signal_id=signal_id,
+                                                       granularity=granularity)
+        }
+
+    def test_bucket_start(self):
+        self.assertEqual(bucket_start(self.base + timedelta(seconds=59), 60), self.base)
+        self.assertEqual(bucket_start(self.base + timedelta(minutes=29, seconds=59), 900),
+                         self.base + timedelta(minutes=15))
+        self.assertEqual(bucket_start(self.base - timedelta(seconds=1), 3600), self.base - timedelta(hours=1))
+
+    def test_logs_are_bucketed_per_granularity(self):
+        # One log at a time takes the upsert path, a batch over many buckets the bulk insert
+        record_logs([self.log(10, 4, 3)])
+        record_logs([self.log(50, 6, 2), self.log(70, 2, 2), self.log(16 * 60, 5, 5), self.log(3600, 1, 1),
+                     self.log(20, 9, 9, signal_id=2)])
+
+        minute = timedelta(minutes=1)
+        self.assertEqual(self.buckets('1m'), {
+            self.base: (2, 10, 6, 5),
+            self.base + minute: (1, 2, 2, 2),
+            self.base + 16 * minute: (1, 5, 5, 5),
+            self.base + 60 * minute: (1, 1, 1, 1),
+        })
+        self.assertEqual(self.buckets('15m'), {
+            self.base: (3, 12, 6, 7),
+            self.base + 15 * minute: (1, 5, 5, 5),
+            self.base + 60 * minute: (1, 1, 1, 1),
+        })
+        self.assertEqual(self.buckets('1h'), {
+            self.base: (4, 17, 6, 12),
+            self.base + 60 * minute: (1, 1, 1, 1),
+        })
+        self.assertEqual(self.buckets('1h', signal_id=2), {self.base: (1, 9, 9, 9)})
+
+        # Adding to existing buckets keeps sums and maxes
+        record_logs([self.log(30, 8, 0)])
+        self.assertEqual(self.buckets('1m')[self.base], (3, 18, 8, 5))
+
+    def test_rebuild_matches_incremental_rollups(self):
+        logs = [self.log(seconds, count, count // 2) for seconds, count in
+                ((5, 3), (40, 7), (200, 2), (1000, 6), (4000, 4), (7300, 1))]
+        record_logs(logs)
+        incremental = {granularity: self.buckets(granularity) for granularity in ('1m', '15m', '1h')}
+
+        TrafficRollup.objects.all().delete()
+        self.assertEqual(rebuild_rollups(), 12)
+        self.assertEqual({granularity: self.buckets(granularity) for granularity in ('1m', '15m', '1h')},
+                         incremental)
+
+    def test_rebuild_of_a_range_leaves_other_hours(self):
+        record_logs([self.log(30, 3, 3), self.log(4000, 4, 4)])
+        TrafficLog.objects.filter(timestamp__lt=self.base + timedelta(hours=1)).update(vehicle_count=5)
+        TrafficLog.objects.filter(timestamp__gte=self.base + timedelta(hours=1)).delete()
+
+        rebuild_rollups(self.base + timedelta(minutes=10), self.base + timedelta(minutes=20))
+        self.assertEqual(self.buckets('1h'), {
+            self.base: (1, 5, 5, 3),
+            # Outside the rebuilt hours, so still counting the deleted log
+            self.base + timedelta(hours=1): (1, 4, 4, 4),
+        })
+
+        rebuild_rollups(self.base + timedelta(hours=1), self.base + timedelta(hours=1))
+        self.assertEqual(self.buckets('1h'), {self.base: (1, 5, 5, 3)})
+
+
+class IngestTests(TestCase):
+    """Edge device batches are stored once per (device_id, sequence), and a bad record rejects the whole batch."""
+
+    url = '/api/ingest/'
+
+    def setUp(self):
+        self.junction = JunctionSignals.objects.create(name='Ingest test')
+
+    def post(self, records, device_id='cam-1'):
+        return self.client.post(self.url, {'device_id': device_id, 'junction_id': self.junction.id,
+                                           'records': records}, content_type='application/json')
+
+    def post_lines(self, lines):
+        return self.client.post(f'{self.url}?device_id=cam-1&junction_id={self.junction.id}', '\n'.join(lines),
+                                content_type='application/x-ndjson')
+
+    def record(self, sequence, **fields):
+        return dict({'sequence': sequence, 'signal_id': 'A', 'timestamp': '2026-03-02T10:00:00Z', 'car': 2,
+                     'truck': 1}, **fields)
+
+    def test_retried_batches_are_stored_once(self):
+        response = self.post([self.record(1), self.record(2)])
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual((response.data['accepted'], response.data['duplicates']), (2, 0))
+        log = TrafficLog.objects.get(sequence=1)
+        self.assertEqual(log.vehicle_count, 3)
+        self.assertEqual(log.traffic_weight, 2 * VEHICLE_WEIGHTS['car'] + VEHICLE_WEIGHTS['truck'])
+
+        response = self.post([self.record(1), self.record(2)])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.data['accepted'], response.data['duplicates']), (0, 2))
+
+        # A partly new batch stores the new records; the last copy of a repeated sequence wins
+        response = self.post([self.record(2), self.record(3, car=5), self.record(3, car=7)])
+        self.assertEqual((response.data['accepted'], response.data['duplicates'], response.data['last_sequence']),
+                         (1, 2, 3))
+        self.assertEqual(TrafficLog.objects.get(sequence=3).Car, 7)
+        # Another device may use the same sequence numbers
+        self.assertEqual(self.post([self.record(1)], device_id='cam-2').data['accepted'], 1)
+
+        self.assertEqual(TrafficLog.objects.filter(junction=self.junction).count(), 4)
+        rollups = TrafficRollup.objects.filter(junction=self.junction, granularity='1h')
+        self.assertEqual(sum(rollup.samples for rollup in rollups), 4)
+
+    def test_columns_and_json_lines(self):
+        response = self.client.post(self.url, {
+            'device_id': 'cam-1', 'junction_id': self.junction.id,
+            'columns': {'sequence': [1, 2], 'signal_id': ['B', 3], 'vehicle_count': [4, 6],
+                        'traffic_weight': [4.5, 6.0], 'timestamp': [1772445600, 1772445660]},
+        }, content_type='application/json')
+        self.assertEqual(response.data['accepted'], 2)
+        self.assertEqual(list(TrafficLog.objects.order_by('sequence').values_list('signal_id', 'vehicle_count')),
+                         [(2, 4), (3, 6)])
+        response = self.post_lines([json.dumps(self.record(3)), '', json.dumps(self.record(4))])
+        self.assertEqual(response.data['accepted'], 2)
+
+    def test_invalid_records_reject_the_batch(self):
+        invalid = {
+            'huge timestamp': self.record(2, timestamp=10 ** 20),
+            'boolean count': self.record(2, car=True),
+            'boolean signal': self.record(2, signal_id=True),
+            'boolean sequence': self.record(True),
+            'negative vehicle_count': self.record(2, vehicle_count=-1),
+            'negative class count': self.record(2, bus=-2),
+            'infinite weight': self.record(2, traffic_weight=float('inf')),
+            'NaN weight': self.record(2, traffic_weight=float('nan')),
+            'NaN dwell': self.record(2, avg_dwell_time=float('nan')),
+            'unknown signal': self.record(2, signal_id='E'),
+            'missing sequence': self.record(None),
+        }
+        for name, record in invalid.items():
+            with self.subTest(name):
+                # NaN and Infinity only get through as JSON lines
+                response = self.post_lines([json.dumps(self.record(1)), json.dumps(record)])
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual([error['index'] for error in response.data['records']], [1])
+        self.assertFalse(TrafficLog.objects.exists())
+
+
+class FrameScalerTests(TestCase):
+    """Frames are analysed at the source size unless a maximum height is set, keeping aspect and even sizes."""
+
+    def test_source_size_by_default(self):
+        self.assertIsNone(parse_processing_options({})['analysis_height'])
+        self.assertIsNone(parse_processing_options({'analysis_height': '0'})['analysis_height'])
+        self.assertEqual(parse_processing_options({'analysis_height': '480'})['analysis_height'], 480)
+        with self.assertRaises(ProcessingError):
+            parse_processing_options({'analysis_height': '-1'})
+        scaler = FrameScaler(1920, 1080)
+        self.assertEqual(scaler.size, (1920, 1080))
+        self.assertFalse(scaler.active)
+
+    def test_sizes(self):
+        cases = {
+            (1920, 1080, 720): (1280, 720),
+            (3840, 2160, 720): (1280, 720),
+            (1366, 768, 720): (1280, 720),
+            (720, 1280, 720): (404, 720),
+            (1280, 720, 720): (1280, 720),
+            (640, 360, 720): (640, 360),
+            (1920, 1080, 7): (12, 8),
+        }
+        for (width, height, max_height), size in cases.items():
+            with self.subTest(width=width, height=height, max_height=max_height):
+                scaler = FrameScaler(width, height, max_height)
+                self.assertEqual(scaler.size, size)
+                self.assertEqual(scaler.active, size != (width, height))
+                frame = np.zeros((height, width, 3), dtype=np.uint8)
+                self.assertEqual(scaler(frame).shape, (size[1], size[0], 3))
+
+    def test_frames_and_boxes_move_between_sizes(self):
+        frame = np.zeros((1080, 1920, 3), dtype=np.uint8)
+        frame[540:, 960:] = 255
+        analysis = FrameScaler(1920, 1080, 720)
+        output = FrameScaler(1920, 1080, 360)
+        source = FrameScaler(1920, 1080)
+
+        analysed = analysis(frame)
+        self.assertIs(analysis.rescale(frame, analysed, analysis), analysed)
+        smaller = output.rescale(frame, analysed, analysis)
+        self.assertEqual(smaller.shape, (360, 640, 3))
+        self.assertEqual((smaller[180:, 320:] == 255).mean(), 1.0)
+        # Upscaling goes back to the source frame instead of the shrunk one
+        self.assertIs(source.rescale(frame, analysed, analysis), frame)
+
+        boxes = np.array([[128, 72, 256, 144]], dtype=np.float32)
+        np.testing.assert_allclose(source.boxes_from(boxes, analysis), [[192, 108, 384, 216]])
+        np.testing.assert_allclose(output.boxes_from(boxes, analysis), [[64, 36, 128, 72]])
+        # The area scaled to the analysed frame covers the same pixels as at the source size
+        area = [[100, 60], [540, 60], [540, 300], [100, 300]]
+        points = np.array([[200, 200], [700, 200], [1500, 850], [1700, 850]], dtype=np.float32)
+        inside = AreaGeometry(scale_points(area, 1920, 1080), 1920, 1080).contains(points)
+        np.testing.assert_array_equal(inside, [False, True, True, False])
+        scaled = analysis.boxes_from(np.hstack([points, points]), source)[:, :2]
+        np.testing.assert_array_equal(AreaGeometry(scale_points(area, *analysis.size), *analysis.size).contains(scaled),
+                                      inside)
+
+
+def metric_value(metric, suffix='', **labels):
+    """The current value of one sample of a metric, 0 when it has none yet."""
+    prefix = f'{metric.name}{suffix}'
+    if labels:
+        prefix += '{' + ','.join(f'{name}="{value}"' for name, value in labels.items()) + '}'
+    for line in metric.samples():
+        name, value = line.rsplit(' ', 1)
+        if name == prefix:
+            return float(value)
+    return 0.0
+
+
+class MetricsTests(TestCase):
+    """Counters, histograms and stage timers, and what a processed job adds to /metrics."""
+
+    def metric(self, kind, *args, **kwargs):
+        metric = kind(*args, **kwargs)
+        self.addCleanup(REGISTRY.remove, metric)
+        return metric
+
+    def test_counter_samples(self):
+        counter = self.metric(Counter, 'test_events_total', 'Events', ['kind'])
+        counter.inc(kind='a')
+        counter.inc(2, kind='a')
+        counter.inc(kind='say "hi"\n')
+        self.assertEqual(counter.samples(), [
+            'test_events_total{kind="a"} 3',
+            'test_events_total{kind="say \\"hi\\"\\n"} 1',
+        ])
+
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = self.metric(Histogram, 'test_seconds', 'Seconds', ['stage'], buckets=(0.1, 1))
+        for value in (0.05, 0.5, 0.7, 3):
+            histogram.observe(value, stage='decode')
+        self.assertEqual(histogram.samples(), [
+            'test_seconds_bucket{stage="decode",le="0.1"} 1',
+            'test_seconds_bucket{stage="decode",le="1"} 3',
+            'test_seconds_bucket{stage="decode",le="+Inf"} 4',
+            'test_seconds_sum{stage="decode"} 4.25',
+            'test_seconds_count{stage="decode"} 4',
+        ])
+
+    def test_stage_timer(self):
+        timer = StageTimer()
+        with timer.stage('inference'):
+            time.sleep(0.01)
+        with timer.stage('inference'):
+            pass
+        timer.add('inference', 1.0)
+        self.assertEqual(list(timer.iterate('decode', [1, 2, 3])), [1, 2, 3])
+        timer.count('frames_decoded', 3)
+        timings = timer.as_dict()
+        self.assertGreaterEqual(timings['seconds']['inference'], 1.01)
+        self.assertIn('decode', timings['seconds'])
+        self.assertEqual(timings['counts'], {'frames_decoded': 3})
+
+        before = (metric_value(STAGE_SECONDS, '_count', stage='inference'), metric_value(FRAMES, kind='decoded'),
+                  metric_value(VIDEOS, result='cached'))
+        record_timings(timings, cached=True)
+        after = (metric_value(STAGE_SECONDS, '_count', stage='inference'), metric_value(FRAMES, kind='decoded'),
+                 metric_value(VIDEOS, result='cached'))
+        self.assertEqual([b - a for a, b in zip(before, after)], [1, 3, 1])
+
+    def test_processed_job_is_exported(self):
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media, ignore_errors=True)
+        with override_settings(MEDIA_ROOT=media, SIGNAL_WORKER_PROCESSES=0):
+            os.makedirs(default_storage.path('videos'))
+            TrafficScene(854, 480, 25, seed=2).write(default_storage.path('videos/clip.mp4'))
+            area = [[100, 60], [540, 60], [540, 300], [100, 300]]
+            job = create_job(JunctionSignals.objects.create(name='Metrics test').id,
+                             [{'signal_id': 'A', 'video': 'videos/clip.mp4', 'area': area}],
+                             parse_processing_options({'stats_only': 'true'}))
+            before = (metric_value(JOBS, status='completed'), metric_value(FRAMES, kind='analyzed'),
+                      metric_value(STAGE_SECONDS, '_count', stage='inference'))
+            with pooled_detector(EnhancedVehicleDetector(backend='scene')):
+                self.assertEqual(run_job(job.id).status, ProcessingJob.STATUS_COMPLETED)
+
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        body = response.content.decode()
+        self.assertIn('# TYPE traffic_stage_seconds histogram', body)
+        after = (metric_value(JOBS, status='completed'), metric_value(FRAMES, kind='analyzed'),
+                 metric_value(STAGE_SECONDS, '_count', stage='inference'))
+        self.assertEqual([b - a for a, b in zip(before, after)], [1, 25, 1])
+        self.assertIn(f'traffic_jobs_total{{status="completed"}} {int(after[0])}', body)
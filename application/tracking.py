@@ -0,0 +1,304 @@
+import numpy as np
+
+COUNTING_MODES = ('tracked', 'frames')
+
+
+def iou_matrix(boxes_a, boxes_b):
+    """Pairwise IoU between two (N, 4) and (M, 4) xyxy box arrays."""
+    boxes_a = np.asarray(boxes_a, dtype=np.float64).reshape(-1, 4)
+    boxes_b = np.asarray(boxes_b, dtype=np.float64).reshape(-1, 4)
+    x1 = np.maximum(boxes_a[:, None, 0], boxes_b[None, :, 0])
+    y1 = np.maximum(boxes_a[:, None, 1], boxes_b[None, :, 1])
+    x2 = np.minimum(boxes_a[:, None, 2], boxes_b[None, :, 2])
+    y2 = np.minimum(boxes_a[:, None, 3], boxes_b[None, :, 3])
+    intersection = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    area_a = (boxes_a[:, 2] - boxes_a[:, 0]) * (boxes_a[:, 3] - boxes_a[:, 1])
+    area_b = (boxes_b[:, 2] - boxes_b[:, 0]) * (boxes_b[:, 3] - boxes_b[:, 1])
+    union = area_a[:, None] + area_b[None, :] - intersection
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(union > 0, intersection / union, 0.0)
+
+
+def greedy_match(scores, threshold, higher_is_better=True):
+    """
+    Pairs rows with columns by repeatedly taking the best remaining score.
+    Returns a list of (row, col) pairs whose score passes `threshold`.
+    """
+    if scores.size == 0:
+        return []
+    order = np.argsort(-scores if higher_is_better else scores, axis=None, kind='stable')
+    rows, cols = np.unravel_index(order, scores.shape)
+    used_rows, used_cols, pairs = set(), set(), []
+    for row, col in zip(rows, cols):
+        score = scores[row, col]
+        if (score < threshold) if higher_is_better else (score > threshold):
+            break
+        if row in used_rows or col in used_cols:
+            continue
+        used_rows.add(row)
+        used_cols.add(col)
+        pairs.append((int(row), int(col)))
+    return pairs
+
+
+class Track:
+    """One vehicle followed across frames."""
+
+    def __init__(self, track_id, box, class_index, confidence, inside, timestamp, num_classes):
+        self.id = track_id
+        self.box = np.asarray(box, dtype=np.float64)
+        self.velocity = np.zeros(4)
+        self.hits = 1
+        self.misses = 0  # frames since the last matching detection
+        self.last_seen = timestamp
+        self.class_votes = np.zeros(num_classes)
+        self.class_votes[class_index] += confidence
+        self.inside = bool(inside)
+        self.was_inside = bool(inside)
+        self.first_inside = timestamp if inside else None
+        self.last_inside = timestamp if inside else None
+        self.entries = 0
+        self.exits = 0
+        self.counted = False  # already reported in a window_summary
+        self.reported_entries = 0  # entries and exits already added to a window_summary
+        self.reported_exits = 0
+
+    def predict(self, timestamp):
+        """Box expected at `timestamp` under constant velocity."""
+        return self.box + self.velocity * (timestamp - self.last_seen)
+
+    def has_left(self, timestamp, frame_size):
+        """
+        True when the predicted box is empty or, given the frame size, lies
+        outside the frame. Boxes are clipped to the frame, so a vehicle
+        driving out shrinks until its prediction collapses.
+        """
+        x1, y1, x2, y2 = self.predict(timestamp)
+        if x2 <= x1 or y2 <= y1:
+            return True
+        if frame_size is None:
+            return False
+        width, height = frame_size
+        return x2 <= 0 or y2 <= 0 or x1 >= width or y1 >= height
+
+    def update(self, box, class_index, confidence, inside, timestamp):
+        box = np.asarray(box, dtype=np.float64)
+        dt = timestamp - self.last_seen
+        if dt > 0:
+            velocity = (box - self.box) / dt
+            self.velocity = velocity if self.hits == 1 else 0.5 * self.velocity + 0.5 * velocity
+        self.box = box
+        self.hits += 1
+        self.misses = 0
+        self.last_seen = timestamp
+        self.class_votes[class_index] += confidence
+
+        if inside and not self.inside:
+            self.entries += 1
+        elif self.inside and not inside:
+            self.exits += 1
+        self.inside = bool(inside)
+        if inside:
+            self.was_inside = True
+            if self.first_inside is None:
+                self.first_inside = timestamp
+            self.last_inside = timestamp
+
+    @property
+    def class_index(self):
+        return int(np.argmax(self.class_votes))
+
+
+class VehicleTracker:
+    """
+    SORT-style tracker: every frame, detections are associated with the
+    constant-velocity predictions of live tracks, first by IoU and then, for
+    what is left, by center distance relative to the track's box size (which
+    keeps tracks alive when frames are sampled sparsely). The distance
+    fallback only considers tracks missed in at most `distance_max_misses`
+    frames, and never pairs a moving track with a detection behind it.
+    Unmatched detections start new tracks; tracks unseen for `max_age`
+    seconds, or whose prediction has left the `frame_size` (width, height)
+    frame, are retired.
+
+    A vehicle is counted once, when its track has at least `min_hits`
+    observations and was inside the detection area at some point. Its class
+    is the confidence-weighted majority over its observations. Entries and
+    exits are outside->inside and inside->outside transitions of the box
+    center; dwell is the time between the first and last observation inside
+    the area plus one frame.
+    """
+
+    def __init__(self, class_names, class_weights, iou_threshold=0.3, max_age=1.0, min_hits=2,
+                 distance_threshold=1.0, frame_duration=0.04, distance_max_misses=1, frame_size=None):
+        self.class_names = list(class_names)
+        self.class_weights = np.asarray(class_weights, dtype=np.float64)
+        self.iou_threshold = iou_threshold
+        self.max_age = max_age
+        self.min_hits = min_hits
+        self.distance_threshold = distance_threshold
+        self.frame_duration = frame_duration
+        self.distance_max_misses = distance_max_misses
+        self.frame_size = frame_size
+        self.tracks = []
+        self.next_id = 1
+
+        # Totals of retired tracks, so finished tracks don't have to be kept
+        self.unique_counts = np.zeros(len(self.class_names), dtype=np.int64)
+        self.entries = 0
+        self.exits = 0
+        self.dwell_total = 0.0
+
+        # Accumulators for window_summary, reset on every call
+        self.window_counts = np.zeros(len(self.class_names), dtype=np.int64)
+        self.window_entries = 0
+        self.window_exits = 0
+        self.window_dwell = []
+
+    def update(self, xyxy, class_index, confidences, inside, timestamp):
+        """
+        Feeds one frame's detections (vehicle classes only, `class_index`
+        being positions in `class_names`). Returns the track id assigned to
+        each detection, in input order.
+        """
+        xyxy = np.asarray(xyxy, dtype=np.float64).reshape(-1, 4)
+        track_ids = np.zeros(len(xyxy), dtype=np.int64)
+        self._retire(timestamp)
+
+        pairs = []
+        if self.tracks and len(xyxy):
+            predicted = np.array([track.predict(timestamp) for track in self.tracks])
+            pairs = greedy_match(iou_matrix(predicted, xyxy), self.iou_threshold)
+
+            matched_tracks = {row for row, _ in pairs}
+            matched_dets = {col for _, col in pairs}
+            free_tracks = [i for i in range(len(self.tracks))
+                           if i not in matched_tracks and self.tracks[i].misses <= self.distance_max_misses]
+            free_dets = [j for j in range(len(xyxy)) if j not in matched_dets]
+            if free_tracks and free_dets:
+                pred = predicted[free_tracks]
+                dets = xyxy[free_dets]
+                last = np.array([self.tracks[i].box for i in free_tracks])
+                pred_centers = (pred[:, :2] + pred[:, 2:]) / 2
+                det_centers = (dets[:, :2] + dets[:, 2:]) / 2
+                last_centers = (last[:, :2] + last[:, 2:]) / 2
+                size = np.hypot(pred[:, 2] - pred[:, 0], pred[:, 3] - pred[:, 1])
+                distance = np.linalg.norm(pred_centers[:, None, :] - det_centers[None, :, :], axis=2)
+                distance /= np.maximum(size, 1.0)[:, None]
+
+                # A track moving by more than a tenth of its size can't be matched backwards
+                expected = pred_centers - last_centers
+                moving = np.linalg.norm(expected, axis=1) >= 0.1 * np.maximum(size, 1.0)
+                travelled = det_centers[None, :, :] - last_centers[:, None, :]
+                backwards = moving[:, None] & ((travelled * expected[:, None, :]).sum(axis=2) < 0)
+                distance[backwards] = np.inf
+                pairs += [(free_tracks[i], free_dets[j])
+                          for i, j in greedy_match(distance, self.distance_threshold, higher_is_better=False)]
+
+        matched_dets = set()
+        for track in self.tracks:
+            track.misses += 1
+        for row, col in pairs:
+            track = self.tracks[row]
+            track.update(xyxy[col], class_index[col], confidences[col], inside[col], timestamp)
+            track_ids[col] = track.id
+            matched_dets.add(col)
+
+        for col in range(len(xyxy)):
+            if col in matched_dets:
+                continue
+            track = Track(self.next_id, xyxy[col], class_index[col], confidences[col], inside[col],
+                          timestamp, len(self.class_names))
+            self.next_id += 1
+            self.tracks.append(track)
+            track_ids[col] = track.id
+
+        return track_ids
+
+    def _retire(self, timestamp):
+        alive = []
+        for track in self.tracks:
+            if timestamp - track.last_seen > self.max_age or track.has_left(timestamp, self.frame_size):
+                self._count(track)
+            else:
+                alive.append(track)
+        self.tracks = alive
+
+    def _qualifies(self, track):
+        return track.hits >= self.min_hits and track.was_inside
+
+    def _report(self, track):
+        """Adds a qualifying track to the window, and its entries and exits since the last report."""
+        if not track.counted:
+            track.counted = True
+            self.window_counts[track.class_index] += 1
+        self.window_entries += track.entries - track.reported_entries
+        self.window_exits += track.exits - track.reported_exits
+        track.reported_entries = track.entries
+        track.reported_exits = track.exits
+
+    def _count(self, track):
+        if not self._qualifies(track):
+            return
+        self._report(track)
+        self.window_dwell.append(track.last_inside - track.first_inside + self.frame_duration)
+        self.unique_counts[track.class_index] += 1
+        self.entries += track.entries
+        self.exits += track.exits
+        self.dwell_total += track.last_inside - track.first_inside + self.frame_duration
+
+    def summary(self):
+        """
+        Aggregates over every track seen so far, including live ones.
+        Returns unique vehicles (total and per class), their combined
+        traffic weight, entries, exits and the average dwell in seconds.
+        """
+        unique_counts = self.unique_counts.copy()
+        entries, exits, dwell_total = self.entries, self.exits, self.dwell_total
+        for track in self.tracks:
+            if not self._qualifies(track):
+                continue
+            unique_counts[track.class_index] += 1
+            entries += track.entries
+            exits += track.exits
+            dwell_total += track.last_inside - track.first_inside + self.frame_duration
+
+        unique_vehicles = int(unique_counts.sum())
+        return {
+            'unique_vehicles': unique_vehicles,
+            'traffic_weight': float((unique_counts * self.class_weights).sum()),
+            'vehicle_type_counts': {name: int(unique_counts[i]) for i, name in enumerate(self.class_names)},
+            'entries': entries,
+            'exits': exits,
+            'avg_dwell_time': round(dwell_total / unique_vehicles, 2) if unique_vehicles else 0.0,
+        }
+
+    def window_summary(self):
+        """
+        Rolling aggregate for live streams: vehicles first counted, entries
+        and exits seen, and dwell of vehicles that left, since the previous
+        call. A vehicle is reported in the window where its track qualifies,
+        so it is never counted twice; the entries and exits of a track that
+        never qualifies, such as a false detection, are never reported.
+        `occupancy` is the number of counted vehicles inside the area right now.
+        """
+        for track in self.tracks:
+            if self._qualifies(track):
+                self._report(track)
+
+        unique_vehicles = int(self.window_counts.sum())
+        summary = {
+            'unique_vehicles': unique_vehicles,
+            'traffic_weight': float((self.window_counts * self.class_weights).sum()),
+            'vehicle_type_counts': {name: int(self.window_counts[i]) for i, name in enumerate(self.class_names)},
+            'entries': self.window_entries,
+            'exits': self.window_exits,
+            'avg_dwell_time': round(sum(self.window_dwell) / len(self.window_dwell), 2) if self.window_dwell else 0.0,
+            'occupancy': sum(1 for track in self.tracks if track.inside and self._qualifies(track)),
+        }
+
+        self.window_counts[:] = 0
+        self.window_entries = 0
+        self.window_exits = 0
+        self.window_dwell = []
+        return summary
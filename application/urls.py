@@ -1,13 +1,23 @@
 from django.urls import path
-from .views import TrafficLogView, latest_stats, AdaptiveGreenTime, junctions_list
+from .views import TrafficLogView, IngestView, latest_stats, AdaptiveGreenTime, junctions_list, job_status, render_log_video, signal_sources, junction_snapshot, junction_events, junction_plan, traffic_history, readiness, metrics
 from django.conf import settings
 from django.conf.urls.static import static
 
 urlpatterns = [
     path('api/log/', TrafficLogView.as_view(), name='upload_api'),
+    path('api/ingest/', IngestView.as_view(), name='ingest_api'),
     path('api/latest-stats/', latest_stats, name='latest_stats'),
+    path('api/history/', traffic_history, name='traffic_history'),
     path('api/adaptive-green-time/', AdaptiveGreenTime.as_view(), name='adaptive_green_time'),
     path('api/junctions/', junctions_list, name='junctions_list'),
+    path('api/health/ready/', readiness, name='readiness'),
+    path('metrics', metrics, name='metrics'),
+    path('api/jobs/<uuid:job_id>/', job_status, name='job_status'),
+    path('api/logs/<int:log_id>/render/', render_log_video, name='render_log_video'),
+    path('api/junctions/<int:junction_id>/sources/', signal_sources, name='signal_sources'),
+    path('api/junctions/<int:junction_id>/snapshot/', junction_snapshot, name='junction_snapshot'),
+    path('api/junctions/<int:junction_id>/events/', junction_events, name='junction_events'),
+    path('api/junctions/<int:junction_id>/plan/', junction_plan, name='junction_plan'),
 ]
 
 urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
\ No newline at end of file
@@ -0,0 +1,12 @@
+def letter_to_number(signal_id):
+    """
+    Converts a signal letter (A, B, C, D) to the numeric id stored in TrafficLog.
+    """
+    return ord(signal_id.upper()) - ord('A') + 1
+
+
+def number_to_letter(signal_id):
+    """
+    Inverse of letter_to_number: 1 -> 'A', 2 -> 'B', ...
+    """
+    return chr(ord('A') + int(signal_id) - 1)
@@ -0,0 +1,418 @@
+import queue
+import tempfile
+import threading
+import subprocess
+import numpy as np
+import cv2
+from .metrics import NULL_TIMER
+
+SAMPLING_MODES = ('all', 'stride', 'fps')
+
+DECODERS = ('opencv', 'pyav')
+
+
+class FrameSampler:
+    """
+    Decides which decoded frames are sent to the detector.
+
+    Modes:
+    - 'all': every frame
+    - 'stride': every `value`-th frame
+    - 'fps': resample to a target analysis rate of `value` frames per second
+
+    Counts of seen and analysed frames are kept so aggregates can be scaled
+    back to what a full-rate run would have produced.
+    """
+
+    def __init__(self, mode='all', value=None, source_fps=25):
+        if mode not in SAMPLING_MODES:
+            raise ValueError(f"Invalid sampling mode: {mode}. Must be one of: {', '.join(SAMPLING_MODES)}")
+        self.mode = mode
+        self.source_fps = float(source_fps) if source_fps and source_fps > 0 else 25.0
+        self.value = None
+        self.frames_seen = 0
+        self.frames_analyzed = 0
+
+        if mode != 'all':
+            try:
+                self.value = float(value)
+            except (TypeError, ValueError):
+                raise ValueError(f"Sampling mode '{mode}' requires a numeric value")
+            if self.value <= 0:
+                raise ValueError("Sampling value must be greater than 0")
+
+        if mode == 'stride':
+            self.stride = max(1, int(self.value))
+
+    def should_analyze(self, index):
+        if self.mode == 'stride':
+            return index % self.stride == 0
+        if self.mode == 'fps':
+            if self.value >= self.source_fps or index == 0:
+                return True
+            ratio = self.value / self.source_fps
+            return int(index * ratio) != int((index - 1) * ratio)
+        return True
+
+    @property
+    def effective_fps(self):
+        """Frame rate of the analysed (and written) frames."""
+        if self.mode == 'stride':
+            return self.source_fps / self.stride
+        if self.mode == 'fps':
+            return min(self.value, self.source_fps)
+        return self.source_fps
+
+    def scale_factor(self):
+        """Multiplier that makes sums over analysed frames comparable to full-rate sums."""
+        if self.frames_analyzed == 0:
+            return 1.0
+        return self.frames_seen / self.frames_analyzed
+
+
+class FrameScaler:
+    """
+    The size frames of a `width` x `height` video are worked on at: frames
+    taller than `max_height` are shrunk (keeping the aspect ratio, even
+    dimensions) once, right after decoding; smaller ones are left alone.
+    None keeps the source size.
+    """
+
+    def __init__(self, width, height, max_height=None):
+        self.source_size = (width, height)
+        if max_height and height > max_height:
+            scale = max_height / height
+            self.size = (max(2, int(round(width * scale / 2)) * 2), max(2, int(round(max_height / 2)) * 2))
+        else:
+            self.size = (width, height)
+
+    @property
+    def active(self):
+        return self.size != self.source_size
+
+    def __call__(self, frame):
+        if frame.shape[1::-1] == self.size:
+            return frame
+        # INTER_AREA averages the dropped pixels instead of aliasing them
+        return cv2.resize(frame, self.size, interpolation=cv2.INTER_AREA)
+
+    def rescale(self, frame, scaled_frame, other):
+        """
+        This scaler's version of a frame that `other` already scaled to
+        `scaled_frame`, resized from whichever of the two is cheaper.
+        """
+        if other.size == self.size:
+            return scaled_frame
+        if other.size[1] >= self.size[1]:
+            return cv2.resize(scaled_frame, self.size, interpolation=cv2.INTER_AREA)
+        return self(frame)
+
+    def boxes_from(self, xyxy, other):
+        """Maps xyxy boxes from `other`'s frame size into this scaler's."""
+        if other.size == self.size or len(xyxy) == 0:
+            return xyxy
+        factors = np.array([self.size[0] / other.size[0], self.size[1] / other.size[1]] * 2, dtype=np.float32)
+        return xyxy * factors
+
+
+class PyAVCapture:
+    """
+    Stand-in for cv2.VideoCapture (isOpened/read/grab/get/release) that
+    decodes with PyAV, whose decoder runs on several threads (frame and
+    slice threading) instead of OpenCV's single one. `threads` caps the
+    decoder threads; None lets FFmpeg choose.
+    """
+
+    def __init__(self, path, threads=None):
+        import av
+        self.container = None
+        try:
+            self.container = av.open(path)
+            self.stream = self.container.streams.video[0]
+        except Exception as e:
+            print(f"[ERROR] PyAV cannot open {path}: {e}")
+            if self.container is not None:
+                self.container.close()
+                self.container = None
+            return
+        self.stream.thread_type = 'AUTO'
+        if threads:
+            self.stream.codec_context.thread_count = threads
+        self.frames = self.container.decode(self.stream)
+
+    def isOpened(self):
+        return self.container is not None
+
+    def _next(self):
+        try:
+            return next(self.frames)
+        except Exception:
+            # End of stream, or a corrupt tail: stop there like OpenCV does
+            return None
+
+    def grab(self):
+        return self.container is not None and self._next() is not None
+
+    def read(self):
+        frame = self._next() if self.container is not None else None
+        if frame is None:
+            return False, None
+        return True, frame.to_ndarray(format='bgr24')
+
+    def get(self, prop):
+        if self.container is None:
+            return 0
+        if prop == cv2.CAP_PROP_FPS:
+            return float(self.stream.average_rate or 0)
+        if prop == cv2.CAP_PROP_FRAME_WIDTH:
+            return self.stream.codec_context.width
+        if prop == cv2.CAP_PROP_FRAME_HEIGHT:
+            return self.stream.codec_context.height
+        if prop == cv2.CAP_PROP_FRAME_COUNT:
+            return self.stream.frames
+        return 0
+
+    def release(self):
+        if self.container is not None:
+            self.container.close()
+            self.container = None
+
+
+def open_video(path, decoder='opencv', threads=None):
+    """
+    Opens a video for read_frame_batches with the named decoder; 'pyav'
+    falls back to OpenCV when PyAV isn't installed.
+    """
+    if decoder not in DECODERS:
+        raise ValueError(f"Invalid video decoder: {decoder}. Must be one of: {', '.join(DECODERS)}")
+    if decoder == 'pyav':
+        try:
+            return PyAVCapture(path, threads)
+        except ImportError:
+            print("[WARN] PyAV is not installed, decoding with OpenCV")
+    return cv2.VideoCapture(path)
+
+
+class ReadAhead:
+    """
+    Iterates over `iterable` (e.g. read_frame_batches) on a background
+    thread that keeps up to `depth` items ready, so decoding overlaps with
+    whatever the consumer does with the previous items. Errors raised by
+    the iterable are re-raised to the consumer. close() stops the thread;
+    call it before releasing anything the iterable reads from.
+    """
+    _end = object()
+
+    def __init__(self, iterable, depth=2, name='decode-ahead'):
+        self.queue = queue.Queue(maxsize=max(1, depth))
+        self.stopped = threading.Event()
+        self.finished = False
+        self.thread = threading.Thread(target=self._run, args=(iter(iterable),), daemon=True, name=name)
+        self.thread.start()
+
+    def _run(self, iterator):
+        try:
+            for item in iterator:
+                if not self._put((item, None)):
+                    return
+        except Exception as e:
+            self._put((None, e))
+            return
+        self._put((self._end, None))
+
+    def _put(self, entry):
+        while not self.stopped.is_set():
+            try:
+                self.queue.put(entry, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.finished:
+            raise StopIteration
+        item, error = self.queue.get()
+        if error is not None:
+            self.finished = True
+            raise error
+        if item is self._end:
+            self.finished = True
+            raise StopIteration
+        return item
+
+    def close(self):
+        self.stopped.set()
+        self.thread.join()
+
+
+def read_frame_batches(cap, batch_size, sampler=None, with_indices=False):
+    """
+    Reads frames from an opened cv2.VideoCapture and yields them in lists of
+    up to `batch_size` frames. The last batch may be shorter.
+
+    When a FrameSampler is given, frames it skips are only grabbed, not
+    decoded. With `with_indices` each batch comes as (frame_indices, frames).
+    """
+    batch_size = max(1, int(batch_size))
+    batch = []
+    indices = []
+    index = 0
+    while True:
+        if sampler is not None and not sampler.should_analyze(index):
+            if not cap.grab():
+                break
+            sampler.frames_seen += 1
+            index += 1
+            continue
+
+        ret, frame = cap.read()
+        if not ret:
+            break
+        if sampler is not None:
+            sampler.frames_seen += 1
+            sampler.frames_analyzed += 1
+        indices.append(index)
+        index += 1
+
+        batch.append(frame)
+        if len(batch) == batch_size:
+            yield (indices, batch) if with_indices else batch
+            batch = []
+            indices = []
+    if batch:
+        yield (indices, batch) if with_indices else batch
+
+
+class EncoderError(Exception):
+    pass
+
+
+class FFmpegWriter:
+    """
+    Encodes BGR frames to H.264 by piping them as raw video into a single
+    ffmpeg process. Drop-in for cv2.VideoWriter's write()/release().
+    """
+
+    def __init__(self, output_path, width, height, fps, ffmpeg_path='ffmpeg', preset='veryfast', crf=23):
+        self.output_path = output_path
+        self.log = tempfile.TemporaryFile()
+        command = [
+            ffmpeg_path, '-y', '-loglevel', 'error',
+            '-f', 'rawvideo', '-pix_fmt', 'bgr24', '-s', f'{width}x{height}', '-r', f'{fps:.3f}',
+            '-i', '-',
+            '-an', '-c:v', 'libx264', '-preset', preset, '-crf', str(crf),
+            # yuv420p needs even dimensions; browsers need yuv420p and the moov atom up front
+            '-vf', 'pad=ceil(iw/2)*2:ceil(ih/2)*2', '-pix_fmt', 'yuv420p', '-movflags', '+faststart',
+            output_path
+        ]
+        self.process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=self.log)
+
+    def _error(self):
+        self.log.seek(0)
+        return self.log.read().decode(errors='replace').strip()
+
+    def write(self, frame):
+        try:
+            self.process.stdin.write(frame.tobytes())
+        except (BrokenPipeError, OSError):
+            self.process.wait()
+            raise EncoderError(f'ffmpeg exited with code {self.process.returncode}: {self._error()}')
+
+    def release(self):
+        if self.log.closed:
+            return
+        if self.process.stdin and not self.process.stdin.closed:
+            try:
+                self.process.stdin.close()
+            except (BrokenPipeError, OSError):
+                pass
+        returncode = self.process.wait()
+        error = self._error()
+        self.log.close()
+        if returncode != 0:
+            raise EncoderError(f'ffmpeg exited with code {returncode}: {error}')
+
+    def release_quietly(self):
+        """Stops the encoder without raising, for use on error paths."""
+        if self.log.closed:
+            return
+        try:
+            if self.process.stdin and not self.process.stdin.closed:
+                self.process.stdin.close()
+        except (BrokenPipeError, OSError):
+            pass
+        if self.process.poll() is None:
+            self.process.kill()
+        self.process.wait()
+        self.log.close()
+
+
+class BackgroundWriter:
+    """
+    Hands frames to `writer` (an FFmpegWriter) on a separate thread through
+    a queue of up to `depth` frames, so piping frames into the encoder
+    overlaps with detection of the next ones. Frames must not be changed
+    after write(). Encoder errors surface on the next write() or release().
+    Time spent writing is added to `timer` as the 'encode' stage.
+    """
+    _end = object()
+
+    def __init__(self, writer, depth=8, timer=None):
+        self.writer = writer
+        self.timer = timer or NULL_TIMER
+        self.queue = queue.Queue(maxsize=max(1, depth))
+        self.error = None
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True, name='encoder')
+        self.thread.start()
+
+    def _run(self):
+        while not self.stopped.is_set():
+            try:
+                frame = self.queue.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            if frame is self._end:
+                return
+            try:
+                with self.timer.stage('encode'):
+                    self.writer.write(frame)
+            except EncoderError as e:
+                self.error = e
+                return
+
+    def _put(self, item):
+        while True:
+            if self.error is not None:
+                raise self.error
+            if not self.thread.is_alive():
+                raise EncoderError('The encoder thread has stopped')
+            try:
+                self.queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def write(self, frame):
+        self._put(frame)
+
+    def release(self):
+        """Waits for queued frames to be encoded, then finishes the file like FFmpegWriter.release()."""
+        try:
+            self._put(self._end)
+        except EncoderError:
+            pass  # raised below, or the thread already finished
+        self.thread.join()
+        if self.error is not None:
+            self.writer.release_quietly()
+            raise self.error
+        self.writer.release()
+
+    def release_quietly(self):
+        self.stopped.set()
+        self.thread.join()
+        self.writer.release_quietly()
@@ -1,27 +1,35 @@
-from rest_framework.views import APIView
-from rest_framework.response import Response
-from rest_framework.parsers import MultiPartParser, FormParser
-from django.views.decorators.csrf import csrf_exempt
-from django.utils.decorators import method_decorator
-from django.core.files.base import File
-from django.utils.timezone import now
-from .models import TrafficLog, JunctionSignals, Settings
-from .detecter import EnhancedVehicleDetector
-from django.conf import settings
-import numpy as np
-import cv2
-import os
-import tempfile
-import json
-import subprocess
+import time
+import hmac
+import asyncio
+import hashlib
 from datetime import datetime, timedelta
 from rest_framework import status
-from .EnhancedTrafficSignal import EnhancedTrafficSignal
-from rest_framework.parsers import JSONParser
+from rest_framework.views import APIView
+from rest_framework.response import Response
+from rest_framework.parsers import MultiPartParser, FormParser, JSONParser
 from rest_framework.decorators import api_view
-from .serializers import SettingsSerializer
-from .utils import letter_to_number
-import traceback
+from django.conf import settings
+from django.http import HttpResponse, StreamingHttpResponse
+from django.urls import reverse
+from django.utils.dateparse import parse_datetime
+from django.utils.decorators import method_decorator
+from django.utils.http import parse_etags, quote_etag
+from django.utils.timezone import is_naive, make_aware, now
+from django.views.decorators.csrf import csrf_exempt
+from .models import TrafficLog, JunctionSignals, ProcessingJob, SignalSource
+from .controller import plan_junction
+from .detector_pool import get_detector_pool
+from .events import format_sse, get_broker, junction_topic, publish_event
+from .geometry import load_areas, save_areas
+from .ingest import IngestError, JSONLinesParser, batch_records, ingest_records
+from .jobs import create_job, enqueue_job, run_job
+from .metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, FAILURES, render_metrics
+from .processing import ProcessingError, VALID_SIGNALS, load_area_polygons, parse_bool, parse_processing_options
+from .result_cache import store_upload
+from .rollups import GRANULARITIES, history_series
+from .services import latest_logs, signal_stats
+from .signal_state import get_signal_store
+from .utils import letter_to_number, number_to_letter
 
 @api_view(['POST', 'GET'])
 def save_area(request):
@@ -32,22 +40,14 @@ def save_area(request):
         if not signal_id or not area or len(area) != 4:
             return Response({'error': 'signal_id and 4-point area required'}, status=400)
 
-        # Path to the areas.json file
-        areas_file = os.path.join(os.path.dirname(__file__), 'areas.json')
-
         # Load existing areas
-        if os.path.exists(areas_file):
-            with open(areas_file, 'r') as f:
-                areas_data = json.load(f)
-        else:
-            areas_data = {}
+        areas_data = load_areas()
 
         # Save or update area for this signal
         areas_data[signal_id.upper()] = area
 
-        # Write back to file
-        with open(areas_file, 'w') as f:
-            json.dump(areas_data, f, indent=4)
+        # Write back to file and drop cached geometry built from the old areas
+        save_areas(areas_data)
 
         return Response({'message': f'Area for signal {signal_id} saved successfully'})
     
@@ -56,28 +56,17 @@ def save_area(request):
         if not signal_id:
             return Response({'error': 'signal_id is required'}, status=400)
 
-        # Path to the areas.json file
-        areas_file = os.path.join(os.path.dirname(__file__), 'areas.json')
-
         # Load existing areas
-        if os.path.exists(areas_file):
-            with open(areas_file, 'r') as f:
-                areas_data = json.load(f)
-                area = areas_data.get(signal_id.upper())
-                if area:
-                    return Response({'signal_id': signal_id.upper(), 'area': area})
-                else:
-                    return Response({'error': f'No area found for signal {signal_id}'}, status=404)
+        areas_data = load_areas()
+        if areas_data:
+            area = areas_data.get(signal_id.upper())
+            if area:
+                return Response({'signal_id': signal_id.upper(), 'area': area})
+            else:
+                return Response({'error': f'No area found for signal {signal_id}'}, status=404)
         else:
             return Response({'error': 'No areas have been defined yet'}, status=404)
 
-areas_path = os.path.join(os.path.dirname(__file__), 'areas.json')
-with open(areas_path, 'r') as f:
-    AREA_POLYGONS = json.load(f)
-
-# Initialize YOLO detector
-detecter = EnhancedVehicleDetector()
-
 @method_decorator(csrf_exempt, name='dispatch')
 class TrafficLogView(APIView):
     parser_classes = [MultiPartParser, FormParser, JSONParser]
@@ -85,20 +74,15 @@ class TrafficLogView(APIView):
     permission_classes = []      # Disable permission checks for this view
 
     def post(self, request):
-        print("[DEBUG] Received request data:", request.data)
-        print("[DEBUG] Received files:", request.FILES)
-        
         video_files = request.FILES.getlist('video')       
         signal_ids = request.data.getlist('signal_id') # Will be A, B, C, or D
         junction_id = request.data.get('junction_id')
         
         if not video_files:
-            print("[ERROR] No video file found in request")
-            print("[DEBUG] Available files:", list(request.FILES.keys()))
+            print(f"[ERROR] No video file found in request (files: {list(request.FILES.keys())})")
             return Response({'error': 'No video file uploaded'}, status=400)    
         if not signal_ids:   
             print("[ERROR] No signal_id found in request")
-            print("[DEBUG] Available data:", request.data)
             return Response({'error': 'Signal ID is required'}, status=400)
         if not junction_id:
             return Response({'error': 'junction_id is required'}, status=400)
@@ -109,218 +93,332 @@ class TrafficLogView(APIView):
             }, status=400)
 
         print(f"[INFO] Processing videos for signals {signal_ids} at junction {junction_id}")
-        
-         # ⬇️ Move area loading here (DYNAMIC)
-        areas_path = os.path.join(os.path.dirname(__file__), 'areas.json')
+
         try:
-            with open(areas_path, 'r') as f:
-                AREA_POLYGONS = json.load(f)
-        except Exception as e:
-            return Response({'error': f'Failed to load area definitions: {e}'}, status=500)
-        # Convert letter signal_id to number
-        response_data = []
-
-        for idx, file_obj in enumerate(video_files):
-            signal_id = signal_ids[idx]
-            if signal_id not in ['A', 'B', 'C', 'D']:
+            options = parse_processing_options(request.data)
+            area_polygons = load_area_polygons()
+        except ProcessingError as e:
+            return Response({'error': str(e)}, status=e.status)
+
+        # Validate everything before any upload is written to storage
+        for signal_id in signal_ids:
+            if signal_id not in VALID_SIGNALS:
                 return Response({
                     'error': f'Invalid signal ID: {signal_id}. Must be one of: A, B, C, D'
                 }, status=400)
+            area = area_polygons.get(signal_id)
+            if not area or len(area) != 4:
+                return Response({'error': f'Area not defined for signal {signal_id}'}, status=400)
 
-            numeric_signal_id = letter_to_number(signal_id)
-            print(f"[DEBUG] Processing video {idx + 1}/{len(video_files)} for signal {signal_id} (numeric: {numeric_signal_id})")
+        # Uploads are stored by content hash (computed by HashingUploadHandler while they streamed in),
+        # so a re-uploaded clip shares the stored file and can be answered from the result cache
+        digests = getattr(request._request, 'upload_digests', {}).get('video', [])
+        if len(digests) != len(video_files):
+            digests = [None] * len(video_files)
 
-            # Save uploaded video temporarily
-            temp_input = tempfile.NamedTemporaryFile(delete=False, suffix='.mp4')
-            for chunk in file_obj.chunks():
-                temp_input.write(chunk)
-            temp_input.close()
-            print(f"[DEBUG] Saved temporary input file to {temp_input.name}")
+        # The area is snapshotted into the job so a redraw mid-queue doesn't change its results
+        inputs = []
+        for signal_id, file_obj, digest in zip(signal_ids, video_files, digests):
+            started = time.perf_counter()
+            try:
+                stored_name, digest = store_upload(file_obj, digest)
+            except OSError as e:
+                FAILURES.inc(stage='upload_write')
+                return Response({'error': f'Could not store the upload: {e}'}, status=500)
+            inputs.append({'signal_id': signal_id, 'video': stored_name, 'area': area_polygons[signal_id],
+                           'content_hash': digest, 'upload_seconds': round(time.perf_counter() - started, 4)})
 
-            cap = cv2.VideoCapture(temp_input.name)
-            if not cap.isOpened():
-                return Response({'error': 'Cannot open video'}, status=400)
+        job = create_job(junction_id, inputs, options)
+        return dispatch_job(job, request)
 
-            # Output video settings
-            fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-            fps = cap.get(cv2.CAP_PROP_FPS) or 25
-            width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-            height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
 
-            temp_output_path = os.path.join(tempfile.gettempdir(), f'processed_output_{signal_id}.mp4')
-            out = cv2.VideoWriter(temp_output_path, fourcc, fps, (width, height))
+@method_decorator(csrf_exempt, name='dispatch')
+class IngestView(APIView):
+    """
+    Bulk ingestion of per-interval count records from edge devices that run
+    detection themselves. Accepts JSON with a `records` list or a columnar
+    `columns` object, or JSON lines (application/x-ndjson) with device_id and
+    junction_id as query parameters. When INGEST_DEVICE_TOKENS is set, the
+    device's token must be sent in the X-Device-Token header.
+    """
+    parser_classes = [JSONParser, JSONLinesParser]
+    authentication_classes = []  # Devices authenticate with INGEST_DEVICE_TOKENS
+    permission_classes = []
 
-            # Get the appropriate area for this signal
-            area_index = ord(signal_id) - ord('A')  # Convert A->0, B->1, etc.
-            area = AREA_POLYGONS.get(signal_id)
-            if not area or len(area) != 4:
-                return Response({'error': f'Area not defined for signal {signal_id}'}, status=400)
-            
-            # ---- RESCALE COORDINATES TO MATCH VIDEO SIZE ----
-            CANVAS_WIDTH = 640   # frontend canvas width
-            CANVAS_HEIGHT = 360  # frontend canvas height
+    def post(self, request):
+        data = request.data
+        if not isinstance(data, dict):
+            return Response({'error': 'Payload must be a JSON object'}, status=400)
+        device_id = data.get('device_id') or request.query_params.get('device_id')
+        junction_id = data.get('junction_id') or request.query_params.get('junction_id')
+        if not device_id:
+            return Response({'error': 'device_id is required'}, status=400)
+        if not junction_id:
+            return Response({'error': 'junction_id is required'}, status=400)
 
-            def scale_points(points, actual_width, actual_height):
-                return [
-                    [int(p[0] * actual_width / CANVAS_WIDTH), int(p[1] * actual_height / CANVAS_HEIGHT)]
-                    for p in points
-                ]
+        tokens = getattr(settings, 'INGEST_DEVICE_TOKENS', {})
+        if tokens:
+            expected = tokens.get(device_id)
+            provided = request.headers.get('X-Device-Token', '')
+            if expected is None or not hmac.compare_digest(expected, provided):
+                return Response({'error': 'Invalid device token'}, status=status.HTTP_403_FORBIDDEN)
 
-            scaled_area = scale_points(area, width, height)
+        if not JunctionSignals.objects.filter(id=junction_id).exists():
+            return Response({'error': f'No junction found with id {junction_id}'}, status=404)
 
+        try:
+            records = batch_records(data)
+            max_records = getattr(settings, 'INGEST_MAX_RECORDS', 5000)
+            if len(records) > max_records:
+                raise IngestError(f'Too many records in one batch (max {max_records})')
+            created, duplicates = ingest_records(device_id, junction_id, records)
+        except IngestError as e:
+            return Response({'error': str(e), 'records': e.errors}, status=400)
 
-            # Tracking
-            total_vehicle_count = 0
-            total_weight = 0.0
-            vehicle_type_counts = {v: 0 for v in detecter.vehicle_classes}
+        return Response({
+            'accepted': len(created),
+            'duplicates': duplicates,
+            'last_sequence': max((log.sequence for log in created), default=None),
+        }, status=status.HTTP_201_CREATED if created else status.HTTP_200_OK)
+
+
+def dispatch_job(job, request):
+    """
+    Queues the job and answers 202 with its id, or, when the request sends
+    async=false, processes it inside the request and returns the results.
+    """
+    if parse_bool(request.data.get('async'), getattr(settings, 'VIDEO_UPLOAD_ASYNC', True)):
+        enqueue_job(job)
+        return Response({
+            'job_id': str(job.id),
+            'status': job.status,
+            'status_url': request.build_absolute_uri(reverse('job_status', args=[job.id]))
+        }, status=status.HTTP_202_ACCEPTED)
 
-            while True:
-                ret, frame = cap.read()
-                if not ret:
-                    break
+    # Synchronous mode: process inside the request like before
+    try:
+        job = run_job(job.id, raise_errors=True)
+    except ProcessingError as e:
+        return Response({'error': str(e)}, status=e.status)
+    except Exception as e:
+        return Response({'error': str(e)}, status=500)
 
-                vc, wt, processed_frame, type_counts = detecter.detect_vehicles_in_area(frame, scaled_area)
-                total_vehicle_count += vc
-                total_weight += wt
-                for vt, count in type_counts.items():
-                    vehicle_type_counts[vt] += count
+    return Response(job_results(job, request), status=200)
 
-                out.write(processed_frame)
 
-            cap.release()
-            out.release()
+@api_view(['POST'])
+def render_log_video(request, log_id):
+    """
+    Renders the annotated video for a log that was analysed in stats-only
+    mode (or re-renders an existing one) from its stored upload.
+    """
+    try:
+        log = TrafficLog.objects.get(id=log_id)
+    except TrafficLog.DoesNotExist:
+        return Response({'error': f'No traffic log found with id {log_id}'}, status=404)
+    if not log.videos:
+        return Response({'error': 'The original video for this log is not available'}, status=404)
+
+    try:
+        options = parse_processing_options(request.data)
+    except ProcessingError as e:
+        return Response({'error': str(e)}, status=e.status)
+    options['stats_only'] = False
+
+    job = create_job(log.junction_id, [{
+        'signal_id': number_to_letter(log.signal_id),
+        'log_id': log.id,
+        'video': log.videos.name,
+    }], options, kind=ProcessingJob.KIND_RENDER)
+    return dispatch_job(job, request)
+
+
+def job_results(job, request):
+    """A job's per-video results; stage timings only when the upload asked for them (timings=true)."""
+    show_timings = (job.options or {}).get('timings', False)
+    results = []
+    for item in job.result or []:
+        item = dict(item)
+        if not show_timings:
+            item.pop('timings', None)
+        if item.get('video_url'):
+            item['video_url'] = request.build_absolute_uri(item['video_url'])
+        results.append(item)
+    return results
 
-            # Convert processed video to browser-friendly format using ffmpeg
-            ffmpeg_path = r'C:\Users\anime\Downloads\ffmpeg-2025-06-11-git-f019dd69f0-essentials_build\ffmpeg-2025-06-11-git-f019dd69f0-essentials_build\bin\ffmpeg.exe'
-            browser_friendly_path = temp_output_path.replace('.mp4', '_browser.mp4')
-            try:
-                subprocess.run([
-                    ffmpeg_path, '-y', '-i', temp_output_path,
-                    '-vcodec', 'libx264', '-acodec', 'aac', browser_friendly_path
-                ], check=True)
-            except Exception as e:
-                return Response({'error': f'ffmpeg conversion failed: {e}'}, status=500)
-
-            # Save processed video to model
-            with open(browser_friendly_path, 'rb') as f:
-                django_file = File(f, name=f'processed_video_{signal_id}.mp4')
-                log = TrafficLog.objects.create(
-                    junction_id=junction_id,
-                    videos=file_obj,
-                    processed_videos=django_file,
-                    signal_id=numeric_signal_id,  # Use numeric ID for database
-                    vehicle_count=total_vehicle_count,
-                    traffic_weight=total_weight,
-                    green_time=10,
-                    efficiency_score=round(total_vehicle_count / max(total_weight, 1.0) * 10, 2),
-                    Car=vehicle_type_counts.get('car', 0),
-                    Truck=vehicle_type_counts.get('truck', 0),
-                    Bus=vehicle_type_counts.get('bus', 0),
-                    Motorcycle=vehicle_type_counts.get('motorcycle', 0),
-                    Bicycle=vehicle_type_counts.get('bicycle', 0),
-                    timestamp=now()
-                )
-                
-                # Ensure the file is properly saved
-                if not os.path.exists(log.processed_videos.path):
-                    return Response({'error': 'Failed to save processed video'}, status=500)
-
-            # Clean up temporary files
-            try:
-                os.unlink(temp_input.name)
-                os.unlink(temp_output_path)
-                os.unlink(browser_friendly_path)
-            except Exception as e:
-                print(f"Warning: Failed to clean up temporary files: {e}")
-
-            response_data.append({
-                'message': f'Video for signal {signal_id} processed',
-                'signal_id': signal_id,
-                'vehicle_count': total_vehicle_count,
-                'video_url': request.build_absolute_uri(log.processed_videos.url)
-            })
-        print(f"[DEBUG] Response data: {response_data}")
-        return Response(response_data, status=200)
 
 @api_view(['GET'])
-def latest_stats(request):
-    junction_id = request.GET.get('junction_id')
-    signal_ids = request.GET.getlist('signal_id')
+def job_status(request, job_id):
+    try:
+        job = ProcessingJob.objects.get(id=job_id)
+    except ProcessingJob.DoesNotExist:
+        return Response({'error': f'No job found with id {job_id}'}, status=404)
 
-    # If no signal_ids are provided, return all signals
-    if not signal_ids:
-        signal_ids = ['A', 'B', 'C', 'D']
+    return Response({
+        'job_id': str(job.id),
+        'junction_id': job.junction_id,
+        'status': job.status,
+        'progress': job.progress,
+        'signals': [item['signal_id'] for item in job.inputs],
+        'results': job_results(job, request),
+        'error': job.error,
+        'created_at': job.created_at,
+        'started_at': job.started_at,
+        'finished_at': job.finished_at,
+    })
 
+def stats_payload(signal_letters, logs, request):
+    """Per-signal stats plus junction totals, as returned by latest_stats and junction_snapshot."""
     signals = []
     total_vehicle_count = 0
     total_weight = 0.0
     total_efficiency = 0.0
     count = 0
-
-    # Convert signal letters to numbers
-    signal_id_map = {letter: ord(letter.upper()) - ord('A') + 1 for letter in ['A', 'B', 'C', 'D']}
-
-    for signal_letter in signal_ids:
-        numeric_signal_id = signal_id_map.get(signal_letter.upper())
-        try:
-            if junction_id:
-                log = TrafficLog.objects.filter(
-                    junction_id=junction_id,
-                    signal_id=numeric_signal_id
-                ).latest('timestamp')
-            else:
-                log = TrafficLog.objects.filter(
-                    signal_id=numeric_signal_id
-                ).latest('timestamp')
-
-            video_url = request.build_absolute_uri(log.processed_videos.url) if log.processed_videos else ''
-            signals.append({
-                'id': signal_letter,
-                'vehicles': log.vehicle_count,
-                'weight': log.traffic_weight,
-                'efficiency': log.efficiency_score,
-                'time': log.green_time,
-                'status': 'green',
-                'video': video_url
-            })
+    for signal_letter in signal_letters:
+        log = logs.get(letter_to_number(signal_letter))
+        signals.append(signal_stats(signal_letter, log, request))
+        if log is not None:
             total_vehicle_count += log.vehicle_count
             total_weight += log.traffic_weight
             total_efficiency += log.efficiency_score
             count += 1
-        except TrafficLog.DoesNotExist:
-            signals.append({
-                'id': signal_letter,
-                'vehicles': 0,
-                'weight': 0.0,
-                'efficiency': 0.0,
-                'time': 0,
-                'status': 'red',
-                'video': ''
-            })
 
     avg_efficiency = round(total_efficiency / count, 2) if count > 0 else 0.0
-
-    return Response({
+    return {
         'signals': signals,
         'total_vehicles': total_vehicle_count,
         'total_weight': total_weight,
         'avg_efficiency': avg_efficiency
-    })
+    }
 
 
-@api_view(['POST'])
-def save_settings(request):
+@api_view(['GET'])
+def latest_stats(request):
+    junction_id = request.GET.get('junction_id')
+    signal_ids = request.GET.getlist('signal_id')
+
+    # If no signal_ids are provided, return all signals
+    if not signal_ids:
+        signal_ids = ['A', 'B', 'C', 'D']
+    signal_ids = [signal_id.upper() for signal_id in signal_ids if signal_id.upper() in VALID_SIGNALS]
+
+    logs = latest_logs([letter_to_number(signal_id) for signal_id in signal_ids], junction_id)
+    return Response(stats_payload(signal_ids, logs, request))
+
+
+@api_view(['GET'])
+def junction_snapshot(request, junction_id):
+    """
+    Latest stats of every signal of a junction, read in one query. The
+    response carries an ETag built from the ids and update times of the
+    rows, so a poll with a matching If-None-Match gets an empty 304.
+    """
+    logs = latest_logs([letter_to_number(signal_id) for signal_id in VALID_SIGNALS], junction_id)
+
+    fingerprint = ';'.join(
+        f'{signal_id}:{log.id}:{log.last_update.isoformat()}' for signal_id, log in sorted(logs.items())
+    )
+    etag = quote_etag(hashlib.md5(f'{junction_id}|{fingerprint}'.encode()).hexdigest())
+    headers = {'ETag': etag, 'Cache-Control': 'no-cache'}
+    if etag in parse_etags(request.headers.get('If-None-Match', '')):
+        return Response(status=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    payload = stats_payload(VALID_SIGNALS, logs, request)
+    payload['junction_id'] = junction_id
+    payload['updated_at'] = max((log.last_update for log in logs.values()), default=None)
+    return Response(payload, headers=headers)
+
+
+@api_view(['GET'])
+def junction_plan(request, junction_id):
+    """
+    Next signal cycle of a junction under SIGNAL_CONTROL_POLICY, from the
+    latest log of each signal and the shared signal state.
+    """
+    if not JunctionSignals.objects.filter(id=junction_id).exists():
+        return Response({'error': f'No junction found with id {junction_id}'}, status=404)
+
+    logs = latest_logs([letter_to_number(signal_id) for signal_id in VALID_SIGNALS], junction_id)
+    plan = plan_junction(junction_id, logs)
+    plan['junction_id'] = junction_id
+    return Response(plan)
+
+
+@api_view(['GET'])
+def traffic_history(request):
+    """
+    Time-bucketed traffic of a junction's signals from the rollup tables.
+    Query parameters: junction_id (required), signal_id (repeatable,
+    default all), granularity (1m, 15m or 1h; default 15m), start and end
+    (ISO 8601; default the last 24 hours).
+    """
     try:
-        serializer = SettingsSerializer(data=request.data)
-        if serializer.is_valid():
-            serializer.save()
-            return Response(serializer.data, status=status.HTTP_201_CREATED)
-        print(serializer.errors)
-        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
-    except Exception as e:
-        print("Exception in save_settings:", e)
-        traceback.print_exc()
-        return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        junction_id = int(request.GET['junction_id'])
+    except (KeyError, ValueError):
+        return Response({'error': 'junction_id is required'}, status=400)
+    granularity = request.GET.get('granularity', '15m')
+    if granularity not in GRANULARITIES:
+        return Response({'error': f"Invalid granularity: {granularity}. Must be one of: {', '.join(GRANULARITIES)}"},
+                        status=400)
+    signal_ids = [signal_id.upper() for signal_id in request.GET.getlist('signal_id')] or VALID_SIGNALS
+    for signal_id in signal_ids:
+        if signal_id not in VALID_SIGNALS:
+            return Response({'error': f'Invalid signal ID: {signal_id}. Must be one of: A, B, C, D'}, status=400)
+
+    try:
+        end = parse_datetime(request.GET['end']) if request.GET.get('end') else now()
+        start = parse_datetime(request.GET['start']) if request.GET.get('start') else end - timedelta(days=1)
+    except ValueError:
+        start = end = None
+    if start is None or end is None:
+        return Response({'error': 'start and end must be ISO 8601 date-times'}, status=400)
+    start = make_aware(start) if is_naive(start) else start
+    end = make_aware(end) if is_naive(end) else end
+    if start >= end:
+        return Response({'error': 'start must be before end'}, status=400)
+
+    max_buckets = getattr(settings, 'HISTORY_MAX_BUCKETS', 5000)
+    if (end - start).total_seconds() / GRANULARITIES[granularity] > max_buckets:
+        return Response({'error': f'Range too long for {granularity} buckets (max {max_buckets}); '
+                                  f'use a coarser granularity'}, status=400)
+
+    return Response({
+        'junction_id': junction_id,
+        'granularity': granularity,
+        'start': start,
+        'end': end,
+        'signals': history_series(junction_id, [letter_to_number(s) for s in signal_ids], granularity, start, end),
+    })
+
+
+async def junction_events(request, junction_id):
+    """
+    Server-Sent Events stream of a junction's live updates: `traffic_log`
+    (new per-signal stats), `job` (upload progress and status) and
+    `signal_timing` events, pushed as they are published. A comment line is
+    sent every EVENT_HEARTBEAT seconds to keep proxies from closing the
+    connection. Needs an ASGI server; see asgi.py.
+    """
+    subscription = get_broker().subscribe(junction_topic(junction_id))
+    heartbeat = getattr(settings, 'EVENT_HEARTBEAT', 15)
+
+    async def stream():
+        try:
+            yield 'retry: 3000\n\n'
+            while True:
+                try:
+                    event = await subscription.get(timeout=heartbeat)
+                except asyncio.TimeoutError:
+                    yield ': keep-alive\n\n'
+                    continue
+                yield format_sse(event)
+        finally:
+            subscription.close()
+
+    response = StreamingHttpResponse(stream(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # don't let nginx buffer the stream
+    return response
 
 @method_decorator(csrf_exempt, name='dispatch')
 class AdaptiveGreenTime(APIView):
@@ -339,15 +437,43 @@ class AdaptiveGreenTime(APIView):
         traffic_weight = log.traffic_weight
         time_of_day = log.timestamp or datetime.now()
 
-        # Create and calculate
-        signal = EnhancedTrafficSignal(signal_id)
-        green_time = signal.calculate_adaptive_green_time(vehicle_count, traffic_weight, time_of_day)
+        # Shared signal state keeps the history between requests; a log is only added to it once
+        def calculate(signals):
+            signal = signals[number_to_letter(log.signal_id)]
+            if signal.last_log_id == log.id:
+                return signal.calculated_green_time
+            signal.last_log_id = log.id
+            return signal.calculate_adaptive_green_time(vehicle_count, traffic_weight, time_of_day)
+
+        green_time = get_signal_store().update(log.junction_id, [number_to_letter(log.signal_id)], calculate)
+        publish_event(log.junction_id, 'signal_timing', {
+            'signal_id': number_to_letter(log.signal_id),
+            'green_time': green_time,
+        })
 
         return Response({
             "signal_id": signal_id,
             "calculated_green_time": green_time
         }, status=status.HTTP_200_OK)
 
+@api_view(['GET'])
+def readiness(request):
+    """
+    Readiness probe for load balancers and autoscalers: 503 while the
+    detector pool is warming up or failed to load, 200 otherwise.
+    """
+    pool_status = get_detector_pool().status()
+    return Response({'detector': pool_status}, status=200 if pool_status['ready'] else 503)
+
+
+def metrics(request):
+    """
+    Prometheus metrics of this process: per-stage pipeline timings and
+    frame, detection, failure and job counters.
+    """
+    return HttpResponse(render_metrics(), content_type=METRICS_CONTENT_TYPE)
+
+
 @api_view(['GET', 'POST'])
 def junctions_list(request):
     if request.method == 'GET':
@@ -359,3 +485,32 @@ def junctions_list(request):
             return Response({'error': 'Name is required'}, status=400)
         junction, created = JunctionSignals.objects.get_or_create(name=name)
         return Response({'id': junction.id, 'name': junction.name}, status=201 if created else 200)
+
+
+@api_view(['GET', 'POST'])
+def signal_sources(request, junction_id):
+    """
+    Live stream sources of a junction's signals, ingested by
+    `manage.py ingest_streams --junction <id>`.
+    """
+    try:
+        junction = JunctionSignals.objects.get(id=junction_id)
+    except JunctionSignals.DoesNotExist:
+        return Response({'error': f'No junction found with id {junction_id}'}, status=404)
+
+    if request.method == 'POST':
+        signal_id = str(request.data.get('signal_id') or '').upper()
+        source = request.data.get('source')
+        if signal_id not in VALID_SIGNALS:
+            return Response({'error': f'Invalid signal ID: {signal_id}. Must be one of: A, B, C, D'}, status=400)
+        if not source:
+            return Response({'error': 'source is required'}, status=400)
+        SignalSource.objects.update_or_create(
+            junction=junction, signal_id=letter_to_number(signal_id),
+            defaults={'source': source, 'enabled': parse_bool(request.data.get('enabled'), True)}
+        )
+
+    return Response([
+        {'signal_id': number_to_letter(item.signal_id), 'source': item.source, 'enabled': item.enabled}
+        for item in junction.sources.order_by('signal_id')
+    ])
@@ -0,0 +1,110 @@
+import os
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_EXCEPTION
+from django.conf import settings
+
+_pool = None
+_progress = None
+_manager = None
+_pool_lock = threading.Lock()
+
+
+def signal_worker_count():
+    return int(getattr(settings, 'SIGNAL_WORKER_PROCESSES', 4) or 0)
+
+
+def torch_threads_per_worker():
+    """
+    Intra-op threads each worker's torch may use. Defaults to an even share
+    of the machine's cores so parallel workers don't oversubscribe the CPU.
+    """
+    configured = getattr(settings, 'SIGNAL_WORKER_TORCH_THREADS', None)
+    if configured:
+        return int(configured)
+    return max(1, (os.cpu_count() or 1) // max(signal_worker_count(), 1))
+
+
+def _init_worker(torch_threads):
+    import django
+    django.setup()
+
+    import cv2
+    cv2.setNumThreads(torch_threads)
+    try:
+        import torch
+        torch.set_num_threads(torch_threads)
+    except ImportError:
+        pass
+
+
+def get_signal_pool():
+    """
+    Lazily starts the per-signal process pool. Workers live for the whole
+    server process, so each keeps its detector and loaded model between jobs.
+    """
+    global _pool, _progress, _manager
+    with _pool_lock:
+        if _pool is None:
+            context = multiprocessing.get_context('spawn')
+            _manager = context.Manager()
+            _progress = _manager.dict()
+            _pool = ProcessPoolExecutor(
+                max_workers=signal_worker_count(),
+                mp_context=context,
+                initializer=_init_worker,
+                initargs=(torch_threads_per_worker(),)
+            )
+    return _pool, _progress
+
+
+def _process_signal_task(progress, progress_key, video_name, signal_id, junction_id, area, options,
+                         content_hash=None, job_id=None):
+    from .processing import process_signal_video
+
+    def report(frames_done):
+        progress[progress_key] = frames_done
+
+    return process_signal_video(video_name, signal_id, junction_id, area, options,
+                                progress_callback=report, content_hash=content_hash, job_id=job_id)
+
+
+def process_signals_in_pool(job, reporter, results, poll_interval=1.0):
+    """
+    Processes every input of a job on its own worker process and appends
+    their results to `results` in input order. If a worker fails, the
+    results of the signals that did finish are still appended, and the
+    first error is raised after all workers have stopped.
+    """
+    pool, progress = get_signal_pool()
+    keys = [f'{job.id}:{index}' for index in range(len(job.inputs))]
+    futures = [
+        pool.submit(_process_signal_task, progress, key, item['video'], item['signal_id'],
+                    job.junction_id, item['area'], job.options, item.get('content_hash'), job.id)
+        for key, item in zip(keys, job.inputs)
+    ]
+
+    try:
+        pending = futures
+        while pending:
+            done, pending = wait(pending, timeout=poll_interval, return_when=FIRST_EXCEPTION)
+            if any(future.cancelled() or future.exception() for future in done):
+                # Let running siblings finish so their rows and files aren't half-written
+                wait(pending)
+                break
+            reporter.report(sum(progress.get(key, 0) for key in keys))
+    finally:
+        for key in keys:
+            progress.pop(key, None)
+
+    error = None
+    for future, item in zip(futures, job.inputs):
+        if future.cancelled():
+            error = error or RuntimeError(f"Processing of signal {item['signal_id']} was cancelled")
+        elif future.exception() is not None:
+            error = error or future.exception()
+        else:
+            results.append(future.result())
+    if error is not None:
+        raise error
+    return results
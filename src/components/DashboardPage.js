@@ -43,21 +43,18 @@ const DashboardPage = ({ navigate, junction }) => {
     if (!junction) return;
     const fetchLatestStats = async () => {
       try {
-        const statsPromises = ['A', 'B', 'C', 'D'].map(async (signalId) => {
-          const response = await fetch(`/api/latest-stats/?junction_id=${junction}&signal_id=${signalId}`);
-          if (!response.ok) {
-            throw new Error(`Failed to fetch stats for signal ${signalId}`);
-          }
-          return response.json();
-        });
+        // One request for all signals; 'no-cache' revalidates with the stored
+        // ETag, so an unchanged snapshot comes back as an empty 304
+        const response = await fetch(`/api/junctions/${junction}/snapshot/`, { cache: 'no-cache' });
+        if (!response.ok) {
+          throw new Error(`Failed to fetch stats for junction ${junction}`);
+        }
+        const snapshot = await response.json();
 
-        const results = await Promise.all(statsPromises);
-        
         // Update signals state with latest data
         setSignals(prevSignals => prevSignals.map(signal => {
-          const result = results.find(r => r.signals[0]?.id === signal.id);
-          if (result?.signals[0]) {
-            const data = result.signals[0];
+          const data = snapshot.signals.find(s => s.id === signal.id);
+          if (data) {
             return {
               ...signal,
               vehicles: data.vehicles,
@@ -73,20 +70,19 @@ const DashboardPage = ({ navigate, junction }) => {
         // Update video sources with processed video URLs
         setVideoSources(prev => {
           const newSources = { ...prev };
-          results.forEach(result => {
-            if (result.signals[0]?.video) {
-              newSources[result.signals[0].id] = result.signals[0].video;
+          snapshot.signals.forEach(data => {
+            if (data.video) {
+              newSources[data.id] = data.video;
             }
           });
           return newSources;
         });
 
         // Update system data
-        const totalVehicles = results.reduce((sum, r) => sum + (r.signals[0]?.vehicles || 0), 0);
-        const totalEfficiency = results.reduce((sum, r) => sum + (r.signals[0]?.efficiency || 0), 0);
+        const totalEfficiency = snapshot.signals.reduce((sum, s) => sum + (s.efficiency || 0), 0);
         setSystemData(prev => ({
           ...prev,
-          totalVehicles,
+          totalVehicles: snapshot.total_vehicles,
           systemEfficiency: totalEfficiency / 4 // Average efficiency
         }));
 
@@ -96,11 +92,28 @@ const DashboardPage = ({ navigate, junction }) => {
       }
     };
 
-    // Fetch immediately and then every 5 seconds
+    // Fetch immediately, then refresh whenever the server pushes a new log.
+    // Polling every 5 seconds only runs while the event stream is down.
     fetchLatestStats();
-    const interval = setInterval(fetchLatestStats, 5000);
+    let streamOpen = false;
+    const events = new EventSource(`/api/junctions/${junction}/events/`);
+    events.onopen = () => { streamOpen = true; };
+    events.onerror = () => { streamOpen = false; };
+    events.addEventListener('traffic_log', fetchLatestStats);
+    events.addEventListener('job', (event) => {
+      const { data } = JSON.parse(event.data);
+      if (data.status === 'completed' || data.status === 'failed') {
+        setLogs(prev => [...prev, `[INFO] Processing job ${data.job_id} ${data.status}`]);
+      }
+    });
+    const interval = setInterval(() => {
+      if (!streamOpen) fetchLatestStats();
+    }, 5000);
 
-    return () => clearInterval(interval);
+    return () => {
+      clearInterval(interval);
+      events.close();
+    };
   }, [junction]);
 
   const handleVideoConfigSave = (config) => {
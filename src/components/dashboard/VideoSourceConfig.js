@@ -40,6 +40,27 @@ const VideoSourceConfig = ({ onSave, onCancel, junctionId }) => {
     }
   };
 
+  const waitForJob = async (statusUrl) => {
+    while (true) {
+      await new Promise(resolve => setTimeout(resolve, 2000));
+      const response = await fetch(statusUrl);
+      const job = await response.json();
+      if (!response.ok) {
+        throw new Error(job.error || 'Failed to fetch job status');
+      }
+      if (job.status === 'completed') {
+        return job.results;
+      }
+      if (job.status === 'failed') {
+        throw new Error(job.error || 'Processing failed');
+      }
+      setUploadStatus({
+        status: 'uploading',
+        message: `Processing videos... ${Math.round(job.progress)}%`
+      });
+    }
+  };
+
   const handleSave = async () => {
     const selectedFiles = Object.entries(videoFiles).filter(([_, file]) => file !== null);
     if (selectedFiles.length === 0) {
@@ -84,6 +105,11 @@ const VideoSourceConfig = ({ onSave, onCancel, junctionId }) => {
         throw new Error('Invalid response format');
       }
 
+      if (response.status === 202 && data.job_id) {
+        // Processing runs in the background; poll the job until it finishes
+        data = await waitForJob(`/api/jobs/${data.job_id}/`);
+      }
+
       if (response.ok) {
         // Update video sources with processed video URLs
         const newSources = { ...videoSources };
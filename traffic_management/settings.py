@@ -18,6 +18,147 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Video analysis
+# Number of frames sent to the detector in one model call
+DETECTION_BATCH_SIZE = 8
+# Run inference only on the detection area's bounding box plus a padding margin
+DETECTION_ROI_CROP = False
+DETECTION_ROI_PADDING = 32
+# Model input size, optionally per signal, e.g. {'B': 960} for a far-away lane
+DETECTION_IMGSZ = 640
+DETECTION_IMGSZ_PER_SIGNAL = {}
+# Frames taller than this are shrunk once after decoding; detection areas are
+# scaled to the smaller size. None (or 0 per upload) analyzes at the source size.
+# A limit such as 720 speeds up 1080p/4K uploads but can change their counts.
+VIDEO_ANALYSIS_HEIGHT = None
+# Height of rendered clips; None renders at the analysis size.
+VIDEO_OUTPUT_HEIGHT = None
+# Detector instances (loaded models) kept per process and shared by its threads;
+# None uses JOB_WORKERS. The model is loaded on first use unless warmed up.
+DETECTOR_POOL_SIZE = None
+# Load and run the model once at startup: None does it in server and worker
+# processes that detect in-process (not in migrate, shell, etc.), True/False forces it
+DETECTOR_WARMUP = None
+DETECTOR_WARMUP_INSTANCES = 1
+# Inference backend: 'torch' (ultralytics/PyTorch) or 'onnx' (ONNX Runtime, CPU);
+# 'stub' returns fake boxes without a model, for benchmarks; 'scene' reads the
+# true boxes back from `manage.py synthetic_video` clips, for load tests.
+# Create the ONNX model with `manage.py export_detector` (optionally --int8).
+# DETECTOR_MODEL_PATH = None uses yolov8n.pt / yolov8n.onnx.
+DETECTOR_BACKEND = 'torch'
+DETECTOR_MODEL_PATH = None
+# ONNX Runtime execution providers, e.g. ['OpenVINOExecutionProvider', 'CPUExecutionProvider']
+# with onnxruntime-openvino, and intra-op threads per model (None: all cores)
+DETECTOR_ONNX_PROVIDERS = ['CPUExecutionProvider']
+DETECTOR_ONNX_THREADS = None
+# Processed clips are piped straight into one H.264 encoder.
+# FFMPEG_PATH = None uses the ffmpeg binary found on PATH.
+FFMPEG_PATH = None
+VIDEO_ENCODER_PRESET = 'veryfast'
+VIDEO_ENCODER_CRF = 23
+# Decoding runs this many frame batches ahead on a separate thread, and annotated
+# frames are handed to ffmpeg from another thread through a queue of
+# VIDEO_ENCODE_QUEUE frames; 0 does either inline.
+VIDEO_DECODE_AHEAD = 2
+VIDEO_ENCODE_QUEUE = 8
+# 'opencv', or 'pyav' (pip install av) for multi-threaded decoding of H.264/HEVC;
+# VIDEO_DECODER_THREADS = None lets FFmpeg pick the thread count.
+VIDEO_DECODER = 'opencv'
+VIDEO_DECODER_THREADS = None
+# Frame sampling: 'all', 'stride' (every Nth frame) or 'fps' (target analysis
+# fps). Can be overridden per upload.
+VIDEO_SAMPLING_MODE = 'all'
+VIDEO_SAMPLING_VALUE = None
+# Analytics-only uploads: skip drawing and encoding. The processed video can be
+# rendered later via /api/logs/<id>/render/. Can be overridden per upload.
+VIDEO_STATS_ONLY = False
+# 'tracked' counts each vehicle once by following it across frames; 'frames' sums
+# per-frame detections. Can be overridden per upload with counting_mode.
+VEHICLE_COUNTING_MODE = 'tracked'
+# Minimum IoU to continue a track, and center distance (in track box diagonals)
+# used as a fallback when frames are sampled sparsely
+TRACKER_IOU_THRESHOLD = 0.3
+TRACKER_DISTANCE_THRESHOLD = 1.0
+# Missed frames after which a track is only continued by IoU, not by distance
+TRACKER_DISTANCE_MAX_MISSES = 1
+# Seconds a track survives without a matching detection
+TRACKER_MAX_AGE = 1.0
+# Observations needed before a track is counted as a vehicle
+TRACKER_MIN_HITS = 2
+
+# Background processing of uploads
+# Uploads return a job id at once unless the request sends async=false
+VIDEO_UPLOAD_ASYNC = True
+# Worker threads started inside the web process. Set JOB_RUN_IN_PROCESS = False
+# to leave jobs queued for separate `manage.py run_jobs` workers instead.
+JOB_WORKERS = 2
+JOB_RUN_IN_PROCESS = True
+# `run_jobs` (or the web process, with JOB_RUN_IN_PROCESS) requeues running jobs
+# whose row hasn't been updated for this many seconds (their worker died); keep
+# it well above the slowest single video step.
+JOB_STALE_SECONDS = 600
+# Videos of one upload are processed in parallel, one worker process per signal,
+# each with its own detector. 0 or 1 processes them one after another.
+SIGNAL_WORKER_PROCESSES = 4
+# Torch threads per worker; None splits the CPU cores evenly between workers
+SIGNAL_WORKER_TORCH_THREADS = None
+
+# Result cache
+# Uploads are hashed while they stream in and stored once per content. Analyses
+# are cached by (content, area, options, model, thresholds); a re-upload reuses
+# the result and the processed clip. Least recently used entries are dropped
+# when the cached clips exceed RESULT_CACHE_MAX_BYTES.
+FILE_UPLOAD_HANDLERS = [
+    'application.result_cache.HashingUploadHandler',
+    'django.core.files.uploadhandler.MemoryFileUploadHandler',
+    'django.core.files.uploadhandler.TemporaryFileUploadHandler',
+]
+RESULT_CACHE_ENABLED = True
+RESULT_CACHE_MAX_BYTES = 2 * 1024 ** 3
+
+# Live stream ingestion (`manage.py ingest_streams`)
+# Seconds of detections aggregated into each TrafficLog row
+STREAM_AGGREGATE_INTERVAL = 5.0
+# Frames buffered per stream; older frames are dropped when detection falls behind
+STREAM_QUEUE_SIZE = 2
+
+# Edge device ingestion (/api/ingest/)
+# {'device-id': 'token'}; when set, devices must send their token in X-Device-Token
+INGEST_DEVICE_TOKENS = {}
+INGEST_MAX_RECORDS = 5000
+
+# Traffic history rollups (1m/15m/1h buckets, see `manage.py compact_rollups`)
+# Days each granularity is kept; None keeps it forever
+ROLLUP_RETENTION_DAYS = {'1m': 7, '15m': 90, '1h': None}
+# Largest number of buckets per signal one /api/history/ request may ask for
+HISTORY_MAX_BUCKETS = 5000
+
+# Live dashboard updates (Server-Sent Events at /api/junctions/<id>/events/)
+# InProcessBroker only sees events published by the web process itself. Use
+# 'application.events.DatabaseBroker' when run_jobs workers, ingest_streams or
+# several web processes publish events.
+EVENT_BROKER = 'application.events.InProcessBroker'
+# DatabaseBroker: seconds between polls and how long relayed events are kept
+EVENT_POLL_INTERVAL = 0.5
+EVENT_RETENTION = 300
+# Ids below the newest delivered event that each poll reads again, for events
+# whose transaction committed after later ones
+EVENT_POLL_OVERLAP = 100
+# Seconds between keep-alive comments on idle streams
+EVENT_HEARTBEAT = 15
+
+# Signal cycle control (/api/junctions/<id>/plan/ and manage.py simulate_junction)
+# Policy: 'adaptive' (EnhancedTrafficSignal with history), 'proportional'
+# (green split by traffic weight) or 'fixed'
+SIGNAL_CONTROL_POLICY = 'adaptive'
+# Longest cycle in seconds; greens above min green are shortened to fit
+SIGNAL_MAX_CYCLE = 120
+# Vehicles per second one approach discharges on green (simulation only)
+SIGNAL_SATURATION_FLOW = 0.5
+# Seconds a process may serve signal state from its cache before re-reading
+# the shared SignalState rows (timing limits come from application/config.json)
+SIGNAL_STATE_TTL = 1.0
+
 
 
 # Quick-start development settings - unsuitable for production